@@ -5,6 +5,12 @@ import numpy as np
 import albumentations as A
 import json
 import base64
+from functools import partial
+
+from aug_manifest import TMP_SUFFIX
+from aug_pipeline import AugmentationPipeline, encode_image, image_data_modes, list_image_paths
+from overlay_bank import OverlayBank
+from photometric_lut import apply_lut, compose_lut, gamma_lut, invert_lut, rgb_shift_lut
 
 # 定义数据增强操作
 def add_noise():
@@ -127,6 +133,27 @@ operations = [
     ("水平翻转", to_HorizontalFlip())
 ]
 
+# 翻转操作与标注翻转类型的对应关系
+flip_operations = {
+    "垂直翻转": 'vertical',
+    "水平翻转": 'horizontal',
+}
+
+# 可以用查找表实现的逐像素操作：操作名称 -> 生成随机查找表的函数（参数与上面的定义一致）
+# 单次流程中连续的这类操作会合并为一个查找表，只用一次 cv2.LUT 处理整张图像
+lut_operations = {
+    "改变曝光度": partial(gamma_lut, gamma_limit=(90, 110)),
+    "改变颜色": partial(rgb_shift_lut, r_shift_limit=(-20, 20), g_shift_limit=(-20, 20), b_shift_limit=(-20, 20)),
+    "反转图像颜色": invert_lut,
+}
+
+# 使用预渲染图层实现的效果：操作名称 -> 图层库
+# 单次流程中随机选择一张缓存的图层叠加到图像上，代替逐张渲染雨滴和光斑
+overlay_operations = {
+    "添加下雨效果": OverlayBank('rain', add_rain_effect(), brightness=0.8, blur_value=3),
+    "模拟夕阳效果": OverlayBank('sun_flare', simulate_sunset()),
+}
+
 def read_json(json_path):
     """
     读取JSON标注文件。
@@ -167,20 +194,15 @@ def flip_bounding_box(points, image_width, image_height, flip_type):
     else:
         return points  # 无需翻转
 
-def update_annotation(json_path, image_shape, flip_type):
+def flip_annotation_data(data, image_shape, flip_type):
     """
-    更新标注文件中的检测框坐标。
+    在内存中的标注数据上调整检测框坐标（不读写文件）。
 
     参数：
-    - json_path: JSON标注文件路径
+    - data: 已读取的标注数据字典
     - image_shape: (高度, 宽度, 通道数)
     - flip_type: 'vertical' 或 'horizontal'
     """
-    if not os.path.exists(json_path):
-        print(f"警告：标注文件 {json_path} 不存在，已跳过。")
-        return
-
-    data = read_json(json_path)
     image_height, image_width = data.get('imageHeight'), data.get('imageWidth')
     if image_height is None or image_width is None:
         # 如果JSON文件中没有imageHeight或imageWidth，则从图像形状中获取
@@ -196,7 +218,23 @@ def update_annotation(json_path, image_shape, flip_type):
             x_min, x_max = min(x_coords), max(x_coords)
             y_min, y_max = min(y_coords), max(y_coords)
             shape['points'] = [[x_min, y_min], [x_max, y_max]]
+    return data
+
+def update_annotation(json_path, image_shape, flip_type):
+    """
+    更新标注文件中的检测框坐标。
+
+    参数：
+    - json_path: JSON标注文件路径
+    - image_shape: (高度, 宽度, 通道数)
+    - flip_type: 'vertical' 或 'horizontal'
+    """
+    if not os.path.exists(json_path):
+        print(f"警告：标注文件 {json_path} 不存在，已跳过。")
+        return
 
+    data = read_json(json_path)
+    flip_annotation_data(data, image_shape, flip_type)
     write_json(json_path, data)
 
 def update_imageData(json_path, image_aug_bgr):
@@ -258,31 +296,143 @@ def update_all_imageData(folder_path):
             print(f"错误更新 imageData for 图像 {img_path}：{e}")
             continue
 
-def process_images(folder_path):
+def augment_image(image_bgr, operation_names):
     """
-    处理指定文件夹中的图像，按照定义的增强操作。
+    在内存中依次对图像应用多个增强操作。
 
-    操作逻辑：
-    - 对于每个增强操作：
-        - 读取文件夹中的所有图像文件路径。
-        - 随机选择50%的图像进行处理。
-        - 对选中的图像应用增强操作。
-        - 如果操作是垂直或水平翻转，则同步更新标注文件中的检测框坐标。
-        - 将处理后的图像覆盖保存到原文件夹中。
+    连续的逐像素操作（见 lut_operations）合并为一个查找表后一次性应用；
+    翻转与逐像素操作可以交换顺序，因此不会打断合并。
+    下雨和太阳耀斑效果使用预渲染的图层库（见 overlay_operations）。
 
-    参数影响：
-    - 每次处理会覆盖原始图像和标注文件，因此建议在运行前备份原始数据。
+    参数：
+    - image_bgr: 原始图像，BGR格式
+    - operation_names: 按顺序应用的操作名称列表
+
+    返回：
+    - 增强后的图像，BGR格式
+    """
+    operation_dict = dict(operations)
+    lut = None
+
+    # 转换颜色空间为 RGB，只转换一次
+    image = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
+    for operation_name in operation_names:
+        if operation_name in lut_operations:
+            sampled_lut = lut_operations[operation_name]()
+            lut = sampled_lut if lut is None else compose_lut(lut, sampled_lut)
+            continue
+        if lut is not None and operation_name not in flip_operations:
+            image = apply_lut(image, lut)
+            lut = None
+        if operation_name in overlay_operations:
+            image = overlay_operations[operation_name].apply(image)
+        else:
+            image = operation_dict[operation_name](image=image)['image']
+
+    if lut is not None:
+        image = apply_lut(image, lut)
+
+    # 转回 BGR 颜色空间
+    return cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+
+def process_single_image(img_path, operation_names, image_data_mode='embed', output_path=None):
+    """
+    对单张图像只解码一次、在内存中应用全部选中的操作、只编码一次。
+
+    编码得到的字节既写入图像文件，也直接用于更新标注文件中的 imageData 字段；
+    如果操作中包含翻转，则按顺序在内存中更新检测框坐标。标注文件只读写一次。
+
+    参数：
+    - img_path: 图像路径
+    - operation_names: 按顺序应用的操作名称列表
+    - image_data_mode: imageData 的写入方式，见 image_data_modes
+    - output_path: 增强结果的图像路径，标注文件保存在同一目录；None 时覆盖原图像和标注文件
+
+    返回：
+    - 增强后的图像（BGR格式），读取失败时返回 None
+    """
+    image = cv2.imread(img_path)
+    if image is None:
+        print(f"警告：无法读取图像 {img_path}，已跳过。")
+        return None
+
+    image_aug_bgr = augment_image(image, operation_names)
+    image_bytes = encode_image(img_path, image_aug_bgr)
+
+    base_name = os.path.splitext(os.path.basename(img_path))[0]
+    json_path = os.path.join(os.path.dirname(img_path), base_name + '.json')
+    data = None
+    if os.path.exists(json_path):
+        data = read_json(json_path)
+        for name in operation_names:
+            if name in flip_operations:
+                flip_annotation_data(data, image_aug_bgr.shape, flip_operations[name])
+        if image_data_mode == 'null':
+            data['imageData'] = None
+        else:
+            data['imageData'] = base64.b64encode(image_bytes).decode('utf-8')
+    else:
+        print(f"警告：标注文件 {json_path} 不存在，已跳过图像 {img_path} 的标注更新。")
+
+    if output_path is None:
+        output_path, output_json_path = img_path, json_path
+    else:
+        output_json_path = os.path.splitext(output_path)[0] + '.json'
+
+    # 先写入临时文件，再依次替换图像和标注文件，中断后可据此恢复（见 aug_manifest.resolve_interrupted）。
+    # 替换而不是直接写入，也保证不会修改结果目录中硬链接指向的原始文件。
+    with open(output_path + TMP_SUFFIX, 'wb') as f:
+        f.write(image_bytes)
+    if data is not None:
+        write_json(output_json_path + TMP_SUFFIX, data)
+    os.replace(output_path + TMP_SUFFIX, output_path)
+    if data is not None:
+        os.replace(output_json_path + TMP_SUFFIX, output_json_path)
+
+    return image_aug_bgr
+
+def load_sample(img_path, operation_names):
+    """
+    读取一张图像及其标注形状，应用选中的增强操作（不写回磁盘），随机种子由调用方设置。
+
+    返回：
+    - (增强后的图像（BGR格式）, shapes 列表)，读取失败时返回 None
+    """
+    image = cv2.imread(img_path)
+    if image is None:
+        print(f"警告：无法读取图像 {img_path}，已跳过。")
+        return None
+
+    json_path = os.path.splitext(img_path)[0] + '.json'
+    data = read_json(json_path) if os.path.exists(json_path) else {}
+    data.setdefault('shapes', [])
+    if not operation_names:
+        return image, data['shapes']
+
+    image_aug_bgr = augment_image(image, operation_names)
+    for name in operation_names:
+        if name in flip_operations:
+            flip_annotation_data(data, image_aug_bgr.shape, flip_operations[name])
+    return image_aug_bgr, data['shapes']
+
+# 操作计划、随机种子、增强清单和多进程调度见 aug_pipeline，与姿态增强脚本共用
+pipeline = AugmentationPipeline('Aug_v2', operations, process_single_image, load_sample, selection_divisor=3)
+build_operation_plan = pipeline.build_operation_plan
+seed_everything = pipeline.seed_everything
+process_images_single_pass = pipeline.process_images_single_pass
+replay_manifest = pipeline.replay_manifest
+iter_augmented_samples = pipeline.iter_augmented_samples
+
+def process_images_per_operation(folder_path):
+    """
+    逐操作处理：每个操作都重新读取、增强并写回选中的图像。
 
     参数：
     - folder_path: 图像文件夹的路径。
     """
     for operation_name, operation in operations:
         # 获取文件夹中的所有图像路径
-        image_paths = [
-            os.path.join(folder_path, f)
-            for f in os.listdir(folder_path)
-            if f.lower().endswith(('jpg', 'png', 'jpeg', 'bmp', 'tif', 'tiff'))
-        ]
+        image_paths = list_image_paths(folder_path)
         if not image_paths:
             print(f"文件夹 {folder_path} 中没有找到图像文件。")
             continue
@@ -342,6 +492,52 @@ def process_images(folder_path):
 
         print(f"已完成操作：{operation_name}")
 
+def process_images(folder_path, single_pass=False, workers=1, seed=None, image_data_mode='embed', incremental=True,
+                   output_dir=None):
+    """
+    处理指定文件夹中的图像，按照定义的增强操作。
+
+    操作逻辑（single_pass=True）：
+    - 预先为每张图像抽取操作计划（每个操作随机选择约 1/3 的图像）。
+    - 可通过 workers 使用多进程并行处理，每张图像的随机种子由 seed 和文件名决定。
+    - 每张图像只读取一次，在内存中依次应用全部选中的操作，只写回一次。
+    - 如果包含垂直或水平翻转，则同步更新标注文件中的检测框坐标。
+    - 只重写被增强图像的标注文件，imageData 直接使用增强时的编码结果，无需第二遍全量处理。
+    - 操作计划和完成情况记录在增强清单中，可中断后继续、只处理新增图像，或用 replay_manifest 重放。
+
+    操作逻辑（single_pass=False，默认）：
+    - 对于每个增强操作：
+        - 读取文件夹中的所有图像文件路径。
+        - 随机选择约 1/3 的图像进行处理。
+        - 对选中的图像应用增强操作。
+        - 如果操作是垂直或水平翻转，则同步更新标注文件中的检测框坐标。
+        - 将处理后的图像覆盖保存到原文件夹中。
+    - 所有操作完成后，重新读取全部图像并更新所有标注文件的 imageData 字段。
+
+    参数影响：
+    - 未指定 output_dir 时会覆盖原始图像和标注文件，因此建议在运行前备份原始数据。
+    - 指定 output_dir 时原始数据保持不变，未增强的文件以硬链接放入 output_dir，只占用被增强文件的空间。
+      逐操作流程会直接写入文件（会修改硬链接指向的原始文件），因此不支持 output_dir。
+
+    参数：
+    - folder_path: 图像文件夹的路径。
+    - single_pass: 是否使用单次解码、单次编码的增强流程。
+    - workers: 单次流程中并行处理的进程数（仅 single_pass=True 时有效）。
+    - seed: 单次流程的全局随机种子，相同种子得到完全相同的增强结果。
+    - image_data_mode: 单次流程中 imageData 的写入方式，'embed' 写入 base64，'null' 写入 null。
+    - incremental: 单次流程再次运行时是否处理增强清单中没有记录的新图像。
+    - output_dir: 单次流程的结果目录，None 时覆盖保存在 folder_path 中。
+    """
+    if single_pass:
+        process_images_single_pass(folder_path, workers=workers, seed=seed, image_data_mode=image_data_mode,
+                                   incremental=incremental, output_dir=output_dir)
+        return
+
+    if output_dir is not None:
+        raise ValueError("逐操作流程（single_pass=False）不支持 output_dir，请使用单次流程。")
+
+    process_images_per_operation(folder_path)
+
     # 所有增强操作完成后，统一更新所有图像的 imageData 字段
     print("开始更新所有图像的 imageData 字段为最新的 Base64 编码。")
     update_all_imageData(folder_path)
@@ -350,3 +546,5 @@ def process_images(folder_path):
 if __name__ == "__main__":
     folder_path = r'E:\PJ\GIO\aiba\dataset\archive_dataset(E8A)_checked\det_json_aug'  # 请替换为您的实际文件夹路径
     process_images(folder_path)
+    # 单次解码、多进程并行、可复现的流程（会在文件夹中写入增强清单 aug_manifest.jsonl）：
+    # process_images(folder_path, single_pass=True, workers=os.cpu_count(), seed=42)
@@ -0,0 +1,165 @@
+import json
+import os
+import shutil
+
+
+# 增强清单的文件名，保存在被增强的文件夹中
+MANIFEST_NAME = 'aug_manifest.jsonl'
+
+# 增强结果先写入带此后缀的临时文件，再替换原文件
+TMP_SUFFIX = '.tmp'
+
+
+def file_signature(path):
+    """
+    返回文件的 [大小, 修改时间(ns)]，用于判断图像是否已被增强结果覆盖。
+    """
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def write_entry(manifest_file, entry):
+    """
+    向清单追加一行记录并立即刷新，保证中断时已完成的记录不会丢失。
+    """
+    manifest_file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    manifest_file.flush()
+
+
+def load_manifest(manifest_path):
+    """
+    读取增强清单。
+
+    清单为 JSON Lines 格式，记录类型：
+    - run: 第一行，记录全局随机种子和各操作的定义
+    - plan: 每张图像一行，记录选中的操作、图像种子和增强前的文件签名
+    - done: 图像处理完成
+
+    参数：
+    - manifest_path: 清单文件路径
+
+    返回：
+    - 清单不存在时返回 None，否则返回字典 {'run': ..., 'plans': {图像名: plan}, 'done': set(图像名)}
+    """
+    if not os.path.exists(manifest_path):
+        return None
+
+    manifest = {'run': None, 'plans': {}, 'done': set()}
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # 中断时最后一行可能不完整
+                print(f"警告：清单 {manifest_path} 中存在无法解析的行，已忽略。")
+                continue
+            entry_type = entry.get('type')
+            if entry_type == 'run' and manifest['run'] is None:
+                manifest['run'] = entry
+            elif entry_type == 'plan':
+                manifest['plans'][entry['image']] = entry
+            elif entry_type == 'done':
+                manifest['done'].add(entry['image'])
+
+    if manifest['run'] is None:
+        print(f"警告：清单 {manifest_path} 缺少 run 记录，已忽略该清单。")
+        return None
+    return manifest
+
+
+def check_operations(manifest, operation_reprs):
+    """
+    检查清单记录的操作定义与当前脚本是否一致，不一致时无法复现相同的结果。
+    """
+    recorded = manifest['run'].get('operations', {})
+    for name, operation_repr in operation_reprs.items():
+        if name in recorded and recorded[name] != operation_repr:
+            print(f"警告：操作 {name} 的定义与清单记录不一致，结果将无法与之前完全相同。")
+
+
+def resolve_interrupted(img_path, json_path, source_signature=None):
+    """
+    判断已计划但未记录完成的图像是否实际已经处理完成，并清理中断时留下的临时文件。
+
+    处理单张图像时先写临时文件，再依次替换图像和标注文件：
+    - 图像未被替换（签名与增强前一致，或输出到新目录时图像还不存在）：删除临时文件，需要重新处理。
+    - 图像已被替换：如果标注的临时文件还在，完成替换；图像视为已处理完成。
+
+    参数：
+    - img_path: 增强结果的图像路径
+    - json_path: 增强结果的标注文件路径
+    - source_signature: 原地增强时原始图像的签名；输出到新目录时为 None
+
+    返回：
+    - True 表示图像已经处理完成
+    """
+    if source_signature is None:
+        replaced = os.path.exists(img_path)
+    else:
+        replaced = file_signature(img_path) != source_signature
+
+    if not replaced:
+        for tmp_path in (img_path + TMP_SUFFIX, json_path + TMP_SUFFIX):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return False
+
+    if os.path.exists(json_path + TMP_SUFFIX):
+        os.replace(json_path + TMP_SUFFIX, json_path)
+    return True
+
+
+def copy_manifest_for_replay(manifest_path, folder_path, output_dir=None):
+    """
+    将清单中的 run 和 plan 记录复制到结果目录中，用于在原始数据上重放增强。
+
+    plan 记录中的文件签名改为 folder_path 中原始图像的签名；folder_path 中不存在的图像被跳过。
+
+    参数：
+    - manifest_path: 要重放的清单文件路径
+    - folder_path: 存放原始图像和标注文件的文件夹
+    - output_dir: 结果目录，None 时为 folder_path（原地增强）
+
+    返回：
+    - 新清单的路径
+    """
+    manifest = load_manifest(manifest_path)
+    if manifest is None:
+        raise FileNotFoundError(f"增强清单不存在或无效：{manifest_path}")
+
+    target_dir = output_dir or folder_path
+    os.makedirs(target_dir, exist_ok=True)
+    target_path = os.path.join(target_dir, MANIFEST_NAME)
+    if os.path.exists(target_path):
+        raise FileExistsError(f"目标文件夹中已存在增强清单：{target_path}")
+
+    with open(target_path, 'w', encoding='utf-8') as f:
+        write_entry(f, manifest['run'])
+        for name, entry in manifest['plans'].items():
+            img_path = os.path.join(folder_path, name)
+            if not os.path.exists(img_path):
+                print(f"警告：原始图像 {img_path} 不存在，已跳过。")
+                continue
+            write_entry(f, dict(entry, source=file_signature(img_path)))
+    return target_path
+
+
+def link_or_copy(src, dst):
+    """
+    将未修改的文件放入结果目录：优先使用硬链接，跨文件系统等无法链接时复制。
+
+    参数：
+    - src: 源文件路径
+    - dst: 目标文件路径，已存在时不做处理
+
+    返回：
+    - 'link'、'copy' 或 'exists'
+    """
+    if os.path.exists(dst):
+        return 'exists'
+    try:
+        os.link(src, dst)
+        return 'link'
+    except OSError:
+        shutil.copy2(src, dst)
+        return 'copy'
@@ -0,0 +1,358 @@
+import hashlib
+import multiprocessing
+import os
+import random
+import time
+
+import cv2
+import numpy as np
+
+from aug_manifest import (
+    MANIFEST_NAME, check_operations, copy_manifest_for_replay, file_signature, link_or_copy, load_manifest,
+    resolve_interrupted, write_entry
+)
+from aug_stream import prefetch_map
+
+# imageData 字段的写入方式：
+# - 'embed': 写入增强后图像编码字节的 base64（与磁盘上的图像文件一致）
+# - 'null': 写入 null，由 labelme 按 imagePath 读取图像
+image_data_modes = ('embed', 'null')
+
+# 按名称登记的增强流程。任务中只传递流程名称，子进程按名称查找；
+# spawn 方式启动的子进程重新导入脚本时会再次登记同名流程，操作对象与脚本中使用的一致。
+_pipelines = {}
+
+
+def list_image_paths(folder_path):
+    """
+    获取文件夹中的所有图像路径。
+    """
+    return [
+        os.path.join(folder_path, f)
+        for f in os.listdir(folder_path)
+        if f.lower().endswith(('jpg', 'png', 'jpeg', 'bmp', 'tif', 'tiff'))
+    ]
+
+
+def image_seed(seed, img_path):
+    """
+    由全局种子和图像文件名派生出该图像的随机种子。
+
+    只使用文件名而不是完整路径，保证同一数据集在不同位置、不同进程数下得到相同的结果。
+    """
+    key = f"{seed}:{os.path.basename(img_path)}".encode('utf-8')
+    return int.from_bytes(hashlib.md5(key).digest()[:4], 'little')
+
+
+def report_progress(done, total, start_time, interval=100):
+    """
+    每处理 interval 张图像（以及最后一张）打印一次进度和吞吐量。
+    """
+    if done % interval and done != total:
+        return
+    elapsed = max(time.time() - start_time, 1e-6)
+    print(f"进度：{done}/{total}，{done / elapsed:.1f} 张/秒")
+
+
+def encode_image(img_path, image_bgr):
+    """
+    按图像文件的扩展名将图像编码为字节。
+
+    参数：
+    - img_path: 图像路径（用于确定编码格式）
+    - image_bgr: 图像数据，BGR格式
+
+    返回：
+    - 编码后的图像字节
+    """
+    ext = os.path.splitext(img_path)[1]
+    success, buffer = cv2.imencode(ext, image_bgr)
+    if not success:
+        raise ValueError(f"无法将图像编码为 {ext} 格式")
+    return buffer.tobytes()
+
+
+def _process_task(task):
+    """
+    进程池中执行的单张图像任务，先按图像种子设置随机状态再处理。
+
+    返回：
+    - (图像路径, 是否处理成功)
+    """
+    name, img_path, operation_names, task_seed, image_data_mode, output_path = task
+    pipeline = _pipelines[name]
+    try:
+        pipeline.seed_everything(task_seed)
+        return img_path, pipeline.process_image(img_path, operation_names, image_data_mode, output_path) is not None
+    except Exception as e:
+        print(f"错误处理图像 {img_path}：{e}")
+        return img_path, False
+
+
+def _load_sample(task):
+    """
+    按图像种子设置随机状态，读取并增强一个样本（不写回磁盘）。
+    """
+    name, img_path, operation_names, task_seed = task
+    pipeline = _pipelines[name]
+    if operation_names:
+        pipeline.seed_everything(task_seed)
+    return pipeline.load_sample(img_path, operation_names)
+
+
+class AugmentationPipeline(object):
+    """
+    单次解码、单次编码的增强流程，由 Aug_v2（检测）和 Aug_pose（姿态）共用。
+
+    负责操作计划的抽样、每张图像的随机种子、增强清单（中断继续、增量处理、重放）以及多进程调度；
+    单张图像如何增强、如何更新标注由脚本提供的函数决定。
+    """
+
+    def __init__(self, name, operations, process_image, load_sample, selection_divisor=3):
+        """
+        参数：
+        - name: 流程名称，在进程间用于查找同一个流程，每个脚本一个
+        - operations: [(操作名称, 增强操作), ...]，计划中操作的顺序与此列表一致
+        - process_image: process_image(img_path, operation_names, image_data_mode, output_path)，
+          增强单张图像并写入图像和标注文件，返回增强后的图像，读取失败时返回 None
+        - load_sample: load_sample(img_path, operation_names)，返回增强后的 (图像, shapes)，不写回磁盘，
+          读取失败时返回 None
+        - selection_divisor: 每个操作从全部图像中随机选择 1/selection_divisor 的图像
+        """
+        self.name = name
+        self.operations = operations
+        self.process_image = process_image
+        self.load_sample = load_sample
+        self.selection_divisor = selection_divisor
+        _pipelines[name] = self
+
+    def build_operation_plan(self, image_paths, rng=random):
+        """
+        预先为每张图像抽取要应用的增强操作。
+
+        与逐操作处理的抽样方式一致：每个操作独立地从全部图像中随机选择约 1/selection_divisor。
+        计划中每张图像的操作顺序与 operations 列表中的顺序相同。
+
+        参数：
+        - image_paths: 图像路径列表
+        - rng: 随机数生成器（random.Random 实例），用于复现相同的计划
+
+        返回：
+        - 字典 {图像路径: [操作名称, ...]}，只包含至少被选中一次的图像
+        """
+        plan = {}
+        if not image_paths:
+            return plan
+
+        num_selected = max(1, len(image_paths) // self.selection_divisor)  # 确保至少选择一张图像
+        for operation_name, _ in self.operations:
+            for img_path in rng.sample(image_paths, num_selected):
+                plan.setdefault(img_path, []).append(operation_name)
+        return plan
+
+    def seed_everything(self, seed):
+        """
+        设置 random、numpy 以及各增强操作自身的随机种子。
+
+        较新版本的 albumentations 中每个 Compose 拥有独立的随机数生成器，需要单独设置。
+        """
+        random.seed(seed)
+        np.random.seed(seed)
+        for index, (_, operation) in enumerate(self.operations):
+            if hasattr(operation, 'set_random_seed'):
+                operation.set_random_seed(seed + index)
+
+    def process_images_single_pass(self, folder_path, workers=1, seed=None, image_data_mode='embed',
+                                   incremental=True, output_dir=None):
+        """
+        单次解码、单次编码的增强流程。
+
+        先为每张图像抽取操作计划，再逐张图像读取一次、依次应用全部选中的操作、写回一次，
+        避免逐操作处理时的多次 JPEG 解码/编码及其带来的画质损失。
+
+        每张图像的随机种子由全局种子和文件名派生，因此无论 workers 为多少，输出都完全一致。
+        只有被增强的图像对应的标注文件会被重写，imageData 直接使用内存中的编码结果。
+
+        操作计划、图像种子和完成情况记录在结果目录中的增强清单（aug_manifest.jsonl）中：
+        - 再次运行时沿用清单中的种子，跳过已完成的图像，继续完成中断时未完成的图像。
+        - incremental=True 时，为清单中没有的新图像抽取操作计划并处理。
+        - 清单可以用 replay_manifest 在原始数据上重放，得到完全相同的增强结果。
+
+        指定 output_dir 时不修改 folder_path：被增强的图像和标注文件写入 output_dir，
+        未被选中的图像和标注文件以硬链接放入 output_dir（跨文件系统时复制），清单也保存在 output_dir 中。
+
+        参数：
+        - folder_path: 图像文件夹的路径。
+        - workers: 并行处理的进程数，1 表示在当前进程中顺序处理。
+        - seed: 全局随机种子，None 时随机生成并打印，以便复现；已有清单时使用清单中的种子。
+        - image_data_mode: imageData 的写入方式，'embed' 或 'null'。
+        - incremental: 是否处理清单中没有记录的新图像。
+        - output_dir: 结果目录，None 时覆盖保存在 folder_path 中。
+        """
+        if image_data_mode not in image_data_modes:
+            raise ValueError(f"不支持的 imageData 写入方式：{image_data_mode}")
+
+        if output_dir is not None and os.path.abspath(output_dir) == os.path.abspath(folder_path):
+            output_dir = None
+        target_dir = output_dir or folder_path
+        os.makedirs(target_dir, exist_ok=True)
+
+        manifest_path = os.path.join(target_dir, MANIFEST_NAME)
+        manifest = load_manifest(manifest_path)
+        operation_reprs = {name: repr(operation) for name, operation in self.operations}
+        new_entries = []
+
+        if manifest is None:
+            if seed is None:
+                seed = random.SystemRandom().randrange(2 ** 32)
+                print(f"未指定随机种子，本次使用：{seed}")
+            plans, finished = {}, set()
+            new_entries.append({'type': 'run', 'seed': seed, 'operations': operation_reprs})
+        else:
+            if seed is not None and seed != manifest['run']['seed']:
+                print(f"警告：已存在增强清单，使用清单中的随机种子 {manifest['run']['seed']}，忽略 {seed}。")
+            seed = manifest['run']['seed']
+            check_operations(manifest, operation_reprs)
+            plans, finished = manifest['plans'], manifest['done']
+            print(f"读取增强清单：已计划 {len(plans)} 张图像，已完成 {len(finished)} 张。")
+
+        if manifest is None or incremental:
+            # 排序保证不同系统上 os.listdir 的顺序差异不影响抽样结果
+            new_paths = [p for p in sorted(list_image_paths(folder_path)) if os.path.basename(p) not in plans]
+            # 首次运行使用全局种子抽样；之后新增的图像按已计划的数量派生抽样种子
+            rng = random.Random(f"{seed}:{len(plans)}" if plans else seed)
+            plan = self.build_operation_plan(new_paths, rng)
+            for img_path in new_paths:
+                entry = {
+                    'type': 'plan',
+                    'image': os.path.basename(img_path),
+                    'operations': plan.get(img_path, []),
+                    'seed': image_seed(seed, img_path),
+                    'source': file_signature(img_path),
+                }
+                plans[entry['image']] = entry
+                new_entries.append(entry)
+            if new_paths:
+                print(f"新增 {len(new_paths)} 张图像，其中 {len(plan)} 张被选中增强。")
+
+        with open(manifest_path, 'a', encoding='utf-8') as manifest_file:
+            for entry in new_entries:
+                write_entry(manifest_file, entry)
+
+            tasks = []
+            linked = 0
+            for name, entry in plans.items():
+                if name in finished:
+                    continue
+                img_path = os.path.join(folder_path, name)
+                if not os.path.exists(img_path):
+                    print(f"警告：清单中的图像 {img_path} 不存在，已跳过。")
+                    continue
+                json_path = os.path.splitext(img_path)[0] + '.json'
+                output_path = os.path.join(target_dir, name)
+                output_json_path = os.path.splitext(output_path)[0] + '.json'
+
+                if not entry['operations']:
+                    if output_dir is not None:
+                        # 未被选中的图像无需重新写入，结果目录中只保存指向原文件的硬链接
+                        linked += link_or_copy(img_path, output_path) != 'exists'
+                        if os.path.exists(json_path):
+                            link_or_copy(json_path, output_json_path)
+                    continue
+
+                source_signature = entry['source'] if output_dir is None else None
+                if resolve_interrupted(output_path, output_json_path, source_signature):
+                    # 上次运行在写入图像后、记录完成前中断
+                    write_entry(manifest_file, {'type': 'done', 'image': name})
+                    continue
+                tasks.append((self.name, img_path, entry['operations'], entry['seed'], image_data_mode,
+                              output_path if output_dir is not None else None))
+
+            if linked:
+                print(f"已将 {linked} 张未增强的图像及其标注文件链接到 {output_dir}。")
+
+            if not tasks:
+                print(f"文件夹 {folder_path} 中没有需要增强的图像。")
+                return
+
+            start_time = time.time()
+            if workers > 1:
+                pool = multiprocessing.Pool(workers)
+                chunksize = max(1, len(tasks) // (workers * 16))
+                results = pool.imap_unordered(_process_task, tasks, chunksize=chunksize)
+            else:
+                pool = None
+                results = map(_process_task, tasks)
+            try:
+                for count, (img_path, success) in enumerate(results, 1):
+                    if success:
+                        write_entry(manifest_file, {'type': 'done', 'image': os.path.basename(img_path)})
+                    report_progress(count, len(tasks), start_time)
+            finally:
+                if pool is not None:
+                    pool.close()
+                    pool.join()
+
+        print(f"已完成 {len(tasks)} 张图像的增强操作。")
+
+    def replay_manifest(self, manifest_path, folder_path, workers=1, image_data_mode='embed', output_dir=None):
+        """
+        按增强清单在一份原始数据上重新生成完全相同的增强结果。
+
+        参数：
+        - manifest_path: 之前运行生成的增强清单路径
+        - folder_path: 存放原始（未增强）图像和标注文件的文件夹
+        - workers: 并行处理的进程数
+        - image_data_mode: imageData 的写入方式，'embed' 或 'null'
+        - output_dir: 结果目录，None 时覆盖保存在 folder_path 中
+        """
+        if output_dir is not None and os.path.abspath(output_dir) == os.path.abspath(folder_path):
+            output_dir = None
+        copy_manifest_for_replay(manifest_path, folder_path, output_dir)
+        self.process_images_single_pass(folder_path, workers=workers, image_data_mode=image_data_mode,
+                                        incremental=False, output_dir=output_dir)
+
+    def iter_augmented_samples(self, folder_path, workers=1, seed=None, epochs=1, shuffle=True, prefetch=None):
+        """
+        在训练时按需生成增强样本，不在磁盘上保存增强后的副本。
+
+        每一轮（epoch）为全部图像重新抽取操作计划（与 process_images 的抽样方式相同），
+        依次返回每张图像增强后的结果，未被选中的图像原样返回；标注随图像的翻转或几何变换同步更新。
+        样本由 workers 个进程提前计算，预取队列的长度由 prefetch 限定。
+        相同的 seed 得到完全相同的样本序列，与 workers 无关。
+
+        参数：
+        - folder_path: 图像文件夹的路径。
+        - workers: 计算样本的进程数，1 表示在当前进程中计算。
+        - seed: 全局随机种子，None 时随机生成并打印。
+        - epochs: 遍历数据集的轮数，None 表示无限循环。
+        - shuffle: 是否在每一轮打乱图像顺序。
+        - prefetch: 预取队列的长度，None 时为 workers 的 4 倍。
+
+        返回：
+        - 生成器，每次返回 (图像（BGR格式的 numpy 数组）, shapes 列表)
+        """
+        image_paths = sorted(list_image_paths(folder_path))
+        if not image_paths:
+            print(f"文件夹 {folder_path} 中没有找到图像文件。")
+            return
+        if seed is None:
+            seed = random.SystemRandom().randrange(2 ** 32)
+            print(f"未指定随机种子，本次使用：{seed}")
+
+        def generate_tasks():
+            epoch = 0
+            while epochs is None or epoch < epochs:
+                epoch_seed = f"{seed}:{epoch}"
+                rng = random.Random(epoch_seed)
+                plan = self.build_operation_plan(image_paths, rng)
+                epoch_paths = list(image_paths)
+                if shuffle:
+                    rng.shuffle(epoch_paths)
+                for img_path in epoch_paths:
+                    yield self.name, img_path, plan.get(img_path, []), image_seed(epoch_seed, img_path)
+                epoch += 1
+
+        for sample in prefetch_map(_load_sample, generate_tasks(), workers=workers, prefetch=prefetch):
+            if sample is not None:
+                yield sample
@@ -0,0 +1,43 @@
+import collections
+import multiprocessing
+
+
+def prefetch_map(function, tasks, workers=1, prefetch=None):
+    """
+    按任务顺序逐个返回 function(task) 的结果，由多个进程提前计算后续任务。
+
+    同时提交给进程池的任务数不超过 prefetch，结果按需计算，内存占用与数据集大小无关；
+    消费方提前退出（break 或关闭生成器）时，进程池随之终止。
+
+    参数：
+    - function: 模块级函数（需要能被 pickle 传给子进程）
+    - tasks: 任务的可迭代对象，可以是无限生成器
+    - workers: 进程数，1 表示在当前进程中顺序计算
+    - prefetch: 预取队列的长度，None 时为 workers 的 4 倍
+
+    返回：
+    - 结果的生成器，顺序与 tasks 一致
+    """
+    if workers <= 1:
+        for task in tasks:
+            yield function(task)
+        return
+
+    if prefetch is None:
+        prefetch = workers * 4
+    prefetch = max(prefetch, 1)
+
+    pool = multiprocessing.Pool(workers)
+    pending = collections.deque()
+    tasks = iter(tasks)
+    try:
+        for task in tasks:
+            pending.append(pool.apply_async(function, (task,)))
+            if len(pending) >= prefetch:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
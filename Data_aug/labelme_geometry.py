@@ -0,0 +1,187 @@
+import numpy as np
+
+
+def pack_shapes(shapes):
+    """
+    将一张图像的所有形状的点打包为一个 (N, 2) 数组。
+
+    矩形的两个对角点会展开为四个角点，这样旋转、透视等变换后仍能得到正确的外接框。
+
+    参数：
+    - shapes: labelme 标注中的 shapes 列表
+
+    返回：
+    - points: (N, 2) 的 float64 数组，所有形状的点按顺序拼接
+    - counts: 每个形状在 points 中占用的点数
+    """
+    flat_points = []
+    counts = []
+    for shape in shapes:
+        points = shape.get('points') or []
+        if (shape.get('shape_type') or '').lower() == 'rectangle' and len(points) == 2:
+            (x1, y1), (x2, y2) = points
+            points = [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]
+        flat_points.extend(points)
+        counts.append(len(points))
+    points = np.asarray(flat_points, dtype=np.float64).reshape(-1, 2)
+    return points, counts
+
+
+def unpack_shapes(shapes, points, counts, image_size=None):
+    """
+    将变换后的点数组写回形状列表。
+
+    - 矩形取四个角点的外接框，保存为左上角和右下角两个点。
+    - 给出 image_size 时，矩形、多边形和折线裁剪到图像范围内，
+      落在图像外的单点（关键点）被删除，完全落在图像外的矩形也被删除。
+
+    参数：
+    - shapes: 原始 shapes 列表（与 pack_shapes 的输入一致）
+    - points: 变换后的 (N, 2) 数组
+    - counts: pack_shapes 返回的每个形状的点数
+    - image_size: 变换后图像的 (高度, 宽度)，None 时不裁剪
+
+    返回：
+    - 新的 shapes 列表
+    """
+    if image_size is not None:
+        image_height, image_width = image_size
+        inside = (
+            (points[:, 0] >= 0) & (points[:, 0] <= image_width) &
+            (points[:, 1] >= 0) & (points[:, 1] <= image_height)
+        )
+        clipped = np.empty_like(points)
+        clipped[:, 0] = np.clip(points[:, 0], 0, image_width)
+        clipped[:, 1] = np.clip(points[:, 1], 0, image_height)
+    else:
+        inside = np.ones(len(points), dtype=bool)
+        clipped = points
+
+    new_shapes = []
+    start = 0
+    for shape, count in zip(shapes, counts):
+        end = start + count
+        shape_type = (shape.get('shape_type') or '').lower()
+        new_shape = dict(shape)
+
+        if shape_type == 'rectangle' and count == 4:
+            x_min, y_min = clipped[start:end].min(axis=0)
+            x_max, y_max = clipped[start:end].max(axis=0)
+            if x_max <= x_min or y_max <= y_min:
+                start = end
+                continue  # 矩形完全落在图像外
+            new_shape['points'] = [[float(x_min), float(y_min)], [float(x_max), float(y_max)]]
+        elif shape_type == 'point':
+            if not inside[start:end].all():
+                start = end
+                continue  # 关键点落在图像外
+            new_shape['points'] = points[start:end].tolist()
+        elif shape_type == 'circle':
+            # 圆心和圆周上的点保持相对位置，不裁剪
+            new_shape['points'] = points[start:end].tolist()
+        else:
+            new_shape['points'] = clipped[start:end].tolist()
+
+        new_shapes.append(new_shape)
+        start = end
+    return new_shapes
+
+
+def apply_matrix(points, matrix):
+    """
+    用 3x3 变换矩阵一次性变换所有点（支持仿射和透视变换）。
+
+    参数：
+    - points: (N, 2) 数组
+    - matrix: 3x3 变换矩阵
+
+    返回：
+    - 变换后的 (N, 2) 数组
+    """
+    if len(points) == 0:
+        return points
+    homogeneous = np.hstack([points, np.ones((len(points), 1))]) @ np.asarray(matrix, dtype=np.float64).T
+    return homogeneous[:, :2] / homogeneous[:, 2:3]
+
+
+def flip_matrix(flip_type, image_width, image_height):
+    """
+    生成翻转对应的 3x3 变换矩阵。
+
+    参数：
+    - flip_type: 'vertical' 或 'horizontal'
+    - image_width: 图像宽度
+    - image_height: 图像高度
+
+    返回：
+    - 3x3 变换矩阵，未知的翻转类型返回单位矩阵
+    """
+    if flip_type == 'vertical':
+        return np.array([[1, 0, 0], [0, -1, image_height], [0, 0, 1]], dtype=np.float64)
+    elif flip_type == 'horizontal':
+        return np.array([[-1, 0, image_width], [0, 1, 0], [0, 0, 1]], dtype=np.float64)
+    else:
+        return np.eye(3)  # 无需翻转
+
+
+def transform_annotation(data, matrix, image_size=None):
+    """
+    用 3x3 变换矩阵变换标注数据中的所有形状（在内存中修改 data）。
+
+    参数：
+    - data: labelme 标注数据字典
+    - matrix: 3x3 变换矩阵
+    - image_size: 变换后图像的 (高度, 宽度)，给出时同步更新 imageHeight/imageWidth 并裁剪形状
+
+    返回：
+    - 修改后的 data
+    """
+    shapes = data.get('shapes', [])
+    points, counts = pack_shapes(shapes)
+    data['shapes'] = unpack_shapes(shapes, apply_matrix(points, matrix), counts, image_size)
+    if image_size is not None:
+        data['imageHeight'], data['imageWidth'] = int(image_size[0]), int(image_size[1])
+    return data
+
+
+def build_flip_pairs(keypoint_names, prefixes=('L_', 'R_')):
+    """
+    根据关键点名称生成左右对称关键点的对应表（如 L_Eye <-> R_Eye）。
+
+    参数：
+    - keypoint_names: 关键点名称列表
+    - prefixes: 左、右两侧名称的前缀
+
+    返回：
+    - 字典 {名称: 对称名称}，只包含两侧都存在的关键点
+    """
+    left, right = prefixes
+    names = set(keypoint_names)
+    flip_pairs = {}
+    for name in keypoint_names:
+        if name.startswith(left) and right + name[len(left):] in names:
+            partner = right + name[len(left):]
+            flip_pairs[name] = partner
+            flip_pairs[partner] = name
+    return flip_pairs
+
+
+def swap_flip_labels(shapes, flip_pairs):
+    """
+    镜像翻转后交换左右对称关键点的标签（在内存中修改 shapes）。
+
+    翻转只改变坐标，不交换标签时，翻转后的左眼会被标成 L_Eye 出现在原来右眼的位置，
+    因此所有镜像类的变换都需要同时交换左右标签。
+
+    参数：
+    - shapes: labelme 标注中的 shapes 列表
+    - flip_pairs: build_flip_pairs 生成的对应表
+
+    返回：
+    - 修改后的 shapes
+    """
+    for shape in shapes:
+        label = shape.get('label')
+        if label in flip_pairs:
+            shape['label'] = flip_pairs[label]
+    return shapes
@@ -0,0 +1,162 @@
+import collections
+import hashlib
+import os
+import random
+
+import cv2
+import numpy as np
+
+
+# 预渲染效果图层的默认缓存目录
+OVERLAY_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'Dataset_tool', 'overlays')
+
+# 每个图层库在每个进程中保留在内存中的图层总字节数上限
+OVERLAY_MAX_BYTES = 256 * 1024 * 1024
+
+
+class OverlayBank:
+    """
+    预渲染的效果图层库（下雨、太阳耀斑等）。
+
+    对每种目标分辨率，用给定的 albumentations 操作在黑色画布上渲染 num_layers 张效果图层，
+    以压缩数组（.npz）缓存到磁盘。处理图像时随机选择一张图层、随机偏移后与图像叠加一次，
+    代替每张图像都从头渲染雨滴或光斑。
+
+    结果是原效果的近似，与逐张渲染的输出并不相同：
+    - 图层以相加的方式叠加，而原效果用雨滴颜色替换像素（太阳耀斑原本也是混合，差别较小）；
+    - 原 RandomRain 会模糊整张图像，这里由 blur_value 在叠加前模糊图像来近似；
+    - 雨滴和光斑的位置只来自 num_layers 张图层及其随机偏移。
+
+    内存占用：每种分辨率的图层占 图层数 × (1 + padding)² × 高 × 宽 × 3 字节，且每个进程各有一份。
+    例如 4K（3840×2160）、padding=0.25 时每张图层约 39 MB，8 张约 311 MB。
+    max_bytes 限制每个图层库在每个进程中的占用：单一分辨率放不下全部图层时减少图层数（至少一张），
+    多种分辨率超出上限时丢弃最久未使用的分辨率。进程池的总占用约为 进程数 × 图层库数 × max_bytes。
+    """
+
+    def __init__(self, name, render_operation, num_layers=8, brightness=1.0, padding=0.25, blur_value=None,
+                 cache_dir=OVERLAY_CACHE_DIR, max_bytes=OVERLAY_MAX_BYTES):
+        """
+        参数：
+        - name: 图层库名称，用于缓存文件名
+        - render_operation: 用于渲染图层的 albumentations 操作（A.Compose）
+        - num_layers: 每种分辨率预渲染的图层数量
+        - brightness: 叠加前图像的亮度系数（下雨效果会使画面变暗）
+        - padding: 图层比目标分辨率多出的比例，用于随机偏移
+        - blur_value: 叠加前模糊图像的核大小（下雨效果会使画面模糊），None 时不模糊
+        - cache_dir: 缓存目录，None 时只缓存在内存中
+        - max_bytes: 每个进程中保留的图层总字节数上限，None 时不限制
+        """
+        self.name = name
+        self.render_operation = render_operation
+        self.num_layers = num_layers
+        self.brightness = brightness
+        self.padding = padding
+        self.blur_value = blur_value
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # 分辨率 -> 图层，按最近使用的顺序排列
+        self.layers = collections.OrderedDict()
+
+        # 渲染参数变化时缓存文件名随之变化，避免使用过期的图层
+        self.key = hashlib.md5(repr(render_operation).encode('utf-8')).hexdigest()[:8]
+
+    def layer_shape(self, height, width):
+        """
+        返回指定分辨率的图层尺寸（含 padding）。
+        """
+        return int(round(height * (1 + self.padding))), int(round(width * (1 + self.padding)))
+
+    def layer_count(self, height, width):
+        """
+        返回指定分辨率的图层数量，受 max_bytes 限制。
+        """
+        if self.max_bytes is None:
+            return self.num_layers
+        layer_height, layer_width = self.layer_shape(height, width)
+        return max(1, min(self.num_layers, self.max_bytes // (layer_height * layer_width * 3)))
+
+    def cache_path(self, height, width):
+        """
+        返回指定分辨率的缓存文件路径。
+        """
+        file_name = f"{self.name}_{self.key}_{width}x{height}_{self.layer_count(height, width)}.npz"
+        return os.path.join(self.cache_dir, file_name)
+
+    def render_layers(self, height, width):
+        """
+        在黑色画布上渲染图层。
+
+        每张图层使用固定的种子，不同进程渲染出的图层完全一致；渲染前后保存并恢复全局随机状态，
+        不影响正在处理的图像的随机参数。
+        """
+        layer_height, layer_width = self.layer_shape(height, width)
+        canvas = np.zeros((layer_height, layer_width, 3), dtype=np.uint8)
+
+        random_state = random.getstate()
+        np_random_state = np.random.get_state()
+        try:
+            layers = []
+            for index in range(self.layer_count(height, width)):
+                random.seed(index)
+                np.random.seed(index)
+                if hasattr(self.render_operation, 'set_random_seed'):
+                    self.render_operation.set_random_seed(index)
+                layers.append(self.render_operation(image=canvas)['image'])
+        finally:
+            random.setstate(random_state)
+            np.random.set_state(np_random_state)
+        return np.stack(layers)
+
+    def get_layers(self, height, width):
+        """
+        获取指定分辨率的图层，依次从内存、磁盘缓存中读取，都没有时重新渲染并写入缓存。
+        """
+        if (height, width) in self.layers:
+            self.layers.move_to_end((height, width))
+            return self.layers[(height, width)]
+
+        layers = None
+        cache_path = self.cache_path(height, width) if self.cache_dir else None
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with np.load(cache_path) as cache:
+                    layers = cache['layers']
+            except Exception as e:
+                print(f"警告：无法读取图层缓存 {cache_path}，将重新渲染：{e}")
+
+        if layers is None:
+            layers = self.render_layers(height, width)
+            if cache_path:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                # 先写临时文件再替换，避免多个进程同时写入时读到不完整的文件
+                tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    np.savez_compressed(f, layers=layers)
+                os.replace(tmp_path, cache_path)
+
+        self.layers[(height, width)] = layers
+        if self.max_bytes is not None:
+            # 超出上限时丢弃最久未使用的分辨率，当前分辨率总是保留
+            while len(self.layers) > 1 and sum(item.nbytes for item in self.layers.values()) > self.max_bytes:
+                self.layers.popitem(last=False)
+        return layers
+
+    def apply(self, image, rng=random):
+        """
+        随机选择一张图层并随机偏移，与图像叠加。
+
+        参数：
+        - image: (H, W, 3) 的 uint8 图像
+        - rng: 随机数生成器
+
+        返回：
+        - 叠加效果后的图像
+        """
+        height, width = image.shape[:2]
+        layers = self.get_layers(height, width)
+        layer = layers[rng.randrange(len(layers))]
+        y = rng.randrange(layer.shape[0] - height + 1)
+        x = rng.randrange(layer.shape[1] - width + 1)
+        if self.blur_value:
+            image = cv2.blur(image, (self.blur_value, self.blur_value))
+        return cv2.addWeighted(image, self.brightness, layer[y:y + height, x:x + width], 1.0, 0)
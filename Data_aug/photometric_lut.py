@@ -0,0 +1,84 @@
+import random
+
+import cv2
+import numpy as np
+
+
+def identity_lut():
+    """
+    返回不改变图像的查找表。
+
+    查找表的形状为 (256, 3)，每一列对应一个通道（与图像的通道顺序一致）。
+    """
+    return np.repeat(np.arange(256, dtype=np.uint8)[:, None], 3, axis=1)
+
+
+def gamma_lut(gamma_limit=(90, 110), rng=random):
+    """
+    随机伽马变换的查找表，参数含义与 A.RandomGamma 相同。
+
+    参数：
+    - gamma_limit: 伽马值范围（除以 100 后使用）
+    - rng: 随机数生成器
+
+    返回：
+    - (256, 3) 的 uint8 查找表
+    """
+    gamma = rng.uniform(gamma_limit[0], gamma_limit[1]) / 100
+    table = (np.power(np.arange(256) / 255.0, gamma) * 255).astype(np.uint8)
+    return np.repeat(table[:, None], 3, axis=1)
+
+
+def rgb_shift_lut(r_shift_limit=(-20, 20), g_shift_limit=(-20, 20), b_shift_limit=(-20, 20), rng=random):
+    """
+    RGB 通道随机偏移的查找表，参数含义与 A.RGBShift 相同（图像为 RGB 顺序）。
+
+    参数：
+    - r_shift_limit / g_shift_limit / b_shift_limit: 各通道的偏移范围
+    - rng: 随机数生成器
+
+    返回：
+    - (256, 3) 的 uint8 查找表
+    """
+    shift = np.array([
+        rng.uniform(*r_shift_limit),
+        rng.uniform(*g_shift_limit),
+        rng.uniform(*b_shift_limit),
+    ])
+    table = np.arange(256)[:, None] + shift[None, :]
+    return np.clip(np.round(table), 0, 255).astype(np.uint8)
+
+
+def invert_lut():
+    """
+    反转图像颜色的查找表，与 A.InvertImg 相同。
+    """
+    return 255 - identity_lut()
+
+
+def compose_lut(first, second):
+    """
+    合并两个查找表，结果等价于先应用 first 再应用 second。
+
+    参数：
+    - first: 先应用的 (256, 3) 查找表
+    - second: 后应用的 (256, 3) 查找表
+
+    返回：
+    - 合并后的 (256, 3) 查找表
+    """
+    return np.take_along_axis(second, first.astype(np.intp), axis=0)
+
+
+def apply_lut(image, lut):
+    """
+    用一次 cv2.LUT 调用对三通道 uint8 图像应用查找表。
+
+    参数：
+    - image: (H, W, 3) 的 uint8 图像
+    - lut: (256, 3) 的 uint8 查找表
+
+    返回：
+    - 变换后的图像
+    """
+    return cv2.LUT(image, np.ascontiguousarray(lut).reshape(1, 256, 3))
@@ -0,0 +1,382 @@
+import unittest
+
+
+def make_dataset(folder, count=6):
+    """
+    在 folder 中生成 count 张 48x32 的随机 PNG 图像及其 labelme 标注（一个检测框和一对左右关键点）。
+    """
+    import json
+    import os
+
+    import cv2
+    import numpy as np
+
+    os.makedirs(folder, exist_ok=True)
+    random_state = np.random.RandomState(0)
+    for index in range(count):
+        name = "image_{}".format(index)
+        cv2.imwrite(os.path.join(folder, name + ".png"), random_state.randint(0, 256, (32, 48, 3), dtype=np.uint8))
+        data = {
+            "version": "5.0.1",
+            "flags": {},
+            "shapes": [
+                {"label": "horse", "points": [[4.0, 6.0], [20.0, 18.0]], "shape_type": "rectangle"},
+                {"label": "L_Eye", "points": [[10.0, 8.0]], "shape_type": "point"},
+                {"label": "R_Eye", "points": [[30.0, 8.0]], "shape_type": "point"},
+            ],
+            "imagePath": name + ".png",
+            "imageData": None,
+            "imageHeight": 32,
+            "imageWidth": 48,
+        }
+        with open(os.path.join(folder, name + ".json"), "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+
+def read_dataset(folder):
+    """
+    返回 folder 中图像和标注文件的内容 {文件名: 字节}。
+    """
+    import os
+
+    contents = {}
+    for name in sorted(os.listdir(folder)):
+        if name.endswith((".png", ".json")):
+            with open(os.path.join(folder, name), "rb") as f:
+                contents[name] = f.read()
+    return contents
+
+
+class Tests(unittest.TestCase):
+
+    def test_single_pass(self):
+        import json
+        import os
+        import tempfile
+
+        import cv2
+
+        import Aug_v2
+
+        with tempfile.TemporaryDirectory() as folder:
+            make_dataset(folder)
+            image_paths = sorted(Aug_v2.list_image_paths(folder))
+            self.assertEqual(len(image_paths), 6)
+
+            # 每个操作选择 1/3 的图像，每张图像的操作顺序与 operations 一致
+            plan = Aug_v2.build_operation_plan(image_paths)
+            operation_names = [name for name, _ in Aug_v2.operations]
+            for name in operation_names:
+                self.assertEqual(sum(name in names for names in plan.values()), 2)
+            for names in plan.values():
+                self.assertEqual(names, sorted(names, key=operation_names.index))
+
+            img_path = image_paths[0]
+            image = cv2.imread(img_path)
+            Aug_v2.process_single_image(img_path, ["水平翻转"])
+            self.assertTrue((cv2.imread(img_path) == cv2.flip(image, 1)).all())
+            with open(os.path.splitext(img_path)[0] + ".json", encoding="utf-8") as f:
+                self.assertEqual(json.load(f)["shapes"][0]["points"], [[28.0, 6.0], [44.0, 18.0]])
+
+    def test_seeded_workers(self):
+        import os
+        import shutil
+        import tempfile
+        from unittest import mock
+
+        import Aug_pose
+        import Aug_v2
+
+        for module in (Aug_v2, Aug_pose):
+            with tempfile.TemporaryDirectory() as root, \
+                    mock.patch.multiple(module.overlay_operations["添加下雨效果"], cache_dir=None), \
+                    mock.patch.multiple(module.overlay_operations["模拟夕阳效果"], cache_dir=None):
+                make_dataset(os.path.join(root, "original"))
+                results = []
+                for workers in (1, 2, 1):
+                    folder = os.path.join(root, "workers_{}_{}".format(workers, len(results)))
+                    shutil.copytree(os.path.join(root, "original"), folder)
+                    module.process_images(folder, single_pass=True, workers=workers, seed=7)
+                    results.append(read_dataset(folder))
+
+                # 相同的种子得到完全相同的结果，与进程数无关
+                self.assertEqual(results[0], results[1])
+                self.assertEqual(results[0], results[2])
+                self.assertNotEqual(results[0], read_dataset(os.path.join(root, "original")))
+
+    def test_image_data(self):
+        import base64
+        import json
+        import os
+        import tempfile
+
+        import Aug_v2
+
+        with tempfile.TemporaryDirectory() as folder:
+            make_dataset(folder)
+            original = read_dataset(folder)
+            img_path = os.path.join(folder, "image_0.png")
+            json_path = os.path.join(folder, "image_0.json")
+
+            Aug_v2.process_single_image(img_path, ["反转图像颜色"], image_data_mode="embed")
+            with open(json_path, encoding="utf-8") as f:
+                image_data = json.load(f)["imageData"]
+            with open(img_path, "rb") as f:
+                self.assertEqual(base64.b64decode(image_data), f.read())
+
+            Aug_v2.process_single_image(img_path, ["反转图像颜色"], image_data_mode="null")
+            with open(json_path, encoding="utf-8") as f:
+                self.assertIsNone(json.load(f)["imageData"])
+
+            # 只重写被增强图像的标注文件
+            contents = read_dataset(folder)
+            for name in original:
+                if not name.startswith("image_0."):
+                    self.assertEqual(contents[name], original[name])
+
+            with self.assertRaises(ValueError):
+                Aug_v2.process_images_single_pass(folder, seed=0, image_data_mode="base64")
+
+    def test_labelme_geometry(self):
+        import numpy as np
+
+        from labelme_geometry import flip_matrix, pack_shapes, transform_annotation, unpack_shapes
+
+        shapes = [
+            {"label": "horse", "points": [[4, 6], [20, 18]], "shape_type": "rectangle"},
+            {"label": "Nose", "points": [[10, 8]], "shape_type": "point"},
+            {"label": "leg", "points": [[1, 1], [5, 1], [5, 5]], "shape_type": None},
+        ]
+        points, counts = pack_shapes(shapes)
+        self.assertEqual(counts, [4, 1, 3])
+        self.assertEqual(points.shape, (8, 2))
+        self.assertEqual(unpack_shapes(shapes, points, counts), [
+            {"label": "horse", "points": [[4.0, 6.0], [20.0, 18.0]], "shape_type": "rectangle"},
+            {"label": "Nose", "points": [[10.0, 8.0]], "shape_type": "point"},
+            {"label": "leg", "points": [[1.0, 1.0], [5.0, 1.0], [5.0, 5.0]], "shape_type": None},
+        ])
+
+        data = {"shapes": shapes, "imageHeight": 32, "imageWidth": 48}
+        transform_annotation(data, flip_matrix("horizontal", 48, 32))
+        self.assertEqual(data["shapes"][0]["points"], [[28.0, 6.0], [44.0, 18.0]])
+        self.assertEqual(data["shapes"][1]["points"], [[38.0, 8.0]])
+        self.assertEqual(data["shapes"][2]["points"], [[47.0, 1.0], [43.0, 1.0], [43.0, 5.0]])
+
+        # 平移后裁剪到图像范围内，落在图像外的关键点被删除
+        shift = np.array([[1, 0, -12], [0, 1, 0], [0, 0, 1]], dtype=np.float64)
+        data = {"shapes": shapes}
+        transform_annotation(data, shift, image_size=(32, 48))
+        self.assertEqual(data["shapes"][0]["points"], [[0.0, 6.0], [8.0, 18.0]])
+        self.assertEqual([shape["label"] for shape in data["shapes"]], ["horse", "leg"])
+        self.assertEqual(data["shapes"][1]["points"], [[0.0, 1.0], [0.0, 1.0], [0.0, 5.0]])
+        self.assertEqual((data["imageHeight"], data["imageWidth"]), (32, 48))
+
+    def test_flip_pairs(self):
+        import numpy as np
+
+        import Aug_pose
+        from labelme_geometry import build_flip_pairs
+
+        self.assertEqual(build_flip_pairs(["L_Eye", "R_Eye", "Nose", "L_Paw"]), {"L_Eye": "R_Eye", "R_Eye": "L_Eye"})
+
+        image = np.random.RandomState(0).randint(0, 256, (32, 48, 3), dtype=np.uint8)
+        shapes = [
+            {"label": "L_Eye", "points": [[10.0, 8.0]], "shape_type": "point"},
+            {"label": "R_Eye", "points": [[30.0, 8.0]], "shape_type": "point"},
+            {"label": "Nose", "points": [[20.0, 12.0]], "shape_type": "point"},
+        ]
+
+        # 水平翻转后，原来的左眼出现在右侧并标为 R_Eye
+        image_aug, flipped = Aug_pose.augment_sample(image, ["水平翻转"], shapes)
+        self.assertTrue((image_aug == image[:, ::-1]).all())
+        self.assertEqual([(shape["label"], shape["points"]) for shape in flipped], [
+            ("R_Eye", [[38.0, 8.0]]), ("L_Eye", [[18.0, 8.0]]), ("Nose", [[28.0, 12.0]]),
+        ])
+
+        # 翻转两次时左右不变
+        _, flipped = Aug_pose.augment_sample(image, ["垂直翻转", "水平翻转"], shapes)
+        self.assertEqual([(shape["label"], shape["points"]) for shape in flipped], [
+            ("L_Eye", [[38.0, 24.0]]), ("R_Eye", [[18.0, 24.0]]), ("Nose", [[28.0, 20.0]]),
+        ])
+
+        # 逐操作流程中的标注翻转同样交换标签
+        data = {"shapes": [dict(shape) for shape in shapes], "imageHeight": 32, "imageWidth": 48}
+        Aug_pose.flip_annotation_data(data, image.shape, "vertical")
+        self.assertEqual([(shape["label"], shape["points"]) for shape in data["shapes"]], [
+            ("R_Eye", [[10.0, 24.0]]), ("L_Eye", [[30.0, 24.0]]), ("Nose", [[20.0, 20.0]]),
+        ])
+
+    def test_photometric_lut(self):
+        import random
+
+        import albumentations as A
+        import numpy as np
+
+        from photometric_lut import apply_lut, compose_lut, gamma_lut, invert_lut, rgb_shift_lut
+
+        image = np.random.RandomState(0).randint(0, 256, (32, 48, 3), dtype=np.uint8)
+        self.assertTrue((apply_lut(image, invert_lut()) == A.InvertImg(p=1)(image=image)["image"]).all())
+
+        # 合并后的查找表与依次应用各个查找表的结果一致
+        rng = random.Random(0)
+        luts = [gamma_lut(rng=rng), rgb_shift_lut(rng=rng), invert_lut(), gamma_lut(rng=rng)]
+        sequential = image
+        fused = luts[0]
+        for lut in luts:
+            sequential = apply_lut(sequential, lut)
+        for lut in luts[1:]:
+            fused = compose_lut(fused, lut)
+        self.assertTrue((apply_lut(image, fused) == sequential).all())
+
+    def test_overlay_bank(self):
+        import os
+        import random
+        import tempfile
+
+        import numpy as np
+
+        import Aug_v2
+        from overlay_bank import OverlayBank
+
+        image = np.random.RandomState(0).randint(0, 256, (32, 48, 3), dtype=np.uint8)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            bank = OverlayBank("rain", Aug_v2.add_rain_effect(), num_layers=4, cache_dir=cache_dir)
+            self.assertEqual(bank.layer_shape(32, 48), (40, 60))
+            layers = bank.get_layers(32, 48)
+            self.assertEqual(layers.shape, (4, 40, 60, 3))
+            self.assertTrue(os.path.exists(bank.cache_path(32, 48)))
+
+            # 另一个进程中的图层库从磁盘缓存读取相同的图层
+            cached = OverlayBank("rain", Aug_v2.add_rain_effect(), num_layers=4, cache_dir=cache_dir)
+            self.assertTrue((cached.get_layers(32, 48) == layers).all())
+            self.assertEqual(bank.apply(image, random.Random(1)).shape, image.shape)
+            self.assertTrue((bank.apply(image, random.Random(1)) == cached.apply(image, random.Random(1))).all())
+
+        # max_bytes 放不下全部图层时减少图层数，多种分辨率超出上限时丢弃最久未使用的分辨率
+        bank = OverlayBank("rain", Aug_v2.add_rain_effect(), num_layers=4, cache_dir=None, max_bytes=2 * 40 * 60 * 3)
+        self.assertEqual(bank.layer_count(32, 48), 2)
+        self.assertEqual(bank.layer_count(320, 480), 1)
+        bank.get_layers(32, 48)
+        bank.get_layers(24, 40)
+        self.assertEqual(list(bank.layers), [(24, 40)])
+
+    def test_manifest_resume_replay(self):
+        import os
+        import shutil
+        import tempfile
+        from unittest import mock
+
+        import Aug_v2
+        from aug_manifest import MANIFEST_NAME, load_manifest
+
+        with tempfile.TemporaryDirectory() as root, \
+                mock.patch.multiple(Aug_v2.overlay_operations["添加下雨效果"], cache_dir=None), \
+                mock.patch.multiple(Aug_v2.overlay_operations["模拟夕阳效果"], cache_dir=None):
+            original = os.path.join(root, "original")
+            folder = os.path.join(root, "augmented")
+            make_dataset(original)
+            shutil.copytree(original, folder)
+            Aug_v2.process_images_single_pass(folder, seed=3)
+            augmented = read_dataset(folder)
+
+            manifest_path = os.path.join(folder, MANIFEST_NAME)
+            manifest = load_manifest(manifest_path)
+            self.assertEqual(manifest["run"]["seed"], 3)
+            self.assertEqual(len(manifest["plans"]), 6)
+            selected = {name for name, entry in manifest["plans"].items() if entry["operations"]}
+            self.assertEqual(manifest["done"], selected)
+
+            # 中断在写入图像之后、记录完成之前：再次运行时不重新处理，只补记完成
+            with open(manifest_path, encoding="utf-8") as f:
+                lines = f.readlines()
+            with open(manifest_path, "w", encoding="utf-8") as f:
+                f.writelines(lines[:-1])
+            with mock.patch.object(Aug_v2.pipeline, "process_image") as process_image:
+                Aug_v2.process_images_single_pass(folder, seed=3)
+                process_image.assert_not_called()
+            self.assertEqual(load_manifest(manifest_path)["done"], selected)
+            self.assertEqual(read_dataset(folder), augmented)
+
+            # 新增的图像在下一次运行时按清单中的种子抽取计划并处理
+            shutil.copy(os.path.join(original, "image_0.png"), os.path.join(folder, "image_9.png"))
+            Aug_v2.process_images_single_pass(folder, seed=None)
+            self.assertIn("image_9.png", load_manifest(manifest_path)["plans"])
+
+            # 在原始数据上重放清单，得到完全相同的结果
+            replayed = os.path.join(root, "replayed")
+            shutil.copytree(original, replayed)
+            Aug_v2.replay_manifest(manifest_path, replayed)
+            self.assertEqual(read_dataset(replayed), augmented)
+
+    def test_output_dir(self):
+        import os
+        import shutil
+        import tempfile
+        from unittest import mock
+
+        import Aug_v2
+        from aug_manifest import MANIFEST_NAME, load_manifest
+
+        with tempfile.TemporaryDirectory() as root, \
+                mock.patch.multiple(Aug_v2.overlay_operations["添加下雨效果"], cache_dir=None), \
+                mock.patch.multiple(Aug_v2.overlay_operations["模拟夕阳效果"], cache_dir=None):
+            original = os.path.join(root, "original")
+            in_place = os.path.join(root, "in_place")
+            output_dir = os.path.join(root, "output")
+            make_dataset(original)
+            shutil.copytree(original, in_place)
+            contents = read_dataset(original)
+
+            Aug_v2.process_images(original, single_pass=True, seed=5, output_dir=output_dir)
+            Aug_v2.process_images(in_place, single_pass=True, seed=5)
+
+            # 原始数据不变，结果与原地增强一致
+            self.assertEqual(read_dataset(original), contents)
+            self.assertFalse(os.path.exists(os.path.join(original, MANIFEST_NAME)))
+            self.assertEqual(read_dataset(output_dir), read_dataset(in_place))
+
+            # 未被选中的图像和标注文件是指向原文件的硬链接，被增强的图像是新文件
+            plans = load_manifest(os.path.join(output_dir, MANIFEST_NAME))["plans"]
+            for name, entry in plans.items():
+                json_name = os.path.splitext(name)[0] + ".json"
+                for file_name in (name, json_name):
+                    linked = os.path.samefile(os.path.join(original, file_name), os.path.join(output_dir, file_name))
+                    self.assertEqual(linked, not entry["operations"])
+
+            with self.assertRaises(ValueError):
+                Aug_v2.process_images(original, output_dir=output_dir)
+
+    def test_augmented_samples(self):
+        import operator
+        import os
+        import tempfile
+        from unittest import mock
+
+        import Aug_pose
+        from aug_stream import prefetch_map
+
+        self.assertEqual(list(prefetch_map(operator.neg, range(10), workers=2, prefetch=3)),
+                         [-index for index in range(10)])
+
+        with tempfile.TemporaryDirectory() as folder, \
+                mock.patch.multiple(Aug_pose.overlay_operations["添加下雨效果"], cache_dir=None), \
+                mock.patch.multiple(Aug_pose.overlay_operations["模拟夕阳效果"], cache_dir=None):
+            make_dataset(folder)
+            contents = read_dataset(folder)
+            samples = list(Aug_pose.iter_augmented_samples(folder, workers=1, seed=11, epochs=2))
+            self.assertEqual(len(samples), 12)
+            for image, shapes in samples:
+                self.assertEqual(image.shape, (32, 48, 3))
+                self.assertEqual(sorted(shape["label"] for shape in shapes), ["L_Eye", "R_Eye", "horse"])
+
+            # 相同的种子得到相同的样本序列，与进程数无关，也不修改磁盘上的文件
+            parallel = list(Aug_pose.iter_augmented_samples(folder, workers=2, seed=11, epochs=2, prefetch=2))
+            self.assertEqual(len(parallel), len(samples))
+            for (image, shapes), (parallel_image, parallel_shapes) in zip(samples, parallel):
+                self.assertTrue((image == parallel_image).all())
+                self.assertEqual(shapes, parallel_shapes)
+            self.assertEqual(read_dataset(folder), contents)
+
+
+if __name__ == '__main__':
+    unittest.main()
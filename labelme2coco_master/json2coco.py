@@ -4,30 +4,51 @@ import json
 import argparse
 import random
 import numpy as np
-from PIL import Image, ImageDraw
 from sklearn.model_selection import train_test_split
 
 # 假设 labelme2coco.utils 和 labelme2coco.image_utils 模块已存在
 # 如果不存在，请确保这些模块的功能已被正确实现
 from labelme2coco.utils import create_dir, list_jsons_recursively
-from labelme2coco.image_utils import read_image_shape_as_dict
+from labelme2coco.image_utils import ImageSizeCache
+from labelme2coco.coco_writer import CocoWriter
+from labelme2coco.labelme_io import load_labelme_json
+from labelme2coco.categories import CategoryRegistry
+from labelme2coco.incremental import (
+    diff_files, load_manifest, manifest_path_for, new_manifest, patch_coco_json, read_coco_json, save_manifest
+)
+from labelme2coco.geometry import polygon_areas, polygon_bboxes, polygon_rle, raster_bbox, shape_polygon
 
 
 class Labelme2COCO:
-    def __init__(self, labelme_folder='', save_json_path='./new.json'):
+    def __init__(self, labelme_folder='', save_json_path='./new.json', bbox_mode='analytic',
+                 segmentation_format='polygon', indent=None, category_registry=None, image_size_cache=None):
         """
         Args:
             labelme_folder: folder that contains labelme annotations and image files
             save_json_path: path for coco json to be saved
+            bbox_mode: 'analytic' 由多边形顶点计算边界框，'raster' 计算多边形绘制后覆盖像素的边界框
+            segmentation_format: 'polygon' 保存顶点列表，'rle' 保存多边形绘制后的压缩 RLE
+            indent: 保存的 json 的缩进，None 时保存为紧凑格式；路径以 .gz 结尾时保存为 gzip 压缩文件
+            category_registry: 多个数据集共用的 CategoryRegistry，保证各数据集的类别 ID 一致；
+                None 时按本文件夹中排序后的标签编号
+            image_size_cache: 按路径、文件大小和修改时间缓存图像尺寸的 json 文件，None 时只缓存在内存中
         """
+        if bbox_mode not in ('analytic', 'raster'):
+            raise ValueError(f"不支持的 bbox_mode：{bbox_mode}")
+        if segmentation_format not in ('polygon', 'rle'):
+            raise ValueError(f"不支持的 segmentation_format：{segmentation_format}")
+        self.bbox_mode = bbox_mode
+        self.segmentation_format = segmentation_format
+        self.indent = indent
         self.save_json_path = save_json_path
+        self.labelme_folder = labelme_folder
         self.images = []
         self.categories = []
         self.annotations = []
-        self.label_set = set()
         self.annID = 1
         self.height = 0
         self.width = 0
+        self.image_sizes = ImageSizeCache(image_size_cache)
 
         # Create save directory
         save_json_dir = os.path.dirname(save_json_path)
@@ -37,27 +58,69 @@ class Labelme2COCO:
         _, labelme_json = list_jsons_recursively(labelme_folder)
         self.labelme_json = labelme_json
 
-    def data_transfer(self):
+        # 类别 ID 在写入标注之前确定，标注中的 category_id 用字典查找
+        if category_registry is None:
+            category_registry = CategoryRegistry.from_policy('sorted', labelme_json)
+        self.category_registry = category_registry
+
+    def data_transfer(self, writer=None):
+        """
+        Args:
+            writer: CocoWriter，转换后的图像和标注直接写入文件；None 时保存在 self.images 和 self.annotations 中
+        """
         for num, json_path in enumerate(self.labelme_json):
-            print(json_path)
-            with open(json_path, 'r', encoding='utf-8') as fp:
-                # Load JSON
-                data = json.load(fp)
-                self.images.append(self.image(data, num, json_path))
-                for shapes in data.get('shapes', []):
-                    label = shapes['label']
-                    self.label_set.add(label)
-                    points = shapes['points']
-                    self.annotations.append(self.annotation(points, label, num))
-                    self.annID += 1
+            self.add_file(num, json_path, writer)
+
+    def add_file(self, num, json_path, writer=None):
+        """
+        转换一个 labelme 文件，其图像 ID 为 num + 1
+
+        Returns:
+            该文件生成的标注 ID 列表
+        """
+        print(json_path)
+        # 读取 JSON（跳过 imageData）
+        data = load_labelme_json(json_path)
+        image = self.image(data, num, json_path)
+        if writer is None:
+            self.images.append(image)
+        else:
+            writer.add_image(image)
+        shapes_list = data.get('shapes', [])
+        annotation_ids = []
+        if self.bbox_mode == 'analytic':
+            # 一次计算该文件所有形状的边界框
+            bboxes = polygon_bboxes([shapes['points'] for shapes in shapes_list])
+        else:
+            bboxes = [None] * len(shapes_list)
+        # 矩形展开为四个角点后，用鞋带公式一次计算所有形状的面积
+        polygons = [shape_polygon(shapes) for shapes in shapes_list]
+        areas = polygon_areas(polygons)
+        for shapes, bbox, polygon, area in zip(shapes_list, bboxes, polygons, areas):
+            label = shapes['label']
+            if self.category_registry.add(label) is None:
+                continue  # 不在 labels.txt 中的标签
+            points = shapes['points']
+            annotation = self.annotation(points, label, num, bbox, area, polygon)
+            if writer is None:
+                self.annotations.append(annotation)
+            else:
+                writer.add_annotation(annotation)
+            annotation_ids.append(annotation['id'])
+            self.annID += 1
+        return annotation_ids
 
     def image(self, data, num, json_path):
         image = {}
         # Get image path
         _, img_extension = os.path.splitext(data["imagePath"])
         image_path = os.path.join(os.path.dirname(json_path), data["imagePath"])
-        img_shape = read_image_shape_as_dict(image_path)
-        height, width = img_shape['height'], img_shape['width']
+        # 优先使用 labelme 文件中的 imageHeight/imageWidth，缺失时只读取图像文件头
+        height, width = data.get('imageHeight'), data.get('imageWidth')
+        if height and width:
+            height, width = int(height), int(width)
+        else:
+            width, height = self.image_sizes.get(image_path)
 
         image['height'] = height
         image['width'] = width
@@ -70,65 +133,48 @@ class Labelme2COCO:
         return image
 
     def category(self, label):
-        category = {}
-        category['supercategory'] = label
-        category['id'] = int(len(self.label_set))  # ID 从1开始
-        category['name'] = label
+        return self.category_registry.category(label)  # ID 从1开始
 
-        return category
-
-    def annotation(self, points, label, num):
+    def annotation(self, points, label, num, bbox=None, area=None, polygon=None):
         annotation = {}
         annotation['iscrowd'] = 0
         annotation['image_id'] = int(num + 1)
 
-        annotation['bbox'] = list(map(float, self.getbbox(points)))
+        if bbox is None:
+            bbox = self.getbbox(points)
+        annotation['bbox'] = list(map(float, bbox))
 
         # Coarsely from bbox to segmentation
         x = annotation['bbox'][0]
         y = annotation['bbox'][1]
         w = annotation['bbox'][2]
         h = annotation['bbox'][3]
-        annotation['segmentation'] = [np.asarray(points).flatten().tolist()]
+        if polygon is None:
+            polygon = points
+        if self.segmentation_format == 'rle':
+            annotation['segmentation'] = polygon_rle(polygon, self.height, self.width)
+        else:
+            annotation['segmentation'] = [np.asarray(points).flatten().tolist()]
 
         annotation['category_id'] = self.getcatid(label)
         annotation['id'] = int(self.annID)
         # Add area info
-        annotation['area'] = float(w * h)  # 使用边界框面积
+        if area is None:
+            area = polygon_areas([polygon])[0]
+        annotation['area'] = float(area)  # 多边形面积
 
         return annotation
 
     def getcatid(self, label):
-        for categorie in self.categories:
-            if label == categorie['name']:
-                return categorie['id']
-        return 1
+        return self.category_registry.get(label)
 
     def getbbox(self, points):
-        polygons = points
-        mask = self.polygons_to_mask([self.height, self.width], polygons)
-        return self.mask2box(mask)
-
-    def mask2box(self, mask):
-        index = np.argwhere(mask == 1)
-        rows = index[:, 0]
-        cols = index[:, 1]
-
-        left_top_r = np.min(rows)  # y
-        left_top_c = np.min(cols)  # x
-
-        right_bottom_r = np.max(rows)
-        right_bottom_c = np.max(cols)
-
-        return [left_top_c, left_top_r, right_bottom_c - left_top_c, right_bottom_r - left_top_r]  # [x1,y1,w,h]
-
-    def polygons_to_mask(self, img_shape, polygons):
-        mask = np.zeros(img_shape, dtype=np.uint8)
-        mask = Image.fromarray(mask)
-        xy = list(map(tuple, polygons))
-        ImageDraw.Draw(mask).polygon(xy=xy, outline=1, fill=1)
-        mask = np.array(mask, dtype=bool)
-        return mask
+        if self.bbox_mode == 'raster':
+            # 只在多边形附近的区域绘制，结果与在整张图像上绘制相同
+            bbox = raster_bbox(points, self.height, self.width)
+            if bbox is not None:
+                return bbox
+        return polygon_bboxes([points])[0]  # [x1,y1,w,h]
 
     def data2coco(self):
         data_coco = {}
@@ -138,18 +184,55 @@ class Labelme2COCO:
         return data_coco
 
     def save_json(self):
-        self.data_transfer()
+        # 图像和标注在转换时直接写入文件，不在内存中累积；类别在最后写入
+        with CocoWriter(self.save_json_path, indent=self.indent, cls=MyEncoder) as writer:
+            self.data_transfer(writer)
 
-        # Create categories
-        sorted_labels = sorted(self.label_set)
-        self.categories = []
-        for idx, label in enumerate(sorted_labels, start=1):
-            self.categories.append(self.category(label))
+            # Create categories
+            self.categories = self.category_registry.categories()
+            for category in self.categories:
+                writer.add_category(category)
+        self.image_sizes.save()
 
-        self.data_coco = self.data2coco()
+    def update_json(self):
+        """
+        增量转换：只转换上次运行后新增或修改的 labelme 文件，并修补已有的 COCO JSON。
 
-        with open(self.save_json_path, 'w', encoding='utf-8') as f:
-            json.dump(self.data_coco, f, indent=4, separators=(',', ': '), cls=MyEncoder)
+        清单保存在 COCO JSON 旁边（<save_json_path>.manifest.json）。修改和删除的文件的图像和标注被删除，
+        修改的文件保留图像 ID，新的标注使用从未用过的 ID。没有清单，或清单由其他选项或类别表生成时，转换所有文件。
+        """
+        manifest_path = manifest_path_for(self.save_json_path)
+        # 类别表变化会改变未修改文件的 category_id，此时转换所有文件
+        options = {'bbox_mode': self.bbox_mode, 'segmentation_format': self.segmentation_format,
+                   'categories': self.category_registry.categories()}
+        manifest = load_manifest(manifest_path, options) if os.path.exists(self.save_json_path) else None
+        up_to_date_possible = manifest is not None
+        if manifest is None:
+            manifest = new_manifest(options)
+            coco = {'images': [], 'annotations': [], 'categories': []}
+        else:
+            coco = read_coco_json(self.save_json_path)
+
+        files, changed, removed = diff_files(manifest, self.labelme_json, self.labelme_folder)
+        if up_to_date_possible and not changed and not removed:
+            print(f"{self.save_json_path} 已是最新。")
+            return
+
+        # 类别在转换后按类别表写入
+        coco['categories'] = []
+        self.annID = manifest['next_annotation_id']
+        with patch_coco_json(self.save_json_path, coco, removed, indent=self.indent, cls=MyEncoder) as writer:
+            for key, json_path in changed:
+                files[key]['annotation_ids'] = self.add_file(files[key]['image_id'] - 1, json_path, writer)
+            self.categories = self.category_registry.categories()
+            for category in self.categories:
+                writer.add_category(category)
+
+        manifest['files'] = files
+        manifest['next_annotation_id'] = self.annID
+        save_manifest(manifest_path, manifest)
+        self.image_sizes.save()
+        print(f"{self.save_json_path}: 转换了 {len(changed)} 个 labelme 文件，删除了 {len(removed)} 个。")
 
 
 # Type check when saving JSON files
@@ -228,7 +311,8 @@ def generate_labels_txt(annotations_dir, labels_txt_path):
 
     # 遍历所有 COCO JSON 文件
     for json_file in os.listdir(annotations_dir):
-        if json_file.endswith('.json'):
+        # 跳过增量转换的清单文件
+        if json_file.endswith('.json') and not json_file.endswith('.manifest.json'):
             json_path = os.path.join(annotations_dir, json_file)
             with open(json_path, 'r', encoding='utf-8') as f:
                 data = json.load(f)
@@ -253,11 +337,20 @@ def main(total_data_dir):
     parser.add_argument('--ratios', type=float, nargs=3, default=[0.7, 0.2, 0.1],
                         help='train, val, test 数据集的比例 (默认为 0.7, 0.2, 0.1)')
     parser.add_argument('--input_dir', type=str, default='', help='原始输入文件夹路径，包含所有图像和 JSON 文件')
+    parser.add_argument('--labels_file', type=str, default='',
+                        help='labels.txt 路径，指定时按其中的顺序编号类别并忽略其他标签；默认按所有数据集中排序后的标签编号')
+    parser.add_argument('--incremental', action='store_true',
+                        help='增量转换：只转换上次运行后新增或修改的 JSON 文件，并修补已有的 instances_{split}.json')
+    parser.add_argument('--image_size_cache', type=str, default='',
+                        help='图像尺寸缓存文件路径，用于 labelme 文件缺少 imageHeight/imageWidth 时；默认不保存缓存')
     args = parser.parse_args()
 
     total_target_dir = args.total_target_dir
     ratios = args.ratios
     input_dir = args.input_dir
+    labels_file = args.labels_file
+    image_size_cache = args.image_size_cache or None
+    incremental = args.incremental
 
     if input_dir:
         # 如果指定了 input_dir，则先进行数据划分
@@ -271,6 +364,18 @@ def main(total_data_dir):
 
     # 处理每个 split 文件夹
     splits = ['train', 'val', 'test']
+
+    # 所有 split 共用一个类别表，保证 train/val/test 的类别 ID 一致
+    split_jsons = []
+    for split in splits:
+        split_folder = os.path.join(total_target_dir, split)
+        if os.path.exists(split_folder):
+            split_jsons.extend(list_jsons_recursively(split_folder)[1])
+    if labels_file:
+        category_registry = CategoryRegistry.from_policy('labels_file', labels_file=labels_file)
+    else:
+        category_registry = CategoryRegistry.from_policy('sorted', split_jsons)
+
     for split in splits:
         split_folder = os.path.join(total_target_dir, split)
         if not os.path.exists(split_folder):
@@ -281,8 +386,12 @@ def main(total_data_dir):
         save_json_path = os.path.join(annotations_dir, f"instances_{split}.json")
 
         print(f"正在转换 {split} 集合...")
-        converter = Labelme2COCO(labelme_folder=split_folder, save_json_path=save_json_path)
-        converter.save_json()
+        converter = Labelme2COCO(labelme_folder=split_folder, save_json_path=save_json_path,
+                                 category_registry=category_registry, image_size_cache=image_size_cache)
+        if incremental:
+            converter.update_json()
+        else:
+            converter.save_json()
         print(f"{split} 集合转换完成，COCO JSON 保存至 {save_json_path}")
 
     # 生成 labels.txt
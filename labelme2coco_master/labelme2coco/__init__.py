@@ -3,12 +3,38 @@ from __future__ import absolute_import
 __version__ = "0.1.2"
 
 from labelme2coco.labelme2coco import labelme2coco
+from labelme2coco.image_utils import IMAGE_SIZE_CACHE_PATH
+from labelme2coco.columnar import export_columnar, load_columnar
+from labelme2coco.categories import CategoryRegistry
 
 
-def convert(labelme_folder: str, save_json_path: str):
+def convert(labelme_folder: str, save_json_path: str, bbox_mode: str = 'analytic',
+            segmentation_format: str = 'polygon', indent: int = None, workers: int = 1,
+            image_size: str = 'check', image_size_cache: str = 'auto', incremental: bool = False,
+            category_ids: str = 'first_seen', labels_file: str = None):
     """
     Args:
         labelme_folder: folder that contains labelme annotations and image files
         save_json_path: oath for coco json to be saved
+        bbox_mode: 'analytic' computes boxes from polygon vertices,
+            'raster' computes pixel-snapped boxes of the polygons drawn on the image
+        segmentation_format: 'polygon' saves vertex lists,
+            'rle' saves compressed coco rle of the polygons drawn on the image
+        indent: indent of the saved json, None saves compact json. Paths ending with '.gz' are saved gzip compressed
+        workers: number of processes that convert labelme files, the output does not depend on it
+        image_size: 'json' trusts imageHeight/imageWidth of the labelme files and reads the image only
+            when they are missing, 'check' reads the image header and warns when the labelme file
+            disagrees, 'image' reads the image header
+        image_size_cache: json file that caches image sizes by path, file size and mtime across runs.
+            'auto' keeps it next to save_json_path, so converting an unchanged folder again opens no image;
+            IMAGE_SIZE_CACHE_PATH shares one cache between datasets. None keeps the cache in memory
+        incremental: keep a manifest next to save_json_path and on later runs only convert the labelme files
+            added or changed since the previous run, patching the existing coco json
+        category_ids: 'first_seen' numbers the labels in the order they are met, 'sorted' numbers the sorted
+            labels, 'labels_file' numbers the labels of labels_file (one per line) and ignores the others.
+            Use a labels file to get the same ids in every split
+        labels_file: labels.txt used by category_ids='labels_file'
     """
-    labelme2coco(labelme_folder, save_json_path)
+    labelme2coco(labelme_folder, save_json_path, bbox_mode=bbox_mode, segmentation_format=segmentation_format,
+                 indent=indent, workers=workers, image_size=image_size, image_size_cache=image_size_cache,
+                 incremental=incremental, category_ids=category_ids, labels_file=labels_file)
@@ -0,0 +1,131 @@
+from labelme2coco.labelme_io import load_labelme_json
+
+
+# 'first_seen': ids in the order labels are met, 'sorted': ids of the sorted labels of all files,
+# 'labels_file': ids in the order of a labels.txt, labels missing from it are ignored
+CATEGORY_ID_POLICIES = ('first_seen', 'sorted', 'labels_file')
+
+
+def read_labels_file(labels_file):
+    """
+    Reads a labels.txt with one label per line, skipping empty lines and labels starting with '_'
+    such as __ignore__ and __background__.
+    """
+    labels = []
+    with open(labels_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            label = line.strip()
+            if label and not label.startswith('_'):
+                labels.append(label)
+    return labels
+
+
+def scan_labels(json_paths):
+    """
+    Returns the labels of all shapes of the labelme files, in the order they are met.
+    """
+    labels = {}
+    for json_path in json_paths:
+        for shape in load_labelme_json(json_path).get('shapes', []):
+            labels.setdefault(shape['label'], None)
+    return list(labels)
+
+
+class CategoryRegistry(object):
+    """
+    Maps labels to category ids with dict lookups.
+
+    A registry built for several splits gives the same ids in all of them. A frozen registry
+    does not add labels: get and add return None for unknown labels, which are then ignored.
+    """
+
+    def __init__(self, labels=(), start_id=1, frozen=False):
+        """
+        Args:
+            labels: labels registered first, in id order
+            start_id: id of the first label, 1 for coco and 0 for yolo
+            frozen: do not register labels that are not in labels
+        """
+        self.start_id = start_id
+        self.labels = []
+        self.ids = {}
+        self.frozen = False
+        self.ignored = set()
+        for label in labels:
+            self.add(label)
+        self.frozen = frozen
+
+    @classmethod
+    def from_policy(cls, policy='first_seen', json_paths=(), labels_file=None, start_id=1):
+        """
+        Builds the registry of a category id policy.
+
+        Args:
+            policy: one of CATEGORY_ID_POLICIES
+            json_paths: labelme files of all splits, scanned for the 'sorted' policy
+            labels_file: labels.txt of the 'labels_file' policy
+            start_id: id of the first label
+        """
+        if policy not in CATEGORY_ID_POLICIES:
+            raise ValueError("category_ids should be one of {}, got {}".format(CATEGORY_ID_POLICIES, policy))
+        if policy == 'labels_file':
+            if labels_file is None:
+                raise ValueError("category_ids='labels_file' needs a labels_file")
+            return cls(read_labels_file(labels_file), start_id=start_id, frozen=True)
+        if policy == 'sorted':
+            return cls(sorted(scan_labels(json_paths)), start_id=start_id)
+        return cls(start_id=start_id)
+
+    @classmethod
+    def from_categories(cls, categories, frozen=False):
+        """
+        Builds a registry from coco categories, keeping their ids.
+        """
+        registry = cls(frozen=frozen)
+        for category in categories:
+            registry.labels.append(category['name'])
+            registry.ids[category['name']] = category['id']
+        # labels added later get ids after the largest one
+        if categories:
+            registry.start_id = max(category['id'] for category in categories) + 1 - len(categories)
+        return registry
+
+    def __contains__(self, label):
+        return label in self.ids
+
+    def __len__(self):
+        return len(self.labels)
+
+    def get(self, label):
+        """
+        Returns the id of a label, None if it is not registered.
+        """
+        return self.ids.get(label)
+
+    def add(self, label):
+        """
+        Returns the id of a label, registering it if needed. Returns None for labels a frozen registry ignores.
+        """
+        category_id = self.ids.get(label)
+        if category_id is None:
+            if self.frozen:
+                if label not in self.ignored:
+                    self.ignored.add(label)
+                    print("warning: label {} is not in the labels file, its shapes are ignored".format(label))
+                return None
+            category_id = self.start_id + len(self.labels)
+            self.labels.append(label)
+            self.ids[label] = category_id
+        return category_id
+
+    def category(self, label):
+        """
+        Returns the coco category dict of a registered label.
+        """
+        return {'supercategory': label, 'id': self.ids[label], 'name': label}
+
+    def categories(self):
+        """
+        Returns the coco categories of all registered labels, in id order.
+        """
+        return [self.category(label) for label in self.labels]
@@ -0,0 +1,86 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+
+
+class CocoWriter(object):
+    """
+    Writes a coco json file incrementally, so memory does not grow with the dataset size.
+
+    Annotations are written to the output file as they are added, images are spooled to a
+    temporary file and categories are kept in memory; both are written when the writer is closed.
+    Paths ending with '.gz' are written gzip compressed.
+    """
+
+    def __init__(self, save_json_path, indent=None, cls=None):
+        """
+        Args:
+            save_json_path: path for coco json to be saved, gzip compressed if it ends with '.gz'
+            indent: indent of every element, None writes compact json
+            cls: json encoder class used for the elements
+        """
+        self.save_json_path = save_json_path
+        self.indent = indent
+        self.cls = cls
+        self.separators = (',', ':') if indent is None else (',', ': ')
+        self.categories = []
+        self.num_images = 0
+        self.num_annotations = 0
+
+        self.file = self._open(save_json_path, 'wt')
+        self.file.write('{"annotations":[')
+        save_json_dir = os.path.dirname(os.path.abspath(save_json_path))
+        self.images_file = tempfile.TemporaryFile('w+t', encoding='utf-8', dir=save_json_dir)
+
+    @staticmethod
+    def _open(path, mode):
+        if path.endswith('.gz'):
+            return gzip.open(path, mode, encoding='utf-8')
+        return open(path, mode, encoding='utf-8')
+
+    def _dumps(self, obj):
+        return json.dumps(obj, indent=self.indent, separators=self.separators, cls=self.cls)
+
+    def add_image(self, image):
+        if self.num_images:
+            self.images_file.write(',')
+        self.images_file.write(self._dumps(image))
+        self.num_images += 1
+
+    def add_annotation(self, annotation):
+        if self.num_annotations:
+            self.file.write(',')
+        self.file.write(self._dumps(annotation))
+        self.num_annotations += 1
+
+    def add_category(self, category):
+        self.categories.append(category)
+
+    def close(self):
+        """
+        Writes images and categories and closes the file.
+        """
+        if self.file is None:
+            return
+        self.file.write('],"images":[')
+        self.images_file.seek(0)
+        shutil.copyfileobj(self.images_file, self.file)
+        self.images_file.close()
+        self.file.write('],"categories":')
+        self.file.write(self._dumps(self.categories))
+        self.file.write('}')
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.images_file.close()
+            self.file.close()
+            self.file = None
@@ -0,0 +1,253 @@
+import json
+import os
+
+import numpy as np
+
+from labelme2coco.geometry import rle_to_string
+from labelme2coco.incremental import read_coco_json
+
+
+COLUMNAR_VERSION = 1
+HEADER_NAME = 'header.json'
+
+
+def _string_pool(strings):
+    """
+    Packs strings into one utf-8 byte array, string i is pool[offsets[i]:offsets[i + 1]].
+    """
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(item) for item in encoded])
+    pool = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return pool, offsets
+
+
+def _pool_string(pool, offsets, index):
+    return bytes(pool[offsets[index]:offsets[index + 1]]).decode('utf-8')
+
+
+def _segmentation_columns(annotations):
+    """
+    Packs polygon segmentations into a vertex pool and rle segmentations into a string pool.
+
+    Polygon j of the vertex pool is polygon_points[polygon_offsets[j]:polygon_offsets[j + 1]],
+    annotation i owns polygons annotation_polygons[i] to annotation_polygons[i + 1].
+    """
+    polygon_points = []
+    polygon_counts = []
+    polygons_per_annotation = []
+    rle_strings = []
+    for annotation in annotations:
+        segmentation = annotation.get('segmentation') or []
+        if isinstance(segmentation, dict):
+            counts = segmentation['counts']
+            rle_strings.append(counts if isinstance(counts, str) else rle_to_string(counts))
+            polygons_per_annotation.append(0)
+            continue
+        rle_strings.append('')
+        polygons_per_annotation.append(len(segmentation))
+        for polygon in segmentation:
+            polygon_points.extend(polygon)
+            polygon_counts.append(len(polygon) // 2)
+
+    polygon_offsets = np.zeros(len(polygon_counts) + 1, dtype=np.int64)
+    polygon_offsets[1:] = np.cumsum(polygon_counts)
+    annotation_polygons = np.zeros(len(polygons_per_annotation) + 1, dtype=np.int64)
+    annotation_polygons[1:] = np.cumsum(polygons_per_annotation)
+    rle_pool, rle_offsets = _string_pool(rle_strings)
+    return {
+        'polygon_points': np.asarray(polygon_points, dtype=np.float32).reshape(-1, 2),
+        'polygon_offsets': polygon_offsets,
+        'annotation_polygons': annotation_polygons,
+        'rle_pool': rle_pool,
+        'rle_offsets': rle_offsets,
+    }
+
+
+def export_columnar(coco, bundle_dir):
+    """
+    Exports a coco dataset as a bundle of raw numpy arrays that can be memory-mapped.
+
+    The bundle is a folder with one .npy file per column and a small header.json holding
+    the categories and the column list. Annotations are grouped by image, so the annotations
+    of image i are rows image_annotations[i] to image_annotations[i + 1] of every annotation column.
+
+    Args:
+        coco: coco dict, or path of a coco json file ('.gz' paths are read gzip compressed)
+        bundle_dir: folder for the bundle, created if it does not exist
+    Returns:
+        bundle_dir
+    """
+    if isinstance(coco, str):
+        coco = read_coco_json(coco)
+    images = coco.get('images', [])
+    annotations = coco.get('annotations', [])
+
+    image_ids = np.array([image['id'] for image in images], dtype=np.int64)
+    image_order = np.argsort(image_ids, kind='stable')
+    # index of the image of every annotation, then annotations grouped by image in image order
+    annotation_image_ids = np.array([annotation['image_id'] for annotation in annotations], dtype=np.int64)
+    sorted_image_ids = image_ids[image_order]
+    positions = np.searchsorted(sorted_image_ids, annotation_image_ids)
+    found = positions < len(images)
+    found[found] = sorted_image_ids[positions[found]] == annotation_image_ids[found]
+    if not found.all():
+        annotation = annotations[np.flatnonzero(~found)[0]]
+        raise ValueError("annotation {} refers to image_id {} that is not in images".format(
+            annotation.get('id'), annotation['image_id']))
+    image_index = image_order[positions]
+    annotation_order = np.argsort(image_index, kind='stable')
+    annotations = [annotations[index] for index in annotation_order]
+    image_annotations = np.zeros(len(images) + 1, dtype=np.int64)
+    image_annotations[1:] = np.cumsum(np.bincount(image_index, minlength=len(images)))
+
+    file_name_pool, file_name_offsets = _string_pool([image['file_name'] for image in images])
+    columns = {
+        'image_id': image_ids,
+        'image_order': image_order.astype(np.int64),
+        # image ids in increasing order, image_id[image_order], so lookups only binary search this column
+        'sorted_image_id': sorted_image_ids,
+        'width': np.array([image['width'] for image in images], dtype=np.int32),
+        'height': np.array([image['height'] for image in images], dtype=np.int32),
+        'file_name_pool': file_name_pool,
+        'file_name_offsets': file_name_offsets,
+        'image_annotations': image_annotations,
+        'annotation_id': np.array([annotation['id'] for annotation in annotations], dtype=np.int64),
+        'annotation_image_id': annotation_image_ids[annotation_order],
+        'category_id': np.array([annotation['category_id'] for annotation in annotations], dtype=np.int32),
+        'bbox': np.array([annotation['bbox'] for annotation in annotations], dtype=np.float32).reshape(-1, 4),
+        'area': np.array([annotation.get('area', 0) for annotation in annotations], dtype=np.float32),
+        'iscrowd': np.array([annotation.get('iscrowd', 0) for annotation in annotations], dtype=np.uint8),
+    }
+    columns.update(_segmentation_columns(annotations))
+
+    num_keypoints = max([len(annotation.get('keypoints', [])) // 3 for annotation in annotations], default=0)
+    if num_keypoints:
+        keypoints = np.zeros((len(annotations), num_keypoints, 3), dtype=np.float32)
+        for row, annotation in enumerate(annotations):
+            values = annotation.get('keypoints', [])
+            keypoints[row, :len(values) // 3] = np.asarray(values, dtype=np.float32).reshape(-1, 3)
+        columns['keypoints'] = keypoints
+        columns['num_keypoints'] = np.array([annotation.get('num_keypoints', 0) for annotation in annotations],
+                                            dtype=np.int32)
+
+    os.makedirs(bundle_dir, exist_ok=True)
+    for name, array in columns.items():
+        np.save(os.path.join(bundle_dir, name + '.npy'), array)
+
+    # the header is written last, a bundle without it is incomplete
+    header = {
+        'version': COLUMNAR_VERSION,
+        'num_images': len(images),
+        'num_annotations': len(annotations),
+        'num_keypoints': num_keypoints,
+        'categories': coco.get('categories', []),
+        'columns': {name: {'dtype': array.dtype.str, 'shape': list(array.shape)} for name, array in columns.items()},
+    }
+    header_path = os.path.join(bundle_dir, HEADER_NAME)
+    with open(header_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(header, f, ensure_ascii=False)
+    os.replace(header_path + '.tmp', header_path)
+    return bundle_dir
+
+
+class ColumnarCoco(object):
+    """
+    Memory-mapped view of a bundle written by export_columnar.
+
+    Columns are numpy arrays backed by the bundle files, so opening a bundle parses only the
+    header and processes reading the same bundle share its pages.
+    """
+
+    def __init__(self, bundle_dir, mmap_mode='r'):
+        """
+        Args:
+            bundle_dir: folder of the bundle
+            mmap_mode: numpy memory-map mode of the columns, None reads them into memory
+        """
+        with open(os.path.join(bundle_dir, HEADER_NAME), 'r', encoding='utf-8') as f:
+            self.header = json.load(f)
+        if self.header.get('version') != COLUMNAR_VERSION:
+            raise ValueError("unsupported columnar bundle version: {}".format(self.header.get('version')))
+        self.bundle_dir = bundle_dir
+        self.categories = self.header['categories']
+        self.columns = {
+            name: np.load(os.path.join(bundle_dir, name + '.npy'), mmap_mode=mmap_mode)
+            for name in self.header['columns']
+        }
+
+    def __len__(self):
+        return self.header['num_images']
+
+    def image_index(self, image_id):
+        """
+        Returns the index of the image with the given coco id.
+        """
+        sorted_image_ids = self.columns['sorted_image_id']
+        position = int(np.searchsorted(sorted_image_ids, image_id))
+        if position == len(sorted_image_ids) or sorted_image_ids[position] != image_id:
+            raise KeyError(image_id)
+        return int(self.columns['image_order'][position])
+
+    def image(self, index):
+        """
+        Returns the coco image dict of the image at index.
+        """
+        return {
+            'id': int(self.columns['image_id'][index]),
+            'file_name': _pool_string(self.columns['file_name_pool'], self.columns['file_name_offsets'], index),
+            'width': int(self.columns['width'][index]),
+            'height': int(self.columns['height'][index]),
+        }
+
+    def annotation_rows(self, index):
+        """
+        Returns the slice of annotation rows of the image at index.
+        """
+        image_annotations = self.columns['image_annotations']
+        return slice(int(image_annotations[index]), int(image_annotations[index + 1]))
+
+    def annotations(self, index):
+        """
+        Returns the annotation columns of the image at index, as views of the bundle.
+
+        Returns:
+            dict with 'id', 'category_id', 'bbox' (N, 4), 'area', 'iscrowd' and, for keypoint
+            datasets, 'keypoints' (N, K, 3) and 'num_keypoints'
+        """
+        rows = self.annotation_rows(index)
+        annotations = {
+            'id': self.columns['annotation_id'][rows],
+            'category_id': self.columns['category_id'][rows],
+            'bbox': self.columns['bbox'][rows],
+            'area': self.columns['area'][rows],
+            'iscrowd': self.columns['iscrowd'][rows],
+        }
+        if 'keypoints' in self.columns:
+            annotations['keypoints'] = self.columns['keypoints'][rows]
+            annotations['num_keypoints'] = self.columns['num_keypoints'][rows]
+        return annotations
+
+    def polygons(self, row):
+        """
+        Returns the polygons of annotation row as a list of (n, 2) arrays.
+        """
+        polygon_offsets = self.columns['polygon_offsets']
+        annotation_polygons = self.columns['annotation_polygons']
+        points = self.columns['polygon_points']
+        return [points[polygon_offsets[polygon]:polygon_offsets[polygon + 1]]
+                for polygon in range(annotation_polygons[row], annotation_polygons[row + 1])]
+
+    def rle(self, row):
+        """
+        Returns the compressed coco rle string of annotation row, None for polygon annotations.
+        """
+        counts = _pool_string(self.columns['rle_pool'], self.columns['rle_offsets'], row)
+        return counts or None
+
+
+def load_columnar(bundle_dir, mmap_mode='r'):
+    """
+    Opens a bundle written by export_columnar.
+    """
+    return ColumnarCoco(bundle_dir, mmap_mode=mmap_mode)
@@ -0,0 +1,55 @@
+import os
+import shutil
+
+
+# ioctl request that clones a file's extents on linux (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+# 'hardlink', 'symlink' and 'reflink' fall back to 'copy' when the file system does not support them
+LINK_MODES = ('hardlink', 'symlink', 'reflink', 'copy')
+
+
+def _reflink(src, dst):
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError("reflink is not supported on this platform")
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        except OSError:
+            dst_file.close()
+            os.remove(dst)
+            raise
+
+
+def materialize_file(src, dst, mode='copy'):
+    """
+    Places a file at dst without copying its data when possible.
+
+    Args:
+        src: source file path
+        dst: destination path, replaced if it exists
+        mode: one of LINK_MODES
+    Returns:
+        mode that was used, 'copy' when linking was not possible
+    """
+    if mode not in LINK_MODES:
+        raise ValueError("mode should be one of {}, got {}".format(LINK_MODES, mode))
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        if mode == 'hardlink':
+            os.link(src, dst)
+        elif mode == 'symlink':
+            os.symlink(os.path.abspath(src), dst)
+        elif mode == 'reflink':
+            _reflink(src, dst)
+        else:
+            shutil.copyfile(src, dst)
+        return mode
+    except OSError:
+        if mode == 'copy':
+            raise
+    shutil.copyfile(src, dst)
+    return 'copy'
@@ -0,0 +1,226 @@
+import math
+
+import numpy as np
+import PIL.Image
+import PIL.ImageDraw
+
+
+def shape_polygon(shape):
+    """
+    Returns the polygon outline of a labelme shape, rectangles are expanded to their four corners.
+
+    Args:
+        shape: labelme shape dict
+    Returns:
+        list of [x, y]
+    """
+    points = shape['points']
+    if shape.get('shape_type') == 'rectangle' and len(points) == 2:
+        (x1, y1), (x2, y2) = points
+        return [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]
+    return points
+
+
+def pack_points(points_list):
+    """
+    Concatenates the points of several shapes into a single array.
+
+    Args:
+        points_list: list of shapes' points, each a list of [x, y]
+    Returns:
+        points: (N, 2) float64 array of all points
+        offsets: start index of every shape in points
+        counts: number of points of every shape
+    """
+    counts = np.array([len(points) for points in points_list], dtype=np.intp)
+    offsets = np.zeros(len(counts), dtype=np.intp)
+    if len(counts) > 1:
+        offsets[1:] = np.cumsum(counts)[:-1]
+    flat_points = [point for points in points_list for point in points]
+    points = np.asarray(flat_points, dtype=np.float64).reshape(-1, 2)
+    return points, offsets, counts
+
+
+def polygon_bboxes(points_list):
+    """
+    Computes [x, y, w, h] boxes of all shapes of a file from their vertices in one pass.
+
+    Args:
+        points_list: list of shapes' points, each a list of [x, y]
+    Returns:
+        (S, 4) float64 array, boxes of shapes without points are all zeros
+    """
+    boxes = np.zeros((len(points_list), 4), dtype=np.float64)
+    points, offsets, counts = pack_points(points_list)
+    valid = counts > 0
+    if not valid.any():
+        return boxes
+
+    starts = offsets[valid]
+    mins = np.minimum.reduceat(points, starts, axis=0)
+    maxs = np.maximum.reduceat(points, starts, axis=0)
+    boxes[valid, :2] = mins
+    boxes[valid, 2:] = maxs - mins
+    return boxes
+
+
+def polygon_areas(points_list):
+    """
+    Computes the areas of all polygons of a file with the shoelace formula in one pass.
+
+    Args:
+        points_list: list of polygons, each a list of [x, y]
+    Returns:
+        (S,) float64 array, polygons with less than 3 points have zero area
+    """
+    areas = np.zeros(len(points_list), dtype=np.float64)
+    points, offsets, counts = pack_points(points_list)
+    valid = counts > 0
+    if not valid.any():
+        return areas
+
+    # index of the next vertex of every point, wrapping around within its polygon
+    next_index = np.arange(1, len(points) + 1)
+    ends = offsets[valid] + counts[valid] - 1
+    next_index[ends] = offsets[valid]
+
+    x, y = points[:, 0], points[:, 1]
+    cross = x * y[next_index] - x[next_index] * y
+    areas[valid] = np.abs(np.add.reduceat(cross, offsets[valid])) / 2
+    areas[counts < 3] = 0
+    return areas
+
+
+def _crop_mask(points, height, width):
+    """
+    Draws a polygon with PIL on the smallest region of the image that contains it.
+
+    Returns:
+        (bool mask of the region, x offset, y offset), None if the polygon is outside of the image
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) == 0:
+        return None
+
+    # one pixel margin for the outline; the crop never exceeds the image
+    x0 = max(int(math.floor(points[:, 0].min())) - 1, 0)
+    y0 = max(int(math.floor(points[:, 1].min())) - 1, 0)
+    x1 = min(int(math.ceil(points[:, 0].max())) + 2, width)
+    y1 = min(int(math.ceil(points[:, 1].max())) + 2, height)
+    if x1 <= x0 or y1 <= y0:
+        return None
+
+    mask = PIL.Image.new('L', (x1 - x0, y1 - y0), 0)
+    xy = [(x - x0, y - y0) for x, y in points.tolist()]
+    PIL.ImageDraw.Draw(mask).polygon(xy=xy, outline=1, fill=1)
+    return np.asarray(mask, dtype=bool), x0, y0
+
+
+def raster_bbox(points, height, width):
+    """
+    Computes the [x, y, w, h] box of the pixels covered by a polygon drawn with PIL.
+
+    Gives the same pixel-snapped box as rasterizing the polygon on a full height x width
+    mask (up to floating point ties on pixel boundaries), but only the region around the
+    polygon is allocated.
+
+    Args:
+        points: list of [x, y]
+        height: image height
+        width: image width
+    Returns:
+        [x, y, w, h] of the covered pixels, None if no pixel of the image is covered
+    """
+    cropped = _crop_mask(points, height, width)
+    if cropped is None:
+        return None
+    mask, x0, y0 = cropped
+    index = np.argwhere(mask)
+    if len(index) == 0:
+        return None
+
+    top, left = index.min(axis=0)
+    bottom, right = index.max(axis=0)
+    return [int(left + x0), int(top + y0), int(right - left), int(bottom - top)]
+
+
+def rle_counts(mask, x0, y0, height, width):
+    """
+    Computes the uncompressed COCO run-lengths of a cropped mask placed in a height x width image.
+
+    Runs are counted in column-major order starting with background, as in pycocotools.
+    Only the foreground run boundaries of the crop are located, the full-frame mask is never built.
+
+    Args:
+        mask: (h, w) bool mask of the crop
+        x0: x offset of the crop in the image
+        y0: y offset of the crop in the image
+        height: image height
+        width: image width
+    Returns:
+        list of run lengths
+    """
+    # pad every column with background so that runs start and end inside it
+    columns = np.zeros((mask.shape[1], mask.shape[0] + 2), dtype=np.int8)
+    columns[:, 1:-1] = mask.T
+    col, row = np.nonzero(np.diff(columns, axis=1))
+    # transitions alternate start/end within each column, in row order
+    boundaries = (col + x0).astype(np.int64) * height + row + y0
+
+    starts, ends = boundaries[0::2], boundaries[1::2]
+    if len(starts) == 0:
+        return [height * width]
+
+    # runs touching the bottom of a column and the top of the next one are contiguous
+    keep = np.ones(len(starts), dtype=bool)
+    keep[1:] = starts[1:] != ends[:-1]
+    starts = starts[keep]
+    ends = ends[np.append(keep[1:], True)]
+
+    positions = np.empty(len(starts) * 2 + 2, dtype=np.int64)
+    positions[0] = 0
+    positions[1:-1:2] = starts
+    positions[2:-1:2] = ends
+    positions[-1] = height * width
+    counts = np.diff(positions)
+    # pycocotools does not write a trailing empty background run
+    if counts[-1] == 0:
+        counts = counts[:-1]
+    return counts.tolist()
+
+
+def rle_to_string(counts):
+    """
+    Compresses run-lengths to the COCO RLE string, same as pycocotools rleToString.
+    """
+    chars = []
+    for index, count in enumerate(counts):
+        value = count - counts[index - 2] if index > 2 else count
+        more = True
+        while more:
+            char = value & 0x1f
+            value >>= 5
+            more = value != -1 if char & 0x10 else value != 0
+            if more:
+                char |= 0x20
+            chars.append(chr(char + 48))
+    return ''.join(chars)
+
+
+def polygon_rle(points, height, width):
+    """
+    Encodes a polygon as a compressed COCO RLE, rasterizing only the region around it.
+
+    Args:
+        points: list of [x, y]
+        height: image height
+        width: image width
+    Returns:
+        {'size': [height, width], 'counts': str}
+    """
+    cropped = _crop_mask(points, height, width)
+    if cropped is None:
+        counts = [height * width]
+    else:
+        counts = rle_counts(*cropped, height, width)
+    return {'size': [int(height), int(width)], 'counts': rle_to_string(counts)}
@@ -1,5 +1,8 @@
 import base64
 import io
+import json
+import os
+import struct
 
 import numpy as np
 import PIL.ExifTags
@@ -89,3 +92,132 @@ def read_image_shape_as_dict(path):
                       "channel": int(len(img.getbands()))
                       })
     return img_shape
+
+
+# start of frame markers of jpeg, they hold the image size
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# suggested path of a persistent image size cache, used only when passed as image_size_cache
+IMAGE_SIZE_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'labelme2coco', 'image_sizes.json')
+
+
+def image_size_cache_path_for(save_json_path):
+    """
+    Returns the path of the image size cache kept next to a coco json file.
+    """
+    return save_json_path + '.image_sizes.json'
+
+
+def _read_jpeg_size(f):
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte and byte != b'\xff':
+            byte = f.read(1)
+        while byte == b'\xff':
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            continue  # markers without a segment
+        segment_length = struct.unpack('>H', f.read(2))[0]
+        if marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack('>xHH', f.read(5))
+            return width, height
+        f.seek(segment_length - 2, os.SEEK_CUR)
+
+
+def read_image_size(path):
+    """
+    Reads (width, height) of an image from its header, without decoding the image.
+
+    JPEG, PNG, GIF and BMP headers are parsed directly, other formats are opened lazily with PIL.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(26)
+        size = None
+        if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+            size = struct.unpack('>II', head[16:24])
+        elif head[:6] in (b'GIF87a', b'GIF89a'):
+            size = struct.unpack('<HH', head[6:10])
+        elif head.startswith(b'BM') and len(head) >= 26:
+            if struct.unpack('<I', head[14:18])[0] == 12:
+                size = struct.unpack('<HH', head[18:22])
+            else:
+                width, height = struct.unpack('<ii', head[18:26])
+                size = (width, abs(height))  # negative height for top-down bitmaps
+        elif head.startswith(b'\xff\xd8'):
+            try:
+                size = _read_jpeg_size(f)
+            except struct.error:
+                size = None
+    if size is None:
+        with PIL.Image.open(path) as img:
+            size = img.size
+    return int(size[0]), int(size[1])
+
+
+class ImageSizeCache(object):
+    """
+    Persistent cache of image sizes keyed by path, file size and modification time.
+
+    Unchanged images are answered with a stat call, without opening the file.
+    """
+
+    def __init__(self, cache_path=None):
+        """
+        Args:
+            cache_path: json file the cache is kept in, None keeps the cache in memory only
+        """
+        self.cache_path = cache_path
+        self.entries = {}
+        self.updates = {}
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def get(self, path):
+        """
+        Returns (width, height) of the image at path.
+        """
+        key = os.path.abspath(path)
+        stat = os.stat(key)
+        entry = self.entries.get(key)
+        if entry is not None and entry[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return entry[2], entry[3]
+
+        width, height = read_image_size(key)
+        entry = [stat.st_size, stat.st_mtime_ns, width, height]
+        self.entries[key] = entry
+        self.updates[key] = entry
+        return width, height
+
+    def pop_updates(self):
+        """
+        Returns and forgets the entries added since the last call, used to merge caches of worker processes.
+        """
+        updates, self.updates = self.updates, {}
+        return updates
+
+    def merge(self, updates):
+        self.entries.update(updates)
+        self.updates.update(updates)
+
+    def save(self):
+        """
+        Writes the cache file if entries were added.
+        """
+        if not self.cache_path or not self.updates:
+            return
+        cache_dir = os.path.dirname(self.cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(self.cache_path, os.getpid())
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, separators=(',', ':'))
+        os.replace(tmp_path, self.cache_path)
+        self.updates = {}
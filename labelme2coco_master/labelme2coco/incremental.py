@@ -0,0 +1,163 @@
+import contextlib
+import gzip
+import hashlib
+import json
+import os
+
+from labelme2coco.coco_writer import CocoWriter
+
+
+MANIFEST_VERSION = 1
+
+
+def manifest_path_for(save_json_path):
+    """
+    Returns the path of the manifest kept next to a coco json file.
+    """
+    return save_json_path + '.manifest.json'
+
+
+def new_manifest(options):
+    """
+    Returns an empty manifest for a conversion with the given options.
+    """
+    return {
+        'version': MANIFEST_VERSION,
+        'options': options,
+        'next_image_id': 1,
+        'next_annotation_id': 1,
+        'files': {},
+    }
+
+
+def load_manifest(manifest_path, options):
+    """
+    Reads a manifest, returns None if it is missing, unreadable or was made with other options.
+
+    Every file record holds the signature (size, mtime) and sha1 of the labelme file, the id of
+    its image and the ids of the annotations it produced.
+    """
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('options') != options:
+        return None
+    return manifest
+
+
+def save_manifest(manifest_path, manifest):
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, separators=(',', ':'))
+    os.replace(tmp_path, manifest_path)
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def file_hash(path, chunk_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def read_coco_json(path):
+    """
+    Reads a coco json file, gzip compressed if the path ends with '.gz'.
+    """
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return json.load(f)
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def diff_files(manifest, json_paths, labelme_folder):
+    """
+    Compares the labelme files with the manifest.
+
+    Files whose size and mtime are unchanged are not read, the others are hashed and compared with
+    the recorded hash.
+
+    Args:
+        manifest: manifest of the previous conversion
+        json_paths: paths of the current labelme files
+        labelme_folder: folder the manifest keys are relative to
+    Returns:
+        files: {key: record} of the current files, records of added and changed files have no annotation ids yet
+        changed: list of (key, json_path) of added and changed files
+        removed: records of changed and deleted files
+    """
+    old_files = dict(manifest['files'])
+    files = {}
+    changed = []
+    removed = []
+    for json_path in json_paths:
+        key = os.path.relpath(json_path, labelme_folder)
+        record = old_files.pop(key, None)
+        signature = file_signature(json_path)
+        if record is not None and record['signature'] == signature:
+            files[key] = record
+            continue
+
+        content_hash = file_hash(json_path)
+        if record is not None and record['hash'] == content_hash:
+            # touched but not changed
+            files[key] = dict(record, signature=signature)
+            continue
+
+        if record is not None:
+            removed.append(record)
+            image_id = record['image_id']
+        else:
+            image_id = manifest['next_image_id']
+            manifest['next_image_id'] += 1
+        files[key] = {'signature': signature, 'hash': content_hash, 'image_id': image_id, 'annotation_ids': []}
+        changed.append((key, json_path))
+
+    removed.extend(old_files.values())
+    return files, changed, removed
+
+
+@contextlib.contextmanager
+def patch_coco_json(save_json_path, coco, removed, indent=None, cls=None):
+    """
+    Rewrites a coco json without the images and annotations of removed files, yielding the writer
+    so the converted added and changed files can be added, then replaces the file.
+
+    The new file is written next to the old one, keeping its '.gz' suffix. The images and annotations
+    of coco are released once they are copied.
+
+    Args:
+        save_json_path: coco json to patch
+        coco: coco dict of save_json_path, its images and annotations are removed from it
+        removed: records of changed and deleted files, see diff_files
+        indent: indent of the saved json, None saves compact json
+        cls: json encoder class used for the elements
+    """
+    removed_image_ids = {record['image_id'] for record in removed}
+    removed_annotation_ids = {annotation_id for record in removed for annotation_id in record['annotation_ids']}
+    images, annotations = coco.pop('images'), coco.pop('annotations')
+
+    save_json_dir, save_json_name = os.path.split(os.path.abspath(save_json_path))
+    tmp_path = os.path.join(save_json_dir, '.tmp.' + save_json_name)
+    with CocoWriter(tmp_path, indent=indent, cls=cls) as writer:
+        for category in coco['categories']:
+            writer.add_category(category)
+        for image in images:
+            if image['id'] not in removed_image_ids:
+                writer.add_image(image)
+        for annotation in annotations:
+            if annotation['id'] not in removed_annotation_ids:
+                writer.add_annotation(annotation)
+        del images, annotations
+        yield writer
+    os.replace(tmp_path, save_json_path)
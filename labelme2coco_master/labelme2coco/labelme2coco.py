@@ -1,27 +1,71 @@
 import os
 import json
+import multiprocessing
 import PIL.Image
 import PIL.ImageDraw
 import numpy as np
 from labelme2coco.utils import create_dir, list_jsons_recursively
-from labelme2coco.image_utils import read_image_shape_as_dict
+from labelme2coco.image_utils import ImageSizeCache, image_size_cache_path_for
+from labelme2coco.coco_writer import CocoWriter
+from labelme2coco.labelme_io import load_labelme_json
+from labelme2coco.categories import CategoryRegistry
+from labelme2coco.incremental import (
+    diff_files, file_hash, load_manifest, manifest_path_for, new_manifest, patch_coco_json, read_coco_json,
+    save_manifest
+)
+from labelme2coco.geometry import polygon_areas, polygon_bboxes, polygon_rle, raster_bbox, shape_polygon
+
+# 'analytic': boxes from polygon vertices, 'raster': pixel-snapped boxes of the drawn polygons
+BBOX_MODES = ('analytic', 'raster')
+
+# 'polygon': vertex lists, 'rle': compressed coco run-length encoding of the drawn polygons
+SEGMENTATION_FORMATS = ('polygon', 'rle')
+
+# 'json': imageHeight/imageWidth of the labelme file, 'check': image header, warning when the labelme
+# file disagrees, 'image': image header
+IMAGE_SIZE_MODES = ('json', 'check', 'image')
 
 
 class labelme2coco(object):
-    def __init__(self, labelme_folder='', save_json_path='./new.json'):
+    def __init__(self, labelme_folder='', save_json_path='./new.json', bbox_mode='analytic',
+                 segmentation_format='polygon', indent=None, workers=1, image_size='check',
+                 image_size_cache='auto', incremental=False, category_ids='first_seen',
+                 labels_file=None, category_registry=None):
         """
         Args:
             labelme_folder: folder that contains labelme annotations and image files
             save_json_path: path for coco json to be saved
+            bbox_mode: 'analytic' computes boxes from polygon vertices,
+                'raster' computes pixel-snapped boxes of the polygons drawn on the image
+            segmentation_format: 'polygon' saves vertex lists,
+                'rle' saves compressed coco rle of the polygons drawn on the image
+            indent: indent of the saved json, None saves compact json
+            workers: number of processes that convert labelme files, the output does not depend on it
+            image_size: 'json' trusts imageHeight/imageWidth of the labelme files and reads the image only
+                when they are missing, 'check' reads the image header and warns when the labelme file
+                disagrees, 'image' reads the image header
+            image_size_cache: json file that caches image sizes by path, file size and mtime across runs,
+                'auto' keeps it next to the coco json (<save_json_path>.image_sizes.json), so converting an
+                unchanged folder again opens no image, None keeps the cache in memory
+            incremental: keep a manifest of the converted labelme files next to the coco json and on later
+                runs only convert added and changed files, patching the existing coco json
+            category_ids: 'first_seen' numbers the labels in the order they are met, 'sorted' numbers the
+                sorted labels of the folder, 'labels_file' numbers the labels of labels_file and ignores the others
+            labels_file: labels.txt used by category_ids='labels_file'
+            category_registry: CategoryRegistry shared by the conversions of several splits, so they get the
+                same category ids; overrides category_ids
         """
+        if image_size_cache == 'auto':
+            image_size_cache = image_size_cache_path_for(save_json_path)
+        self.set_options(bbox_mode, segmentation_format, image_size, image_size_cache)
+        self.indent = indent
+        self.workers = workers
+        self.incremental = incremental
+        self.labelme_folder = labelme_folder
         self.save_json_path = save_json_path
         self.images = []
-        self.categories = []
         self.annotations = []
-        self.label = []
         self.annID = 1
-        self.height = 0
-        self.width = 0
 
         # create save dir
         save_json_dir = os.path.dirname(save_json_path)
@@ -31,32 +75,123 @@ class labelme2coco(object):
         _, labelme_json = list_jsons_recursively(labelme_folder)
         self.labelme_json = labelme_json
 
+        self.category_ids = category_ids
+        self.labels_file = labels_file
+        if category_registry is None:
+            category_registry = CategoryRegistry.from_policy(category_ids, labelme_json, labels_file)
+        self.category_registry = category_registry
+        self.categories = category_registry.categories()
+
         self.save_json()
 
-    def data_transfer(self):
-        for num, json_path in enumerate(self.labelme_json):
-            with open(json_path, 'r') as fp:
-                # load json
-                data = json.load(fp)
-#                (prefix, res) = os.path.split(json_path)
-#                (file_name, extension) = os.path.splitext(res)
-                self.images.append(self.image(data, num, json_path))
-                for shapes in data['shapes']:
-                    label = shapes['label']
-                    if label not in self.label:
-                        self.categories.append(self.category(label))
-                        self.label.append(label)
-                    points = shapes['points']
-                    self.annotations.append(self.annotation(points, label, num))
-                    self.annID += 1
+    def set_options(self, bbox_mode, segmentation_format, image_size, image_size_cache):
+        if image_size not in IMAGE_SIZE_MODES:
+            raise ValueError("image_size should be one of {}, got {}".format(IMAGE_SIZE_MODES, image_size))
+        if bbox_mode not in BBOX_MODES:
+            raise ValueError("bbox_mode should be one of {}, got {}".format(BBOX_MODES, bbox_mode))
+        if segmentation_format not in SEGMENTATION_FORMATS:
+            raise ValueError("segmentation_format should be one of {}, got {}".format(
+                SEGMENTATION_FORMATS, segmentation_format))
+        self.bbox_mode = bbox_mode
+        self.segmentation_format = segmentation_format
+        self.image_size = image_size
+        self.image_sizes = ImageSizeCache(image_size_cache)
+        self.height = 0
+        self.width = 0
+
+    def data_transfer(self, writer=None):
+        """
+        Args:
+            writer: CocoWriter that images and annotations are written to as they are converted,
+                None keeps them in self.images and self.annotations
+        """
+        for image, annotations in self.convert_files():
+            self.add_converted(image, annotations, writer)
+
+    def add_converted(self, image, annotations, writer=None):
+        """
+        Adds a converted labelme file, assigning the category ids and annotation ids.
+
+        Returns:
+            ids of the added annotations
+        """
+        annotation_ids = []
+        if writer is None:
+            self.images.append(image)
+        else:
+            writer.add_image(image)
+        # categories and annotation ids are assigned here in file order, so the output
+        # is the same for any number of workers
+        for label, annotation in annotations:
+            if label not in self.category_registry:
+                if self.category_registry.add(label) is None:
+                    continue
+                category = self.category(label)
+                self.categories.append(category)
+                if writer is not None:
+                    writer.add_category(category)
+            annotation['category_id'] = self.getcatid(label)
+            annotation['id'] = int(self.annID)
+            if writer is None:
+                self.annotations.append(annotation)
+            else:
+                writer.add_annotation(annotation)
+            annotation_ids.append(annotation['id'])
+            self.annID += 1
+        return annotation_ids
+
+    def convert_files(self, tasks=None):
+        """
+        Yields the converted labelme files in order, converted in a process pool if workers > 1.
+
+        Args:
+            tasks: list of (image id - 1, json path), defaults to all labelme files
+        """
+        if tasks is None:
+            tasks = list(enumerate(self.labelme_json))
+        if self.workers <= 1:
+            for num, json_path in tasks:
+                yield self.convert_file(num, json_path)
+            return
+
+        initargs = (self.bbox_mode, self.segmentation_format, self.image_size, self.image_sizes.cache_path)
+        with multiprocessing.Pool(self.workers, initializer=_init_worker, initargs=initargs) as pool:
+            chunksize = max(1, min(64, len(tasks) // (self.workers * 4)))
+            for result, image_size_updates in pool.imap(_convert_file, tasks, chunksize=chunksize):
+                self.image_sizes.merge(image_size_updates)
+                yield result
+
+    def convert_file(self, num, json_path):
+        """
+        Converts a single labelme file.
+
+        Returns:
+            image: coco image dict
+            annotations: list of (label, coco annotation dict), category_id and id of the annotations
+                are assigned by data_transfer
+        """
+        # load json without decoding imageData
+        data = load_labelme_json(json_path)
+        image = self.image(data, num, json_path)
+        if self.bbox_mode == 'analytic':
+            bboxes = polygon_bboxes([shapes['points'] for shapes in data['shapes']])
+        else:
+            bboxes = [None] * len(data['shapes'])
+        polygons = [shape_polygon(shapes) for shapes in data['shapes']]
+        areas = polygon_areas(polygons)
+        annotations = []
+        for shapes, bbox, polygon, area in zip(data['shapes'], bboxes, polygons, areas):
+            label = shapes['label']
+            points = shapes['points']
+            annotations.append((label, self.annotation(points, label, num, bbox, area, polygon)))
+        return image, annotations
 
     def image(self, data, num, json_path):
         image = {}
         # get image path
         _, img_extension = os.path.splitext(data["imagePath"])
         image_path = json_path.replace(".json", img_extension)
-        img_shape = read_image_shape_as_dict(image_path)
-        height, width = img_shape['height'], img_shape['width']
+        height, width = self.image_shape(data, image_path)
 
         image['height'] = height
         image['width'] = width
@@ -68,49 +203,65 @@ class labelme2coco(object):
 
         return image
 
-    def category(self, label):
-        category = {}
-        category['supercategory'] = label
-        category['id'] = int(len(self.label) + 1)
-        category['name'] = label
+    def image_shape(self, data, image_path):
+        """
+        Returns (height, width) of the image according to self.image_size.
+        """
+        json_height, json_width = data.get('imageHeight'), data.get('imageWidth')
+        if self.image_size == 'json' and json_height and json_width:
+            return int(json_height), int(json_width)
 
-        return category
+        # only the image header is read, unchanged images are answered from the cache
+        width, height = self.image_sizes.get(image_path)
+        if self.image_size == 'check' and json_height and json_width and \
+                (int(json_height), int(json_width)) != (height, width):
+            print("warning: {} is {}x{} but its labelme file says {}x{}, using the image size".format(
+                image_path, width, height, json_width, json_height))
+        return height, width
 
-    def annotation(self, points, label, num):
+    def category(self, label):
+        return self.category_registry.category(label)
+
+    def annotation(self, points, label, num, bbox=None, area=None, polygon=None):
         annotation = {}
         annotation['iscrowd'] = 0
         annotation['image_id'] = int(num + 1)
 
-        annotation['bbox'] = list(map(float, self.getbbox(points)))
+        if bbox is None:
+            bbox = self.getbbox(points)
+        annotation['bbox'] = list(map(float, bbox))
 
         # coarsely from bbox to segmentation
         x = annotation['bbox'][0]
         y = annotation['bbox'][1]
         w = annotation['bbox'][2]
         h = annotation['bbox'][3]
-        annotation['segmentation'] = [np.asarray(points).flatten().tolist()]
+        if polygon is None:
+            polygon = points
+        if self.segmentation_format == 'rle':
+            annotation['segmentation'] = polygon_rle(polygon, self.height, self.width)
+        else:
+            annotation['segmentation'] = [np.asarray(points).flatten().tolist()]
 
         annotation['category_id'] = self.getcatid(label)
         annotation['id'] = int(self.annID)
         # add area info
-        annotation['area'] = self.height * self.width  # the area is not used for detection
+        if area is None:
+            area = polygon_areas([polygon])[0]
+        annotation['area'] = float(area)
         return annotation
 
     def getcatid(self, label):
-        for categorie in self.categories:
-            if label == categorie['name']:
-                return categorie['id']
-            # if label[1]==categorie['name']:
-            #     return categorie['id']
-        return -1
-
-    def getbbox(self,points):
-        # img = np.zeros([self.height,self.width],np.uint8)
-        # cv2.polylines(img, [np.asarray(points)], True, 1, lineType=cv2.LINE_AA)
-        # cv2.fillPoly(img, [np.asarray(points)], 1)
-        polygons = points
-        mask = self.polygons_to_mask([self.height, self.width], polygons)
-        return self.mask2box(mask)
+        category_id = self.category_registry.get(label)
+        return -1 if category_id is None else category_id
+
+    def getbbox(self, points):
+        if self.bbox_mode == 'raster':
+            # only the region around the polygon is rasterized, see geometry.raster_bbox
+            bbox = raster_bbox(points, self.height, self.width)
+            if bbox is not None:
+                return bbox
+        return polygon_bboxes([points])[0]
 
     def mask2box(self, mask):
         # np.where(mask==1)
@@ -142,10 +293,80 @@ class labelme2coco(object):
         return data_coco
 
     def save_json(self):
-        self.data_transfer()
-        self.data_coco = self.data2coco()
+        if self.incremental:
+            self.update_json()
+            return
+
+        # images and annotations are written as they are converted instead of kept in memory
+        with CocoWriter(self.save_json_path, indent=self.indent, cls=MyEncoder) as writer:
+            for category in self.categories:
+                writer.add_category(category)
+            self.data_transfer(writer)
+        self.image_sizes.save()
+
+    def update_json(self):
+        """
+        Converts only the labelme files added or changed since the last run and patches the coco json.
+
+        Images and annotations of changed and deleted files are dropped. Changed files keep their image id,
+        added files and all new annotations get ids that were never used before. Without a manifest, or
+        when it was made with other options, all files are converted.
+        """
+        manifest_path = manifest_path_for(self.save_json_path)
+        # a changed labels file or image size mode changes the output of unchanged files, so it converts all files
+        options = {'bbox_mode': self.bbox_mode, 'segmentation_format': self.segmentation_format,
+                   'category_ids': self.category_ids, 'image_size': self.image_size,
+                   'labels_file': file_hash(self.labels_file) if self.labels_file else None}
+        manifest = load_manifest(manifest_path, options) if os.path.exists(self.save_json_path) else None
+        up_to_date_possible = manifest is not None
+        if manifest is None:
+            manifest = new_manifest(options)
+            coco = {'images': [], 'annotations': [], 'categories': self.categories}
+        else:
+            coco = read_coco_json(self.save_json_path)
+            # keep the ids of the existing categories, new labels are added after them
+            self.category_registry = CategoryRegistry.from_categories(coco['categories'],
+                                                                      frozen=self.category_registry.frozen)
+
+        files, changed, removed = diff_files(manifest, self.labelme_json, self.labelme_folder)
+        if up_to_date_possible and not changed and not removed:
+            print("{} is up to date.".format(self.save_json_path))
+            return
+
+        self.categories = coco['categories']
+        self.annID = manifest['next_annotation_id']
+        tasks = [(files[key]['image_id'] - 1, json_path) for key, json_path in changed]
+        keys = {files[key]['image_id']: key for key, _ in changed}
+        with patch_coco_json(self.save_json_path, coco, removed, indent=self.indent, cls=MyEncoder) as writer:
+            for image, annotations in self.convert_files(tasks):
+                files[keys[image['id']]]['annotation_ids'] = self.add_converted(image, annotations, writer)
+
+        manifest['files'] = files
+        manifest['next_annotation_id'] = self.annID
+        save_manifest(manifest_path, manifest)
+        self.image_sizes.save()
+        print("{}: converted {} labelme files, removed {}.".format(
+            self.save_json_path, len(changed), len(removed)))
+
+
+# converter used by the worker processes of labelme2coco.convert_files
+_worker_converter = None
+
+
+def _init_worker(bbox_mode, segmentation_format, image_size, image_size_cache):
+    global _worker_converter
+    _worker_converter = labelme2coco.__new__(labelme2coco)
+    # the cache is only read here, new entries are sent back and saved by the main process
+    _worker_converter.set_options(bbox_mode, segmentation_format, image_size, image_size_cache)
+    # category ids and annotation ids are reassigned in the main process
+    _worker_converter.category_registry = CategoryRegistry()
+    _worker_converter.annID = 1
+
 
-        json.dump(self.data_coco, open(self.save_json_path, 'w', encoding='utf-8'), indent=4, separators=(',', ': '), cls=MyEncoder)
+def _convert_file(task):
+    num, json_path = task
+    result = _worker_converter.convert_file(num, json_path)
+    return result, _worker_converter.image_sizes.pop_updates()
 
 
 # type check when save json files
@@ -0,0 +1,49 @@
+import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# the imageData key of a labelme file followed by the opening quote of its base64 string
+IMAGE_DATA_PATTERN = re.compile(rb'"imageData"\s*:\s*"')
+
+
+def loads_json(raw):
+    """
+    Parses json bytes with orjson when it is installed, with the standard json module otherwise.
+    """
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def load_labelme_json(json_path, keep_image_data=False):
+    """
+    Reads a labelme annotation file without decoding its base64 imageData.
+
+    imageData is usually most of the file. Its string is located on the raw bytes and replaced
+    by null before parsing, so it is never decoded into a python string. Base64 never contains
+    quotes, so the string ends at the next quote.
+
+    Args:
+        json_path: path of the labelme json file
+        keep_image_data: parse the whole file, including imageData
+    Returns:
+        labelme data dict, with imageData set to None unless keep_image_data is True
+    """
+    with open(json_path, 'rb') as fp:
+        raw = fp.read()
+
+    if not keep_image_data:
+        match = IMAGE_DATA_PATTERN.search(raw)
+        if match is not None:
+            end = raw.find(b'"', match.end())
+            if end != -1:
+                try:
+                    return loads_json(raw[:match.end() - 1] + b'null' + raw[end + 1:])
+                except ValueError:
+                    pass  # not the top level imageData, parse the whole file
+    return loads_json(raw)
@@ -0,0 +1,244 @@
+import numpy as np
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+
+def keypoint_index(keypoint_names):
+    """
+    Maps keypoint names to their index in the coco keypoints list.
+    """
+    return {name: index for index, name in enumerate(keypoint_names)}
+
+
+class PoseInstance(object):
+    """
+    One animal of a labelme file: its box and its (K, 3) keypoints (x, y, visibility).
+    """
+
+    def __init__(self, num_keypoints, box=None, group_id=None):
+        """
+        Args:
+            num_keypoints: number of keypoint names
+            box: [x1, y1, x2, y2] of the instance rectangle, None if it has none
+            group_id: labelme group_id of the instance
+        """
+        self.box = box
+        self.group_id = group_id
+        self.keypoints = np.zeros((num_keypoints, 3), dtype=np.float64)
+
+    def set_keypoint(self, index, x, y):
+        # the first point of a name wins, as when shapes were searched in order
+        if self.keypoints[index, 2] == 0:
+            self.keypoints[index] = (x, y, 2)
+
+    @property
+    def num_visible(self):
+        return int(np.count_nonzero(self.keypoints[:, 2]))
+
+    def bbox(self):
+        """
+        Returns the [x, y, w, h] of the instance rectangle, zeros if it has none.
+        """
+        if self.box is None:
+            return [0.0, 0.0, 0.0, 0.0]
+        x1, y1, x2, y2 = self.box
+        return [float(x1), float(y1), float(x2 - x1), float(y2 - y1)]
+
+
+def _rectangle_box(points):
+    (x1, y1), (x2, y2) = points[0], points[-1]
+    return [min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)]
+
+
+def _solve_assignment(cost):
+    """
+    Assigns rows to columns of a cost matrix with infinite cost for forbidden pairs.
+
+    Uses the hungarian algorithm when scipy is installed. Otherwise pairs are taken greedily,
+    rows with the largest margin between their best and second best column first.
+
+    Returns:
+        (R,) column of every row, -1 for unassigned rows
+    """
+    rows, columns = cost.shape
+    assignment = np.full(rows, -1, dtype=np.intp)
+    feasible = np.isfinite(cost)
+    if not feasible.any():
+        return assignment
+
+    if linear_sum_assignment is not None:
+        # forbidden pairs get a cost no valid assignment can reach, and are dropped afterwards
+        finite_cost = np.where(feasible, cost, cost[feasible].max() * (rows + 1) + 1)
+        row_index, column_index = linear_sum_assignment(finite_cost)
+        valid = feasible[row_index, column_index]
+        assignment[row_index[valid]] = column_index[valid]
+        return assignment
+
+    ordered = np.sort(cost, axis=1)
+    with np.errstate(invalid='ignore'):
+        margin = (ordered[:, 1] if columns > 1 else np.full(rows, np.inf)) - ordered[:, 0]
+    taken = np.zeros(columns, dtype=bool)
+    for row in np.argsort(-np.nan_to_num(margin, nan=0, posinf=np.finfo(np.float64).max)):
+        candidates = np.where(feasible[row] & ~taken, cost[row], np.inf)
+        column = int(np.argmin(candidates))
+        if np.isfinite(candidates[column]):
+            assignment[row] = column
+            taken[column] = True
+    return assignment
+
+
+def assign_keypoints(points, kinds, boxes, occupied=None, margin=0.1, ambiguity=0.25):
+    """
+    Assigns keypoints to boxes, at most one keypoint of each kind per box.
+
+    Containment and distances of all point/box pairs are computed at once with broadcasting.
+    A point can go to the boxes that contain it, grown by margin times their size; its cost is
+    its distance to the box center in box sizes. The assignment is then solved for every kind.
+
+    Args:
+        points: (P, 2) point coordinates
+        kinds: (P,) keypoint index of every point
+        boxes: (B, 4) [x1, y1, x2, y2] boxes
+        occupied: (B, K) bool, keypoint kinds the boxes already have
+        margin: fraction of the box size a point can lie outside of it
+        ambiguity: points whose two best boxes have costs closer than this are reported as ambiguous
+    Returns:
+        assignment: (P,) box of every point, -1 for points no box can take
+        ambiguous: (P,) bool, points that could as well belong to another box
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    kinds = np.asarray(kinds, dtype=np.intp)
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    assignment = np.full(len(points), -1, dtype=np.intp)
+    ambiguous = np.zeros(len(points), dtype=bool)
+    if len(points) == 0 or len(boxes) == 0:
+        return assignment, ambiguous
+
+    sizes = np.maximum(boxes[:, 2:] - boxes[:, :2], 1e-6)
+    centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+    # (P, B, 2) offsets from the box centers, in box sizes
+    offsets = (points[:, None, :] - centers[None, :, :]) / sizes[None, :, :]
+    feasible = (np.abs(offsets) <= 0.5 + margin).all(axis=2)
+    cost = np.where(feasible, np.sqrt((offsets ** 2).sum(axis=2)), np.inf)
+    if occupied is not None:
+        cost[np.asarray(occupied, dtype=bool)[:, kinds].T] = np.inf
+
+    if len(boxes) > 1:
+        ordered = np.sort(cost, axis=1)
+        with np.errstate(invalid='ignore'):
+            ambiguous = np.isfinite(ordered[:, 1]) & (ordered[:, 1] - ordered[:, 0] < ambiguity)
+
+    for kind in np.unique(kinds):
+        rows = np.flatnonzero(kinds == kind)
+        if len(rows) == 1:
+            column = int(np.argmin(cost[rows[0]]))
+            if np.isfinite(cost[rows[0], column]):
+                assignment[rows[0]] = column
+        else:
+            assignment[rows] = _solve_assignment(cost[rows])
+    return assignment, ambiguous
+
+
+def unknown_shapes(shapes, keypoint_indexes, box_labels=None):
+    """
+    Returns the shapes group_instances ignores: shapes that are neither an instance rectangle
+    nor a keypoint, so callers can report them.
+
+    Args:
+        shapes: labelme shapes
+        keypoint_indexes: {keypoint name: index}, see keypoint_index
+        box_labels: labels of the instance rectangles, None for all rectangles
+    """
+    unknown = []
+    for shape in shapes:
+        if shape.get('shape_type') == 'rectangle':
+            if box_labels is not None and shape['label'] not in box_labels:
+                unknown.append(shape)
+        elif shape['label'] not in keypoint_indexes:
+            unknown.append(shape)
+    return unknown
+
+
+def group_instances(shapes, keypoint_indexes, box_labels=None, require_box=False, margin=0.1, ambiguity=0.25):
+    """
+    Groups the rectangles and keypoints of a labelme file into pose instances.
+
+    Every rectangle starts an instance. Points are assigned by group_id when they have one,
+    the others are assigned to the rectangles by assign_keypoints, independently of the shape
+    order. Points no rectangle can take belong to the only instance when there is one, and are
+    reported otherwise. Without require_box, a file without rectangles gives a single instance
+    without box. Other shapes are ignored, see unknown_shapes.
+
+    Args:
+        shapes: labelme shapes
+        keypoint_indexes: {keypoint name: index}, see keypoint_index
+        box_labels: labels of the instance rectangles, None for all rectangles
+        require_box: only make instances from rectangles
+        margin: see assign_keypoints
+        ambiguity: see assign_keypoints
+    Returns:
+        instances: list of PoseInstance, rectangles first in file order
+        unassigned: shapes of the points that were not assigned to any instance
+        ambiguous: shapes of the points assigned to one of several close boxes
+    """
+    num_keypoints = len(keypoint_indexes)
+    instances = []
+    by_group = {}
+    points = []
+    for shape in shapes:
+        shape_type = shape.get('shape_type')
+        if shape_type == 'rectangle':
+            if box_labels is not None and shape['label'] not in box_labels:
+                continue
+            group_id = shape.get('group_id')
+            instance = PoseInstance(num_keypoints, _rectangle_box(shape['points']), group_id)
+            instances.append(instance)
+            if group_id is not None:
+                by_group.setdefault(group_id, instance)
+        elif shape['label'] in keypoint_indexes:
+            points.append(shape)
+
+    unassigned = []
+    loose = []
+    for shape in points:
+        group_id = shape.get('group_id')
+        if group_id is None:
+            loose.append(shape)
+            continue
+        instance = by_group.get(group_id)
+        if instance is None:
+            if require_box:
+                unassigned.append(shape)
+                continue
+            instance = by_group[group_id] = PoseInstance(num_keypoints, group_id=group_id)
+            instances.append(instance)
+        x, y = shape['points'][0]
+        instance.set_keypoint(keypoint_indexes[shape['label']], x, y)
+
+    if loose and not instances and not require_box:
+        instances.append(PoseInstance(num_keypoints))
+    if not loose:
+        return instances, unassigned, []
+
+    boxed = [instance for instance in instances if instance.box is not None]
+    xy = [shape['points'][0] for shape in loose]
+    kinds = [keypoint_indexes[shape['label']] for shape in loose]
+    occupied = np.array([instance.keypoints[:, 2] != 0 for instance in boxed], dtype=bool).reshape(-1, num_keypoints)
+    assignment, ambiguous_points = assign_keypoints(xy, kinds, [instance.box for instance in boxed], occupied,
+                                                    margin=margin, ambiguity=ambiguity)
+    ambiguous = []
+    for shape, (x, y), kind, box, is_ambiguous in zip(loose, xy, kinds, assignment, ambiguous_points):
+        if box >= 0:
+            instance = boxed[box]
+        elif len(instances) == 1:
+            instance = instances[0]
+        else:
+            unassigned.append(shape)
+            continue
+        if is_ambiguous:
+            ambiguous.append(shape)
+        instance.set_keypoint(kind, x, y)
+    return instances, unassigned, ambiguous
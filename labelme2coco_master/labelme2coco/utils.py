@@ -1,6 +1,7 @@
 import os
 import json
-import jsonschema
+
+from labelme2coco.validation import validate_coco
 
 image_schema = {
     "type": "object",
@@ -78,23 +79,26 @@ coco_schema = {
 
 
 def read_and_validate_coco_annotation(
-        coco_annotation_path: str) -> (dict, bool):
+        coco_annotation_path: str, check_references: bool = True) -> (dict, bool):
     """
     Reads coco formatted annotation file and validates its fields.
+
+    The fields are checked against the rules of coco_schema in a single pass, see
+    validation.validate_coco, and all violations are printed with their json paths.
+    For files too large to load, use validation.validate_coco_file with stream=True.
     """
+    coco_dict = None
     try:
         with open(coco_annotation_path) as json_file:
             coco_dict = json.load(json_file)
-        jsonschema.validate(coco_dict, coco_schema)
-        response = True
-    except jsonschema.exceptions.ValidationError as e:
-        print("well-formed but invalid JSON:", e)
-        response = False
     except json.decoder.JSONDecodeError as e:
         print("poorly-formed text, not JSON:", e)
-        response = False
+        return coco_dict, False
 
-    return coco_dict, response
+    errors = validate_coco(coco_dict, check_references=check_references)
+    for error in errors:
+        print("well-formed but invalid JSON:", error)
+    return coco_dict, not errors
 
 
 def create_dir(_dir):
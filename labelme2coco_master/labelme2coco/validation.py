@@ -0,0 +1,268 @@
+import gzip
+
+try:
+    import ijson
+    from ijson.common import ObjectBuilder
+except ImportError:
+    ijson = None
+
+from labelme2coco.incremental import read_coco_json
+
+
+COCO_SECTIONS = ('images', 'annotations', 'categories')
+
+
+def _is_integer(value):
+    # same as json schema: any number without a fractional part, booleans are not numbers
+    if isinstance(value, bool):
+        return False
+    return isinstance(value, int) or (isinstance(value, float) and value.is_integer())
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _type_error(path, value, expected):
+    return "{}: {!r} is not of type '{}'".format(path, value, expected)
+
+
+def _json_type(value):
+    if isinstance(value, dict):
+        return 'object'
+    if isinstance(value, list):
+        return 'array'
+    if isinstance(value, str):
+        return 'string'
+    if value is None:
+        return 'null'
+    return 'boolean' if isinstance(value, bool) else 'number'
+
+
+# json type of the ijson events that start a value
+EVENT_TYPES = {'start_map': 'object', 'start_array': 'array', 'string': 'string', 'number': 'number',
+               'boolean': 'boolean', 'null': 'null'}
+
+
+class CocoValidator(object):
+    """
+    Validates coco items one at a time, with the rules of utils.coco_schema.
+
+    Every rule is a plain python check, so a dataset is validated in a single linear pass.
+    Violations are collected with the json path of the offending value instead of stopping at
+    the first one. With check_references, annotations must also point to existing images and
+    categories; these are checked in finish, since images can come after annotations in the file.
+    Polygon segmentations are lists of number lists; compressed or uncompressed rle dicts
+    ({'size': [h, w], 'counts': ...}) are also accepted.
+    """
+
+    def __init__(self, check_references=True):
+        self.check_references = check_references
+        self.errors = []
+        self.image_ids = set()
+        self.category_ids = set()
+        self.references = []
+        self.sections = set()
+
+    def check_required(self, path, item, keys):
+        for key in keys:
+            if key not in item:
+                self.errors.append("{}: '{}' is a required property".format(path, key))
+
+    def check_type(self, path, item, key, check, expected):
+        if key in item and not check(item[key]):
+            self.errors.append(_type_error(path + '.' + key, item[key], expected))
+            return False
+        return key in item
+
+    def check_root_type(self, json_type):
+        if json_type != 'object':
+            self.errors.append("$: {} is not of type 'object'".format(json_type))
+            return False
+        return True
+
+    def check_section_type(self, section, json_type):
+        """
+        Checks that a top level section is an array, only sections that are get their references checked.
+        """
+        if json_type != 'array':
+            self.errors.append("$.{}: {} is not of type 'array'".format(section, json_type))
+            return False
+        self.sections.add(section)
+        return True
+
+    def check_root(self, root):
+        if not self.check_root_type(_json_type(root)):
+            return False
+        self.check_required('$', root, COCO_SECTIONS)
+        for section in COCO_SECTIONS:
+            if section in root:
+                self.check_section_type(section, _json_type(root[section]))
+        return True
+
+    def add(self, section, index, item):
+        """
+        Validates item number index of a top level section.
+        """
+        path = '$.{}[{}]'.format(section, index)
+        if not isinstance(item, dict):
+            self.errors.append(_type_error(path, item, 'object'))
+            return
+        if section == 'images':
+            self.add_image(path, item)
+        elif section == 'annotations':
+            self.add_annotation(path, item)
+        else:
+            self.add_category(path, item)
+
+    def add_image(self, path, image):
+        self.check_required(path, image, ('file_name', 'id'))
+        self.check_type(path, image, 'file_name', lambda value: isinstance(value, str), 'string')
+        if self.check_type(path, image, 'id', _is_integer, 'integer'):
+            self.image_ids.add(image['id'])
+
+    def add_category(self, path, category):
+        self.check_required(path, category, ('name', 'id'))
+        self.check_type(path, category, 'name', lambda value: isinstance(value, str), 'string')
+        if self.check_type(path, category, 'id', _is_integer, 'integer'):
+            self.category_ids.add(category['id'])
+
+    def add_annotation(self, path, annotation):
+        self.check_required(path, annotation, ('image_id', 'category_id', 'segmentation'))
+        has_image_id = self.check_type(path, annotation, 'image_id', _is_integer, 'integer')
+        has_category_id = self.check_type(path, annotation, 'category_id', _is_integer, 'integer')
+        if 'segmentation' in annotation:
+            self.check_segmentation(path + '.segmentation', annotation['segmentation'])
+        if self.check_references:
+            self.references.append((
+                path,
+                annotation['image_id'] if has_image_id else None,
+                annotation['category_id'] if has_category_id else None,
+            ))
+
+    def check_segmentation(self, path, segmentation):
+        if isinstance(segmentation, dict):
+            self.check_rle(path, segmentation)
+            return
+        if not isinstance(segmentation, list):
+            self.errors.append(_type_error(path, segmentation, 'array'))
+            return
+        for polygon_index, polygon in enumerate(segmentation):
+            if not isinstance(polygon, list):
+                self.errors.append(_type_error('{}[{}]'.format(path, polygon_index), polygon, 'array'))
+                continue
+            for value_index, value in enumerate(polygon):
+                if not _is_number(value):
+                    self.errors.append(_type_error('{}[{}][{}]'.format(path, polygon_index, value_index),
+                                                   value, 'number'))
+
+    def check_rle(self, path, rle):
+        self.check_required(path, rle, ('size', 'counts'))
+        size = rle.get('size')
+        if 'size' in rle and not (isinstance(size, list) and len(size) == 2 and all(map(_is_integer, size))):
+            self.errors.append(_type_error(path + '.size', size, '[height, width]'))
+        counts = rle.get('counts')
+        if 'counts' in rle and not (isinstance(counts, str) or
+                                    (isinstance(counts, list) and all(map(_is_integer, counts)))):
+            self.errors.append(_type_error(path + '.counts', counts, 'string or integer array'))
+
+    def finish(self):
+        """
+        Checks the references of the annotations and returns all violations.
+        """
+        check_images = 'images' in self.sections
+        check_categories = 'categories' in self.sections
+        for path, image_id, category_id in self.references:
+            if check_images and image_id is not None and image_id not in self.image_ids:
+                self.errors.append("{}.image_id: image {} does not exist".format(path, image_id))
+            if check_categories and category_id is not None and category_id not in self.category_ids:
+                self.errors.append("{}.category_id: category {} does not exist".format(path, category_id))
+        self.references = []
+        return self.errors
+
+
+def validate_coco(coco_dict, check_references=True):
+    """
+    Validates a coco dict in a single pass.
+
+    Args:
+        coco_dict: coco formatted dict
+        check_references: also check that annotation image_id and category_id exist
+    Returns:
+        list of violations with their json paths, empty if the dict is valid
+    """
+    validator = CocoValidator(check_references=check_references)
+    if validator.check_root(coco_dict):
+        for section in COCO_SECTIONS:
+            items = coco_dict.get(section)
+            if isinstance(items, list):
+                for index, item in enumerate(items):
+                    validator.add(section, index, item)
+    return validator.finish()
+
+
+def _stream_validate(json_file, validator):
+    """
+    Validates a coco json file item by item from ijson parser events, without loading it.
+    """
+    root_type = None
+    root_keys = set()
+    item_prefixes = {section + '.item': section for section in COCO_SECTIONS}
+    indexes = dict.fromkeys(COCO_SECTIONS, 0)
+    section = None
+    builder = None
+    for prefix, event, value in ijson.parse(json_file, use_float=True):
+        if builder is not None:
+            # inside an item, rebuild it and validate it once complete
+            builder.event(event, value)
+            if prefix == section + '.item' and event in ('end_map', 'end_array'):
+                validator.add(section, indexes[section], builder.value)
+                indexes[section] += 1
+                builder = None
+        elif prefix == '':
+            if root_type is None:
+                root_type = event
+            if event == 'map_key':
+                root_keys.add(value)
+        elif prefix in COCO_SECTIONS:
+            if event in EVENT_TYPES:
+                validator.check_section_type(prefix, EVENT_TYPES[event])
+        elif prefix in item_prefixes:
+            section = item_prefixes[prefix]
+            if event in ('start_map', 'start_array'):
+                builder = ObjectBuilder()
+                builder.event(event, value)
+            else:
+                validator.add(section, indexes[section], value)
+                indexes[section] += 1
+
+    if validator.check_root_type(EVENT_TYPES.get(root_type)):
+        validator.check_required('$', root_keys, COCO_SECTIONS)
+
+
+def validate_coco_file(coco_annotation_path, stream=False, check_references=True):
+    """
+    Validates a coco json file.
+
+    Args:
+        coco_annotation_path: path of the coco json file, gzip compressed if it ends with '.gz'
+        stream: validate while parsing with ijson, so the file is never loaded into memory
+        check_references: also check that annotation image_id and category_id exist
+    Returns:
+        list of violations with their json paths, empty if the file is valid
+    Raises:
+        ValueError: if the file is not json
+    """
+    if not stream:
+        return validate_coco(read_coco_json(coco_annotation_path), check_references=check_references)
+
+    if ijson is None:
+        raise ImportError("stream=True requires ijson, install it with 'pip install ijson'")
+    validator = CocoValidator(check_references=check_references)
+    opener = gzip.open if coco_annotation_path.endswith('.gz') else open
+    with opener(coco_annotation_path, 'rb') as json_file:
+        try:
+            _stream_validate(json_file, validator)
+        except ijson.JSONError as e:
+            raise ValueError("poorly-formed text, not JSON: {}".format(e))
+    return validator.finish()
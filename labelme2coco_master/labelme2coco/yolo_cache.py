@@ -0,0 +1,200 @@
+import glob
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+
+from labelme2coco.columnar import _pool_string, _string_pool
+from labelme2coco.incremental import file_signature
+
+
+LABEL_CACHE_VERSION = 1
+LABEL_CACHE_NAME = 'labels.yolocache'
+LABEL_CACHE_MAGIC = b'YOLOLBL\0'
+# arrays start at multiples of this many bytes, so their memory-mapped views are aligned
+ALIGNMENT = 64
+
+
+def label_cache_sources(source_dir, pattern='*.json'):
+    """
+    Returns the source record of a label cache: the hash of the names, sizes and mtimes of the
+    labelme files of source_dir matching pattern.
+
+    Call it before reading the labelme files, so that a file changed during the export makes the cache stale.
+    """
+    source_dir = os.path.abspath(source_dir)
+    paths = sorted(glob.glob(os.path.join(source_dir, pattern)))
+    sha1 = hashlib.sha1()
+    for path in paths:
+        size, mtime = file_signature(path)
+        sha1.update('{}\0{}\0{}\n'.format(os.path.relpath(path, source_dir), size, mtime).encode('utf-8'))
+    return {'dir': source_dir, 'pattern': pattern, 'num_files': len(paths), 'hash': sha1.hexdigest()}
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_label_cache(cache_path, names, labels, sources, num_keypoints=0):
+    """
+    Writes the yolo labels of a split into one binary file that can be memory-mapped.
+
+    The classes, boxes and keypoints of all images are concatenated, the labels of image i are
+    rows offsets[i] to offsets[i + 1]. The file starts with a magic number and a json header
+    holding the source record and the position of every array.
+
+    Args:
+        cache_path: path of the cache file
+        names: label file names without extension, one per image
+        labels: (N, 5 + 3 * num_keypoints) arrays of yolo label rows (class, box, keypoints), one per image
+        sources: source record of label_cache_sources
+        num_keypoints: number of keypoints of every label
+    Returns:
+        cache_path
+    """
+    width = 5 + 3 * num_keypoints
+    rows = np.concatenate([np.asarray(image_labels, dtype=np.float32).reshape(-1, width) for image_labels in labels]
+                          + [np.zeros((0, width), dtype=np.float32)])
+    offsets = np.zeros(len(labels) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(image_labels) for image_labels in labels])
+    name_pool, name_offsets = _string_pool(names)
+    arrays = {
+        'class': np.ascontiguousarray(rows[:, 0]),
+        'box': np.ascontiguousarray(rows[:, 1:5]),
+        'keypoints': np.ascontiguousarray(rows[:, 5:]).reshape(len(rows), num_keypoints, 3),
+        'offsets': offsets,
+        'name_pool': name_pool,
+        'name_offsets': name_offsets,
+    }
+
+    columns = {}
+    position = 0
+    for name, array in arrays.items():
+        position = _align(position)
+        columns[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': position}
+        position += array.nbytes
+    header = json.dumps({
+        'version': LABEL_CACHE_VERSION,
+        'num_images': len(labels),
+        'num_labels': len(rows),
+        'num_keypoints': num_keypoints,
+        'sources': sources,
+        'columns': columns,
+    }).encode('utf-8')
+    data_start = _align(len(LABEL_CACHE_MAGIC) + 8 + len(header))
+
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(LABEL_CACHE_MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + columns[name]['offset'])
+            f.write(array.tobytes())
+        f.truncate(data_start + position)
+    os.replace(tmp_path, cache_path)
+    return cache_path
+
+
+def _read_header(f):
+    if f.read(len(LABEL_CACHE_MAGIC)) != LABEL_CACHE_MAGIC:
+        raise ValueError("not a yolo label cache")
+    header_size, = struct.unpack('<Q', f.read(8))
+    header = json.loads(f.read(header_size).decode('utf-8'))
+    return header, _align(len(LABEL_CACHE_MAGIC) + 8 + header_size)
+
+
+class YoloLabelCache(object):
+    """
+    Memory-mapped view of a label cache written by write_label_cache.
+
+    Opening a cache parses only its header, the label arrays are views of the file.
+    """
+
+    def __init__(self, cache_path, mmap_mode='r'):
+        """
+        Args:
+            cache_path: path of the cache file
+            mmap_mode: numpy memory-map mode of the arrays, None reads them into memory
+        """
+        with open(cache_path, 'rb') as f:
+            self.header, data_start = _read_header(f)
+        if self.header.get('version') != LABEL_CACHE_VERSION:
+            raise ValueError("unsupported yolo label cache version: {}".format(self.header.get('version')))
+        self.cache_path = cache_path
+        if mmap_mode is None:
+            data = np.fromfile(cache_path, dtype=np.uint8)
+        else:
+            data = np.memmap(cache_path, dtype=np.uint8, mode=mmap_mode)
+        self.columns = {}
+        for name, column in self.header['columns'].items():
+            start = data_start + column['offset']
+            dtype = np.dtype(column['dtype'])
+            size = dtype.itemsize * int(np.prod(column['shape']))
+            self.columns[name] = data[start:start + size].view(dtype).reshape(column['shape'])
+        self._indexes = None
+
+    def __len__(self):
+        return self.header['num_images']
+
+    @property
+    def num_keypoints(self):
+        return self.header['num_keypoints']
+
+    def name(self, index):
+        """
+        Returns the label file name, without extension, of the image at index.
+        """
+        return _pool_string(self.columns['name_pool'], self.columns['name_offsets'], index)
+
+    def index(self, name):
+        """
+        Returns the index of the image with the given label file name.
+        """
+        if self._indexes is None:
+            self._indexes = {self.name(index): index for index in range(len(self))}
+        return self._indexes[name]
+
+    def label_rows(self, index):
+        """
+        Returns the slice of label rows of the image at index.
+        """
+        offsets = self.columns['offsets']
+        return slice(int(offsets[index]), int(offsets[index + 1]))
+
+    def labels(self, index):
+        """
+        Returns the labels of the image at index, as views of the cache.
+
+        Returns:
+            dict with 'class' (N,), 'box' (N, 4) normalized [x_center, y_center, width, height]
+            and 'keypoints' (N, K, 3) normalized [x, y, visibility]
+        """
+        rows = self.label_rows(index)
+        return {name: self.columns[name][rows] for name in ('class', 'box', 'keypoints')}
+
+
+def load_label_cache(cache_path, verify=True, mmap_mode='r'):
+    """
+    Opens a label cache written by write_label_cache.
+
+    Args:
+        cache_path: path of the cache file
+        verify: check that the labelme files the cache was made from are unchanged
+        mmap_mode: numpy memory-map mode of the arrays, None reads them into memory
+    Returns:
+        YoloLabelCache, None if the cache is missing, unreadable or stale
+    """
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        cache = YoloLabelCache(cache_path, mmap_mode=mmap_mode)
+    except (OSError, ValueError):
+        return None
+    if verify:
+        sources = cache.header['sources']
+        if label_cache_sources(sources['dir'], sources['pattern']) != sources:
+            return None
+    return cache
@@ -0,0 +1,111 @@
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def pose_label_rows(instances, image_width, image_height, num_keypoints, class_id=0):
+    """
+    Returns the yolo pose labels of the instances of an image as one array.
+
+    Args:
+        instances: PoseInstance list, all with a box
+        image_width: width the coordinates are normalized by
+        image_height: height the coordinates are normalized by
+        num_keypoints: number of keypoints of every instance
+        class_id: class of the instances
+    Returns:
+        (N, 5 + 3 * num_keypoints) float64 rows of class, normalized [x_center, y_center, width, height]
+        and normalized [x, y, visibility] of every keypoint, zeros for keypoints that are not labeled
+    """
+    boxes = np.array([instance.box for instance in instances], dtype=np.float64).reshape(-1, 4)
+    keypoints = np.array([instance.keypoints for instance in instances], dtype=np.float64).reshape(-1, num_keypoints, 3)
+    scale = np.array([image_width, image_height], dtype=np.float64)
+
+    rows = np.zeros((len(boxes), 5 + 3 * num_keypoints), dtype=np.float64)
+    rows[:, 0] = class_id
+    rows[:, 1:3] = (boxes[:, :2] + boxes[:, 2:]) / 2 / scale
+    rows[:, 3:5] = (boxes[:, 2:] - boxes[:, :2]) / scale
+    row_keypoints = rows[:, 5:].reshape(len(boxes), num_keypoints, 3)
+    visible = keypoints[:, :, 2] != 0
+    row_keypoints[:, :, :2] = np.where(visible[:, :, None], keypoints[:, :, :2] / scale, 0)
+    row_keypoints[:, :, 2] = keypoints[:, :, 2]
+    return rows
+
+
+def format_label_rows(rows, num_keypoints=0, precision=6):
+    """
+    Formats yolo label rows as the text of a label file.
+
+    The format of every line is chosen from the visibility column of its keypoints, then all the
+    numbers of the file are formatted by a single % operation. Keypoints with zero visibility are
+    written '0 0 0'.
+
+    Args:
+        rows: (N, 5 + 3 * num_keypoints) label rows, see pose_label_rows
+        num_keypoints: number of keypoints of every row
+        precision: number of decimals of the coordinates
+    Returns:
+        text with one line per row, every line ending with a newline
+    """
+    rows = np.asarray(rows, dtype=np.float64).reshape(-1, 5 + 3 * num_keypoints)
+    if len(rows) == 0:
+        return ''
+    number = '%.{}f'.format(precision)
+    head = '%d' + (' ' + number) * 4
+    visible = rows[:, 7::3] != 0
+    point_formats = np.where(visible, ' {0} {0} %d'.format(number), ' 0 0 0')
+    text_format = ''.join(head + ''.join(line_points) + '\n' for line_points in point_formats.tolist())
+
+    # numbers of the visible keypoints only, in row order
+    used = np.ones(rows.shape, dtype=bool)
+    used[:, 5:] = np.repeat(visible, 3, axis=1)
+    return text_format % tuple(rows[used].tolist())
+
+
+class LabelWriterPool(object):
+    """
+    Writes label files from a thread pool, so the next image is converted while files are written.
+
+    Write errors are raised by a later write or by close. At most max_pending files wait to be written.
+    """
+
+    def __init__(self, workers=4, max_pending=256, buffering=1 << 16):
+        """
+        Args:
+            workers: number of writer threads
+            max_pending: number of files queued before write blocks
+            buffering: buffer size of the files, in bytes
+        """
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.max_pending = max_pending
+        self.buffering = buffering
+        self.pending = collections.deque()
+
+    def _write(self, path, text):
+        with open(path, 'w', encoding='utf-8', buffering=self.buffering) as f:
+            f.write(text)
+
+    def write(self, path, text):
+        """
+        Queues the writing of text to path.
+        """
+        while len(self.pending) >= self.max_pending:
+            self.pending.popleft().result()
+        self.pending.append(self.executor.submit(self._write, path, text))
+
+    def close(self):
+        """
+        Waits for all queued files to be written.
+        """
+        try:
+            while self.pending:
+                self.pending.popleft().result()
+        finally:
+            self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -17,6 +17,21 @@ class Tests(unittest.TestCase):
             _, response = read_and_validate_coco_annotation(true_sample)
             self.assertEqual(response, True)
 
+    def test_validate_coco_file(self):
+        from labelme2coco.validation import ijson, validate_coco_file
+
+        errors = validate_coco_file("tests/data/coco_false_3.json")
+        self.assertEqual(errors, ["$.images[1]: 'id' is a required property",
+                                  "$.annotations[2].image_id: image 2 does not exist"])
+        self.assertEqual(validate_coco_file("tests/data/coco_false_3.json", check_references=False), errors[:1])
+        self.assertEqual(validate_coco_file("tests/data/coco_true_1.json"), [])
+
+        if ijson is not None:
+            for ind in range(17):
+                json_path = "tests/data/coco_false_" + str(ind) + ".json"
+                self.assertEqual(sorted(validate_coco_file(json_path, stream=True)),
+                                 sorted(validate_coco_file(json_path)))
+
     def test_lableme2coco(self):
         from labelme2coco.labelme2coco import labelme2coco
         import json
@@ -28,7 +43,9 @@ class Tests(unittest.TestCase):
 
         with open(save_json_path) as json_file:
             test_coco = json.load(json_file)
-        self.assertEqual(test_coco["annotations"][1]["bbox"][1], 96.0)
+        self.assertAlmostEqual(test_coco["annotations"][1]["bbox"][1], 96.56382978723406)
+        self.assertAlmostEqual(test_coco["annotations"][1]["bbox"][2], 108.93617021276599)
+        self.assertAlmostEqual(test_coco["annotations"][1]["area"], 15654.606382978727)
         self.assertEqual(test_coco["annotations"][1]["id"], 2)
         self.assertEqual(test_coco["annotations"][1]["category_id"], 1)
         self.assertEqual(test_coco["annotations"][1]["segmentation"][0][2], 0.9361702127659877)
@@ -39,6 +56,333 @@ class Tests(unittest.TestCase):
         self.assertEqual(len(test_coco["categories"]), 2)
 
         os.remove(save_json_path)
+        os.remove(save_json_path + ".image_sizes.json")
+
+    def test_lableme2coco_raster_bbox(self):
+        from labelme2coco.labelme2coco import labelme2coco
+        import json
+        import os
+
+        labelme_folder = "tests/data/labelme_annot"
+        save_json_path = "tests/data/test_coco_raster.json"
+        labelme2coco(labelme_folder, save_json_path, bbox_mode="raster")
+
+        with open(save_json_path) as json_file:
+            test_coco = json.load(json_file)
+        self.assertEqual(test_coco["annotations"][1]["bbox"], [0.0, 96.0, 108.0, 187.0])
+
+        os.remove(save_json_path)
+        os.remove(save_json_path + ".image_sizes.json")
+
+    def test_lableme2coco_rle(self):
+        from labelme2coco.labelme2coco import labelme2coco
+        import json
+        import os
+
+        labelme_folder = "tests/data/labelme_annot"
+        save_json_path = "tests/data/test_coco_rle.json"
+        labelme2coco(labelme_folder, save_json_path, segmentation_format="rle")
+
+        with open(save_json_path) as json_file:
+            test_coco = json.load(json_file)
+        segmentation = test_coco["annotations"][2]["segmentation"]
+        self.assertEqual(segmentation["size"], [375, 500])
+        self.assertEqual(segmentation["counts"], ("nce45X;;E;E:F;I7O1O1O001O1O1O1O1O001O1O1O1O001O1O;E<DO100000"
+                                                  "00000000000000000000000000000000000000000000000000000000000O"
+                                                  "100000000000000000000000000000000000000000000000000000000000"
+                                                  "0000Vb0"))
+
+        os.remove(save_json_path)
+        os.remove(save_json_path + ".image_sizes.json")
+
+    def test_lableme2coco_workers(self):
+        from labelme2coco.labelme2coco import labelme2coco
+        import json
+        import os
+        import shutil
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as labelme_folder, tempfile.TemporaryDirectory() as save_dir:
+            with open("tests/data/labelme_annot/2011_000025.json") as json_file:
+                labelme_data = json.load(json_file)
+            for ind in range(6):
+                shutil.copy("tests/data/labelme_annot/2011_000025.jpg",
+                            os.path.join(labelme_folder, "image_" + str(ind) + ".jpg"))
+                labelme_data["shapes"] = labelme_data["shapes"][1:] + labelme_data["shapes"][:1]
+                with open(os.path.join(labelme_folder, "image_" + str(ind) + ".json"), "w") as json_file:
+                    json.dump(labelme_data, json_file)
+
+            serial_path = os.path.join(save_dir, "serial.json")
+            parallel_path = os.path.join(save_dir, "parallel.json")
+            labelme2coco(labelme_folder, serial_path)
+            labelme2coco(labelme_folder, parallel_path, workers=3)
+
+            with open(serial_path, "rb") as serial_file, open(parallel_path, "rb") as parallel_file:
+                self.assertEqual(serial_file.read(), parallel_file.read())
+
+    def test_lableme2coco_incremental(self):
+        from labelme2coco.labelme2coco import labelme2coco
+        import json
+        import os
+        import shutil
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as labelme_folder, tempfile.TemporaryDirectory() as save_dir:
+            with open("tests/data/labelme_annot/2011_000025.json") as json_file:
+                labelme_data = json.load(json_file)
+            for ind in range(4):
+                shutil.copy("tests/data/labelme_annot/2011_000025.jpg",
+                            os.path.join(labelme_folder, "image_" + str(ind) + ".jpg"))
+                with open(os.path.join(labelme_folder, "image_" + str(ind) + ".json"), "w") as json_file:
+                    json.dump(labelme_data, json_file)
+
+            full_path = os.path.join(save_dir, "full.json")
+            incremental_path = os.path.join(save_dir, "incremental.json")
+            labelme2coco(labelme_folder, full_path, image_size_cache=None)
+            labelme2coco(labelme_folder, incremental_path, image_size_cache=None, incremental=True)
+            with open(full_path, "rb") as full_file, open(incremental_path, "rb") as incremental_file:
+                self.assertEqual(full_file.read(), incremental_file.read())
+            with open(incremental_path) as json_file:
+                before = json.load(json_file)
+
+            # change one file, delete one and add one
+            labelme_data["shapes"] = labelme_data["shapes"][:1]
+            with open(os.path.join(labelme_folder, "image_1.json"), "w") as json_file:
+                json.dump(labelme_data, json_file)
+            os.remove(os.path.join(labelme_folder, "image_2.json"))
+            shutil.copy("tests/data/labelme_annot/2011_000025.jpg", os.path.join(labelme_folder, "image_4.jpg"))
+            with open(os.path.join(labelme_folder, "image_4.json"), "w") as json_file:
+                json.dump(labelme_data, json_file)
+            labelme2coco(labelme_folder, incremental_path, image_size_cache=None, incremental=True)
+            with open(incremental_path) as json_file:
+                after = json.load(json_file)
+
+            before_ids = {os.path.basename(image["file_name"]): image["id"] for image in before["images"]}
+            after_ids = {os.path.basename(image["file_name"]): image["id"] for image in after["images"]}
+            self.assertNotIn("image_2.jpg", after_ids)
+            for name in ["image_0.jpg", "image_1.jpg", "image_3.jpg"]:
+                self.assertEqual(after_ids[name], before_ids[name])
+            self.assertEqual(after_ids["image_4.jpg"], 5)
+
+            annotation_ids = [annotation["id"] for annotation in after["annotations"]]
+            self.assertEqual(len(annotation_ids), len(set(annotation_ids)))
+            self.assertEqual(len(after["annotations"]), 2 * len(before["annotations"]) // 4 + 2)
+            self.assertGreater(min(annotation_ids[-2:]), max(a["id"] for a in before["annotations"]))
+            self.assertEqual(after["categories"], before["categories"])
+
+    def test_columnar_export(self):
+        from labelme2coco.labelme2coco import labelme2coco
+        from labelme2coco.columnar import export_columnar, load_columnar
+        import json
+        import os
+        import tempfile
+        import numpy as np
+
+        with tempfile.TemporaryDirectory() as save_dir:
+            save_json_path = os.path.join(save_dir, "train.json")
+            labelme2coco("tests/data/labelme_annot", save_json_path, image_size_cache=None)
+            with open(save_json_path) as json_file:
+                coco = json.load(json_file)
+            bundle = load_columnar(export_columnar(save_json_path, os.path.join(save_dir, "train")))
+
+            self.assertEqual(len(bundle), len(coco["images"]))
+            self.assertEqual(bundle.categories, coco["categories"])
+            for image in coco["images"]:
+                index = bundle.image_index(image["id"])
+                self.assertEqual(bundle.image(index), image)
+                expected = [annotation for annotation in coco["annotations"] if annotation["image_id"] == image["id"]]
+                annotations = bundle.annotations(index)
+                self.assertEqual(annotations["id"].tolist(), [annotation["id"] for annotation in expected])
+                self.assertEqual(annotations["category_id"].tolist(),
+                                 [annotation["category_id"] for annotation in expected])
+                self.assertTrue(np.allclose(annotations["bbox"], [annotation["bbox"] for annotation in expected]))
+                rows = bundle.annotation_rows(index)
+                polygons = bundle.polygons(rows.start)
+                self.assertEqual(len(polygons), 1)
+                self.assertEqual(polygons[0].shape, (len(expected[0]["segmentation"][0]) // 2, 2))
+
+            # annotations must refer to an existing image, ids below and above the image ids are rejected
+            for image_id in [0, coco["images"][0]["id"] + 100]:
+                orphan = dict(coco, annotations=coco["annotations"] + [dict(coco["annotations"][0], image_id=image_id)])
+                with self.assertRaisesRegex(ValueError, "image_id {}".format(image_id)):
+                    export_columnar(orphan, os.path.join(save_dir, "orphan"))
+
+            # images are looked up by id whatever their order in the coco file
+            images = [dict(coco["images"][0], id=image_id) for image_id in [5, 2, 9]]
+            bundle = load_columnar(export_columnar({"images": images, "annotations": [], "categories": []},
+                                                   os.path.join(save_dir, "unordered")))
+            self.assertEqual([bundle.image_index(image_id) for image_id in [2, 5, 9]], [1, 0, 2])
+            for image_id in [1, 3, 10]:
+                with self.assertRaises(KeyError):
+                    bundle.image_index(image_id)
+
+    def test_category_registry(self):
+        from labelme2coco.categories import CategoryRegistry
+        from labelme2coco.labelme2coco import labelme2coco
+        import json
+        import os
+        import tempfile
+
+        registry = CategoryRegistry(["horse", "person"], start_id=0, frozen=True)
+        self.assertEqual(registry.add("person"), 1)
+        self.assertIsNone(registry.add("dog"))
+        self.assertNotIn("dog", registry)
+
+        registry = CategoryRegistry.from_categories([{"name": "car", "id": 3}, {"name": "bus", "id": 7}])
+        self.assertEqual(registry.add("truck"), 8)
+
+        with tempfile.TemporaryDirectory() as save_dir:
+            labels_file = os.path.join(save_dir, "labels.txt")
+            with open(labels_file, "w") as f:
+                f.write("__ignore__\n__background__\ncar\nperson\n")
+            save_json_path = os.path.join(save_dir, "coco.json")
+            labelme2coco("tests/data/labelme_annot", save_json_path, image_size_cache=None,
+                         category_ids="labels_file", labels_file=labels_file)
+            with open(save_json_path) as json_file:
+                coco = json.load(json_file)
+            self.assertEqual([(category["name"], category["id"]) for category in coco["categories"]],
+                             [("car", 1), ("person", 2)])
+            self.assertEqual([annotation["category_id"] for annotation in coco["annotations"]], [1])
+
+            # an incremental run with another labels file converts the unchanged files again
+            incremental_path = os.path.join(save_dir, "incremental.json")
+            labelme2coco("tests/data/labelme_annot", incremental_path, image_size_cache=None,
+                         category_ids="labels_file", labels_file=labels_file, incremental=True)
+            with open(labels_file, "w") as f:
+                f.write("person\ncar\n")
+            labelme2coco("tests/data/labelme_annot", incremental_path, image_size_cache=None,
+                         category_ids="labels_file", labels_file=labels_file, incremental=True)
+            with open(incremental_path) as json_file:
+                coco = json.load(json_file)
+            self.assertEqual([(category["name"], category["id"]) for category in coco["categories"]],
+                             [("person", 1), ("car", 2)])
+            self.assertEqual([annotation["category_id"] for annotation in coco["annotations"]], [2])
+
+    def test_group_pose_instances(self):
+        from labelme2coco.pose import group_instances, keypoint_index, unknown_shapes
+
+        def point(label, x, y, group_id=None):
+            return {"label": label, "shape_type": "point", "points": [[x, y]], "group_id": group_id}
+
+        shapes = [
+            {"label": "horse", "shape_type": "rectangle", "points": [[0, 0], [90, 90]], "group_id": None},
+            point("Nose", 120, 10, group_id=7),
+            {"label": "horse", "shape_type": "rectangle", "points": [[150, 90], [100, 0]], "group_id": 7},
+            point("Nose", 10, 10),
+            point("L_Eye", 110, 20),
+            point("R_Eye", 300, 300),
+        ]
+        instances, unassigned, ambiguous = group_instances(shapes, keypoint_index(["L_Eye", "R_Eye", "Nose"]))
+        self.assertEqual([instance.bbox() for instance in instances], [[0, 0, 90, 90], [100, 0, 50, 90]])
+        self.assertEqual(instances[0].keypoints.tolist(), [[0, 0, 0], [0, 0, 0], [10, 10, 2]])
+        self.assertEqual(instances[1].keypoints.tolist(), [[110, 20, 2], [0, 0, 0], [120, 10, 2]])
+        self.assertEqual([shape["label"] for shape in unassigned], ["R_Eye"])
+        self.assertEqual(ambiguous, [])
+
+        # two overlapping boxes: each nose goes to the box whose center it is closest to, whatever the order
+        shapes = [
+            point("Nose", 55, 50),
+            point("Nose", 45, 50),
+            {"label": "horse", "shape_type": "rectangle", "points": [[0, 0], [80, 100]]},
+            {"label": "horse", "shape_type": "rectangle", "points": [[20, 0], [100, 100]]},
+        ]
+        instances, unassigned, ambiguous = group_instances(shapes, keypoint_index(["Nose"]))
+        self.assertEqual([instance.keypoints[0, 0] for instance in instances], [45, 55])
+        self.assertEqual(len(ambiguous), 2)
+
+        # shapes that are neither instance boxes nor keypoints are ignored and can be reported
+        shapes.extend([point("Tail", 50, 50), {"label": "rider", "shape_type": "rectangle", "points": [[0, 0], [9, 9]]}])
+        instances, _, _ = group_instances(shapes, keypoint_index(["Nose"]), box_labels={"horse"})
+        self.assertEqual(len(instances), 2)
+        self.assertEqual([shape["label"] for shape in unknown_shapes(shapes, keypoint_index(["Nose"]), {"horse"})],
+                         ["Tail", "rider"])
+
+    def test_yolo_label_cache(self):
+        from labelme2coco.yolo_cache import label_cache_sources, load_label_cache, write_label_cache
+        import os
+        import shutil
+        import tempfile
+        import numpy as np
+
+        labels = [np.arange(2 * 11, dtype=np.float32).reshape(2, 11), np.zeros((0, 11), dtype=np.float32)]
+        with tempfile.TemporaryDirectory() as save_dir:
+            shutil.copy("tests/data/labelme_annot/2011_000025.json", save_dir)
+            cache_path = os.path.join(save_dir, "labels.yolocache")
+            write_label_cache(cache_path, ["2011_000025", "empty"], labels, label_cache_sources(save_dir),
+                              num_keypoints=2)
+
+            cache = load_label_cache(cache_path)
+            self.assertEqual(len(cache), 2)
+            self.assertEqual(cache.index("empty"), 1)
+            first = cache.labels(cache.index("2011_000025"))
+            self.assertEqual(first["class"].tolist(), [0, 11])
+            self.assertEqual(first["box"].tolist(), labels[0][:, 1:5].tolist())
+            self.assertEqual(first["keypoints"].tolist(), labels[0][:, 5:].reshape(2, 2, 3).tolist())
+            self.assertEqual(cache.labels(1)["keypoints"].shape, (0, 2, 3))
+            del cache, first
+
+            # a new labelme file makes the cache stale
+            shutil.copy("tests/data/labelme_annot/2011_000025.json", os.path.join(save_dir, "2011_000026.json"))
+            self.assertIsNone(load_label_cache(cache_path))
+            self.assertIsNotNone(load_label_cache(cache_path, verify=False))
+
+    def test_yolo_pose_label_format(self):
+        from labelme2coco.pose import PoseInstance
+        from labelme2coco.yolo_labels import LabelWriterPool, format_label_rows, pose_label_rows
+        import os
+        import tempfile
+
+        instance = PoseInstance(3, box=[10, 20, 50, 100])
+        instance.set_keypoint(0, 25, 40)
+        instance.set_keypoint(2, 1, 99)
+        rows = pose_label_rows([instance], 200, 100, 3, class_id=1)
+        self.assertEqual(rows.shape, (1, 14))
+        self.assertEqual(format_label_rows(rows, 3),
+                         "1 0.150000 0.600000 0.200000 0.800000 0.125000 0.400000 2 0 0 0 0.005000 0.990000 2\n")
+        self.assertEqual(format_label_rows(rows, 3, precision=2),
+                         "1 0.15 0.60 0.20 0.80 0.12 0.40 2 0 0 0 0.01 0.99 2\n")
+        self.assertEqual(format_label_rows(pose_label_rows([], 200, 100, 3), 3), "")
+
+        with tempfile.TemporaryDirectory() as save_dir:
+            with LabelWriterPool(workers=2, max_pending=1) as writer:
+                for index in range(5):
+                    writer.write(os.path.join(save_dir, "{}.txt".format(index)), str(index))
+            for index in range(5):
+                with open(os.path.join(save_dir, "{}.txt".format(index))) as txt_file:
+                    self.assertEqual(txt_file.read(), str(index))
+
+    def test_image_size_cache(self):
+        from labelme2coco.image_utils import ImageSizeCache, read_image_size
+        from labelme2coco.labelme2coco import labelme2coco
+        from unittest import mock
+        import os
+        import tempfile
+
+        image_path = "tests/data/labelme_annot/2011_000025.jpg"
+        self.assertEqual(read_image_size(image_path), (500, 375))
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_path = os.path.join(cache_dir, "image_sizes.json")
+            image_sizes = ImageSizeCache(cache_path)
+            self.assertEqual(image_sizes.get(image_path), (500, 375))
+            image_sizes.save()
+
+            with mock.patch("labelme2coco.image_utils.read_image_size") as read_size:
+                self.assertEqual(ImageSizeCache(cache_path).get(image_path), (500, 375))
+                read_size.assert_not_called()
+
+            # a second conversion of an unchanged folder opens no image, with the default cache next to the coco json
+            save_json_path = os.path.join(cache_dir, "coco.json")
+            labelme2coco("tests/data/labelme_annot", save_json_path)
+            with open(save_json_path, "rb") as json_file:
+                first = json_file.read()
+            with mock.patch("labelme2coco.image_utils.read_image_size") as read_size, \
+                    mock.patch("PIL.Image.open") as image_open:
+                labelme2coco("tests/data/labelme_annot", save_json_path)
+                read_size.assert_not_called()
+                image_open.assert_not_called()
+            with open(save_json_path, "rb") as json_file:
+                self.assertEqual(json_file.read(), first)
 
 
 if __name__ == '__main__':
@@ -13,13 +13,17 @@
 #-----------------------------------------------------#
 """
 
-import json
 import numpy as np
 import glob
 from pathlib import Path
-import shutil
+import multiprocessing
 import os
 
+# labelme2coco 来自本仓库的 labelme2coco_master，运行前在仓库根目录执行：pip install -e labelme2coco_master
+from labelme2coco.labelme_io import load_labelme_json
+from labelme2coco.categories import CategoryRegistry, read_labels_file
+from labelme2coco.file_links import materialize_file
+
 class labelme2yolo():
     def __init__(
             self,
@@ -29,7 +33,14 @@ class labelme2yolo():
             obj_name='labels.txt',
             dataset_type = 'train',
             image_type = '.jpg',
+            image_mode = 'copy',
+            workers = 1,
             ):
+        """
+        image_mode: 图像放入数据集目录的方式，'hardlink'、'symlink'、'reflink' 不复制图像数据，
+            文件系统不支持时退回 'copy'
+        workers: 解析 json、写入 txt 的进程数
+        """
 
         self.labelme_image_path = labelme_image_path
         self.labelme_json_path = labelme_json_path
@@ -39,49 +50,43 @@ class labelme2yolo():
         self.save_image_dir = 'obj_'+dataset_type+'_data'
 
         self.image_type = image_type
+        self.image_mode = image_mode
+        self.workers = workers
         self.width = 0
         self.height = 0
-        self.labels = []
-        self.labels_out = []
-
-        with open(obj_name, 'r') as f:
-            while True:
-                n = f.readline().strip()
-                if not n:
-                    break
-                if n[0] != '_':
-                    self.labels.append(n)
-                    self.labels_out.append(n + '\n')
+        # 类别 ID 从0开始，按 obj_name 中的顺序编号，用字典查找
+        self.category_registry = CategoryRegistry(read_labels_file(obj_name), start_id=0, frozen=True)
+        self.labels = self.category_registry.labels
+        self.labels_out = [label + '\n' for label in self.labels]
 
         self.classes = len(self.labels)
 
         self.transfer()
 
     def parse_json2txt(self, json_file, path_txt):
-        with open(json_file, 'r') as fp:
-            with open(path_txt, 'w+') as ftxt:
-                data = json.load(fp)
-                self.height = data['imageHeight']
-                self.width = data['imageWidth']
-                for shape in data['shapes']:
-                    label = shape['label']
-                    shape_type =  shape['shape_type']
-
-                    if shape_type != "rectangle":
-                        print('只支持retangle标注')
-                        break
-
-                    if label in self.labels:
-                        idx = self.labels.index(label)
-                        points = shape['points']
-                        x_center, y_center, w, h = self.point_to_box(points)
-
-                        str_annotation = str(idx) + ' ' + str(x_center) + ' ' + \
-                                         str(y_center) + ' ' + str(w) + ' ' + \
-                                         str(h)+ '\n'
-                        ftxt.writelines(str_annotation)
-                    else:
-                        print('label: {} 已忽略'.format(label))
+        data = load_labelme_json(json_file)  # 不解析 imageData
+        with open(path_txt, 'w+') as ftxt:
+            self.height = data['imageHeight']
+            self.width = data['imageWidth']
+            for shape in data['shapes']:
+                label = shape['label']
+                shape_type =  shape['shape_type']
+
+                if shape_type != "rectangle":
+                    print('只支持retangle标注')
+                    break
+
+                idx = self.category_registry.get(label)
+                if idx is not None:
+                    points = shape['points']
+                    x_center, y_center, w, h = self.point_to_box(points)
+
+                    str_annotation = str(idx) + ' ' + str(x_center) + ' ' + \
+                                     str(y_center) + ' ' + str(w) + ' ' + \
+                                     str(h)+ '\n'
+                    ftxt.writelines(str_annotation)
+                else:
+                    print('label: {} 已忽略'.format(label))
 
     def point_to_box(self, points):
         min_x = min_y = np.inf
@@ -136,27 +141,67 @@ class labelme2yolo():
             obj_data_text = 'classes = {}\n{} = {}\nnames = {}\nbackup = backup/'.format(self.classes, self.dataset_type, txt_1, txt_2)
             obj_d.writelines(obj_data_text)
 
-            for json_file in labelme_json:
-                print(json_file)
-                fn = json_file.split('\\')[-1]
-                fn_txt = fn.split('.')[0] + '.txt'
-                fn_img = fn.split('.')[0] + self.image_type
+            # 数据集列表按 json 文件的顺序写入
+            for save_path_name in self.export_files(labelme_json, obj_image_dir):
+                if save_path_name is not None:
+                    ytxt.writelines(save_path_name + '\n')
+
+    def export_files(self, labelme_json, obj_image_dir):
+        """
+        按顺序返回每个 json 文件的 export_file 结果，workers > 1 时在进程池中处理
+        """
+        tasks = [(json_file, obj_image_dir) for json_file in labelme_json]
+        if self.workers <= 1:
+            for json_file, obj_image_dir in tasks:
+                yield self.export_file(json_file, obj_image_dir)
+            return
+
+        chunksize = max(1, min(64, len(tasks) // (self.workers * 4)))
+        with multiprocessing.Pool(self.workers, initializer=_init_worker, initargs=(self,)) as pool:
+            for save_path_name in pool.imap(_export_file, tasks, chunksize=chunksize):
+                yield save_path_name
+
+    def export_file(self, json_file, obj_image_dir):
+        """
+        放置一个 json 文件对应的图像并写入 txt 标签
+
+        返回数据集列表中的图像路径，未找到图像时返回 None
+        """
+        print(json_file)
+        # 用 os.path 取文件名，Windows 和 Linux 路径都适用
+        fn = os.path.splitext(os.path.basename(json_file))[0]
+        fn_txt = fn + '.txt'
+        fn_img = fn + self.image_type
+
+        path_txt = obj_image_dir.joinpath(fn_txt)
+        path_img = obj_image_dir.joinpath(fn_img)
+        origin_path_img =  Path(self.labelme_image_path).joinpath(fn_img)
+
+        if not origin_path_img.exists():
+            print('未找到标签对应图像文件：{}'.format(origin_path_img))
+            return None
+
+        materialize_file(str(origin_path_img), str(path_img), self.image_mode)
+
+        self.parse_json2txt(json_file, path_txt)
+
+        # 保存数据集路径
+        return str(path_img.relative_to(path_img.parent.parent.parent)).replace('\\','/')
+
+
+# 进程池中使用的转换器，见 labelme2yolo.export_files
+_worker_converter = None
 
-                path_txt = obj_image_dir.joinpath(fn_txt)
-                path_img = obj_image_dir.joinpath(fn_img)
-                origin_path_img =  Path(self.labelme_image_path).joinpath(fn_img)
 
-                if not origin_path_img.exists():
-                    print('未找到标签对应图像文件：{}'.format(origin_path_img))
-                    continue
+def _init_worker(converter):
+    global _worker_converter
+    _worker_converter = converter
 
-                shutil.copyfile(origin_path_img, path_img)
 
-                # 保存数据集路径
-                save_path_name = str(path_img.relative_to(path_img.parent.parent.parent)).replace('\\','/')
-                ytxt.writelines(save_path_name + '\n')
+def _export_file(task):
+    json_file, obj_image_dir = task
+    return _worker_converter.export_file(json_file, obj_image_dir)
 
-                self.parse_json2txt(json_file, path_txt)
 
 if __name__ == '__main__':
     labelme2yolo(r'D:\SHARE\labelme\examples\instance_segmentation\all_deblured',
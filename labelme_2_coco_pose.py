@@ -1,6 +1,11 @@
 import os
 import json
 
+# labelme2coco 来自本仓库的 labelme2coco_master，运行前在仓库根目录执行：pip install -e labelme2coco_master
+from labelme2coco.columnar import export_columnar
+from labelme2coco.labelme_io import load_labelme_json
+from labelme2coco.pose import group_instances, keypoint_index
+
 pose_point_categories = {
     "categories": [
         {
@@ -44,6 +49,8 @@ class LabelMe2COCO:
         self.save_json_path = save_json_path
         self.pose_point_categories = pose_point_categories
         self.key_points_list = pose_point_categories["categories"][0]["keypoints"]
+        # 关键点名称 -> 在 keypoints 中的序号
+        self.key_points_index = keypoint_index(self.key_points_list)
 
         self.images = []
         self.annotations = []
@@ -69,53 +76,34 @@ class LabelMe2COCO:
     def data2coco(self):
         for file_path in self.labelme_files_list:
             print(f'Processing {file_path}...')
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                self.images.append(self.image_info(data))
-                self.annotations.append(self.process_annotations(data))
-
-    def process_annotations(self, data):
-        keypoints = self.get_keypoints(data)
-        bbox = self.calculate_bbox(data)
-
-        annotation = {
-            'keypoints': keypoints,
-            'image_id': self.image_id - 1,  # 当前图像ID
-            'id': self.ann_id - 1,
-            'num_keypoints': sum([1 for i in range(0, len(keypoints), 3) if keypoints[i] != 0]),
-            'bbox': bbox,
-            'iscrowd': 0,
-            'area': bbox[2] * bbox[3],  # 面积为宽度 * 高度
-            'category_id': 1  # 假设所有的关键点都属于类别 1 (动物)
-        }
-
-        self.ann_id += 1
-        return annotation
-
-    def get_keypoints(self, data):
-        keypoints_coco_format = []
-        for point_name in self.key_points_list:
-            found = False
-            for shape in data.get('shapes', []):
-                if shape['label'] == point_name:
-                    x, y = shape['points'][0]
-                    keypoints_coco_format.extend([x, y, 2.0])
-                    found = True
-                    break
-            if not found:
-                keypoints_coco_format.extend([0.0, 0.0, 0.0])
-        return keypoints_coco_format
-
-    def calculate_bbox(self, data):
-        # 找到 'rectangle' 类型的形状，并计算边界框
-        for shape in data.get('shapes', []):
-            if shape['shape_type'] == 'rectangle':
-                x_min, y_min = shape['points'][0]
-                x_max, y_max = shape['points'][1]
-                width = x_max - x_min
-                height = y_max - y_min
-                return [x_min, y_min, width, height]
-        return [0.0, 0.0, 0.0, 0.0]  # 如果没有找到 'rectangle' 返回空边界框
+            data = load_labelme_json(file_path)  # 不解析 imageData
+            self.images.append(self.image_info(data))
+            self.annotations.extend(self.process_annotations(data, file_path))
+
+    def process_annotations(self, data, file_path=''):
+        # 一次遍历所有形状，按 group_id 或矩形框包含关系把关键点分到每只动物，每只动物一条标注
+        instances, unassigned, ambiguous = group_instances(data.get('shapes', []), self.key_points_index)
+        for shape in unassigned:
+            print(f"警告: {file_path} 中的关键点 '{shape['label']}' 不在任何矩形框内，已忽略。")
+        for shape in ambiguous:
+            print(f"警告: {file_path} 中的关键点 '{shape['label']}' {shape['points'][0]} 位于多个矩形框附近，请检查归属。")
+
+        annotations = []
+        for instance in instances:
+            bbox = instance.bbox()
+            annotation = {
+                'keypoints': instance.keypoints.ravel().tolist(),
+                'image_id': self.image_id - 1,  # 当前图像ID
+                'id': self.ann_id - 1,
+                'num_keypoints': instance.num_visible,
+                'bbox': bbox,
+                'iscrowd': 0,
+                'area': bbox[2] * bbox[3],  # 面积为宽度 * 高度
+                'category_id': 1  # 假设所有的关键点都属于类别 1 (动物)
+            }
+            self.ann_id += 1
+            annotations.append(annotation)
+        return annotations
 
     def get_json_list(self, json_dir):
         target_extension = '.json'
@@ -147,7 +135,7 @@ class LabelMe2COCO:
         print(f"COCO format JSON saved at {self.save_json_path}")
 
 
-def convert(total_data_dir, annotations_dir, pose_point_categories):
+def convert(total_data_dir, annotations_dir, pose_point_categories, columnar=False):
     convert_list = ['train', 'test', 'val']  # 需要处理的三个文件夹
     for folder in convert_list:
         folder_path = os.path.join(total_data_dir, folder)
@@ -160,15 +148,19 @@ def convert(total_data_dir, annotations_dir, pose_point_categories):
 
         convert_file.data2coco()  # 处理文件夹中的所有json文件
         convert_file.save_json()  # 保存生成的COCO格式json
+        if columnar:
+            # 额外导出可内存映射的列式数据（horse_train/ 等目录），训练启动时无需解析json
+            bundle_dir = export_columnar(save_json_path, os.path.splitext(save_json_path)[0])
+            print(f'Exported columnar bundle to {bundle_dir}')
         print(f'Converted {folder_path} to {save_json_path} successfully.')
 
 
-def main(total_data_dir, pose_point_categories):
+def main(total_data_dir, pose_point_categories, columnar=False):
     annotations_dir = os.path.join(total_data_dir, 'annotations')
     if not os.path.exists(annotations_dir):
         os.makedirs(annotations_dir)
 
-    convert(total_data_dir, annotations_dir, pose_point_categories)
+    convert(total_data_dir, annotations_dir, pose_point_categories, columnar=columnar)
 
 
 if __name__ == '__main__':
@@ -1,7 +1,12 @@
-import json
 import os
 import glob
 
+# labelme2coco 来自本仓库的 labelme2coco_master，运行前在仓库根目录执行：pip install -e labelme2coco_master
+from labelme2coco.labelme_io import load_labelme_json
+from labelme2coco.pose import group_instances, keypoint_index, unknown_shapes
+from labelme2coco.yolo_cache import LABEL_CACHE_NAME, label_cache_sources, write_label_cache
+from labelme2coco.yolo_labels import LabelWriterPool, format_label_rows, pose_label_rows
+
 # 定义关键点的顺序
 KEYPOINTS_ORDER = [
     "L_Eye",
@@ -25,9 +30,21 @@ KEYPOINTS_ORDER = [
     "L_B_Paw",
     "R_B_Paw"
 ]
+KEYPOINTS_INDEX = keypoint_index(KEYPOINTS_ORDER)
+
+
+def convert_labelme_to_yolo_multiple(json_dir, output_dir, label_cache=True, precision=6, writers=4):
+    """
+    将 json_dir 中的 LabelMe JSON 转换为 YOLO 姿态 TXT 文件
 
+    :param label_cache: 同时在 output_dir 中写入二进制标签缓存 labels.yolocache，
+        训练和检查时可以直接内存映射读取，而不必解析每个 TXT 文件
+    :param precision: 坐标保留的小数位数
+    :param writers: 写 TXT 文件的线程数，写文件与下一张图像的转换并行
+    """
+    # 在读取 JSON 之前记录源文件的名称、大小和修改时间，转换期间被修改的文件会使缓存失效
+    sources = label_cache_sources(json_dir) if label_cache else None
 
-def convert_labelme_to_yolo_multiple(json_dir, output_dir):
     # 获取所有JSON文件
     json_files = glob.glob(os.path.join(json_dir, "*.json"))
 
@@ -35,82 +52,52 @@ def convert_labelme_to_yolo_multiple(json_dir, output_dir):
         print("警告: 在指定目录中未找到任何JSON文件。")
         return
 
-    for json_file in json_files:
-        # 读取JSON文件
-        with open(json_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-
-        image_width = data['imageWidth']
-        image_height = data['imageHeight']
-        image_name = os.path.splitext(os.path.basename(data['imagePath']))[0]
-
-        shapes = data['shapes']
-
-        # 初始化列表以存储所有对象的YOLO行
-        yolo_lines = []
-
-        i = 0
-        while i < len(shapes):
-            shape = shapes[i]
-            if shape['label'] == 'horse' and shape['shape_type'] == 'rectangle':
-                # 提取边界框
-                coords = shape['points']
-                x_min = min(coord[0] for coord in coords)
-                y_min = min(coord[1] for coord in coords)
-                x_max = max(coord[0] for coord in coords)
-                y_max = max(coord[1] for coord in coords)
-                bounding_box = (x_min, y_min, x_max, y_max)
-
-                # 计算边界框的中心坐标和宽高，归一化
-                box_center_x = (x_min + x_max) / 2 / image_width
-                box_center_y = (y_min + y_max) / 2 / image_height
-                box_width = (x_max - x_min) / image_width
-                box_height = (y_max - y_min) / image_height
-
-                # 初始化关键点字典
-                keypoints_dict = {kp: (0, 0, 0) for kp in KEYPOINTS_ORDER}
-
-                # 处理当前"horse"后的关键点，直到下一个"horse"或结束
-                i += 1
-                while i < len(shapes) and not (
-                        shapes[i]['label'] == 'horse' and shapes[i]['shape_type'] == 'rectangle'):
-                    kp_shape = shapes[i]
-                    if kp_shape['shape_type'] == 'point' and kp_shape['label'] in keypoints_dict:
-                        x, y = kp_shape['points'][0]
-                        keypoints_dict[kp_shape['label']] = (x / image_width, y / image_height, 2)  # 归一化并设为可见
-                    else:
-                        print(f"警告: 未知的关键点标签 '{kp_shape['label']}' 被忽略。")
-                    i += 1
-
-                # 构建YOLO行
-                class_id = 0  # 类别ID为0
-                yolo_line = f"{class_id} {box_center_x:.6f} {box_center_y:.6f} {box_width:.6f} {box_height:.6f}"
-
-                # 添加关键点信息
-                for kp in KEYPOINTS_ORDER:
-                    x, y, visibility = keypoints_dict[kp]
-                    if visibility == 2:
-                        yolo_line += f" {x:.6f} {y:.6f} {visibility}"
-                    else:
-                        yolo_line += " 0 0 0"
-
-                yolo_lines.append(yolo_line)
-            else:
-                i += 1  # 如果不是"horse"的边界框，继续下一个
-
-        if not yolo_lines:
-            print(f"警告: 文件 '{json_file}' 中未检测到任何 'horse' 对象。")
-
-        # 确保输出目录存在
-        os.makedirs(output_dir, exist_ok=True)
-
-        # 写入TXT文件
-        txt_filename = os.path.join(output_dir, f"{image_name}.txt")
-        with open(txt_filename, 'w', encoding='utf-8') as txt_file:
-            for line in yolo_lines:
-                txt_file.write(line + '\n')
-
-        print(f"转换成功: {txt_filename}")
+    # 确保输出目录存在
+    os.makedirs(output_dir, exist_ok=True)
+
+    # 缓存的图像名和每张图像的标签数组
+    cache_names = []
+    cache_labels = []
+    with LabelWriterPool(workers=writers) as writer:
+        for json_file in json_files:
+            # 读取JSON文件（不解析 imageData）
+            data = load_labelme_json(json_file)
+
+            image_width = data['imageWidth']
+            image_height = data['imageHeight']
+            image_name = os.path.splitext(os.path.basename(data['imagePath']))[0]
+
+            shapes = data['shapes']
+
+            # 按 group_id 或位置把关键点分配给 'horse' 框，与标注顺序无关
+            instances, unassigned, ambiguous = group_instances(shapes, KEYPOINTS_INDEX, box_labels={'horse'},
+                                                               require_box=True)
+            for kp_shape in unassigned:
+                print(f"警告: 文件 '{json_file}' 中的关键点 '{kp_shape['label']}' 不属于任何 'horse' 框，已忽略。")
+            for kp_shape in unknown_shapes(shapes, KEYPOINTS_INDEX, box_labels={'horse'}):
+                print(f"警告: 文件 '{json_file}' 中的未知关键点标签 '{kp_shape['label']}' 被忽略。")
+            for kp_shape in ambiguous:
+                print(f"警告: 文件 '{json_file}' 中的关键点 '{kp_shape['label']}' {kp_shape['points'][0]} "
+                      f"位于多个 'horse' 框附近，请检查归属。")
+
+            # 每个实例一行: 类别ID（为0）、归一化的边界框中心坐标和宽高、每个关键点的 x, y, visibility
+            yolo_rows = pose_label_rows(instances, image_width, image_height, len(KEYPOINTS_ORDER), class_id=0)
+
+            if not len(yolo_rows):
+                print(f"警告: 文件 '{json_file}' 中未检测到任何 'horse' 对象。")
+
+            # 一次格式化整张图像的标签，未标注的关键点写为 "0 0 0"
+            txt_filename = os.path.join(output_dir, f"{image_name}.txt")
+            writer.write(txt_filename, format_label_rows(yolo_rows, len(KEYPOINTS_ORDER), precision=precision))
+
+            print(f"转换成功: {txt_filename}")
+            cache_names.append(image_name)
+            cache_labels.append(yolo_rows)
+
+    if label_cache:
+        cache_path = write_label_cache(os.path.join(output_dir, LABEL_CACHE_NAME), cache_names, cache_labels,
+                                       sources, num_keypoints=len(KEYPOINTS_ORDER))
+        print(f"标签缓存已写入: {cache_path}")
 
 
 # 批量转换示例用法
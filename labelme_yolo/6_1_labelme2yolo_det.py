@@ -13,26 +13,37 @@
 #-----------------------------------------------------#
 """
 
-import json
 import numpy as np
 from pathlib import Path
 import glob
 import os
 
+# labelme2coco 来自本仓库的 labelme2coco_master，运行前在仓库根目录执行：pip install -e labelme2coco_master
+from labelme2coco.labelme_io import load_labelme_json
+from labelme2coco.categories import CategoryRegistry, read_labels_file
+from labelme2coco.yolo_cache import LABEL_CACHE_NAME, label_cache_sources, write_label_cache
+
 class LabelmeToYOLO:
     def __init__(
             self,
             root_dir: str,
-            labels_file: str
+            labels_file: str,
+            label_cache: bool = True,
+            single_class: bool = True
             ):
         """
         初始化转换器
 
         :param root_dir: YOLO数据集格式的根目录路径
         :param labels_file: 包含所有类别名称的文件，每行一个类别
+        :param label_cache: 在每个包含 JSON 的文件夹中写入二进制标签缓存 labels.yolocache，
+            训练和检查时可以直接内存映射读取，而不必解析每个 TXT 文件
+        :param single_class: 所有目标都写为类别 0；为 False 时按标签文件中的顺序写入各标签的类别 ID
         """
         self.root_dir = Path(root_dir)
         self.labels_file = Path(labels_file)
+        self.label_cache = label_cache
+        self.single_class = single_class
         self.labels = []
         self.labels_out = []
 
@@ -46,12 +57,10 @@ class LabelmeToYOLO:
         if not self.labels_file.exists():
             raise FileNotFoundError(f"标签文件未找到: {self.labels_file}")
 
-        with self.labels_file.open('r', encoding='utf-8') as f:
-            for line in f:
-                label = line.strip()
-                if label and not label.startswith('_'):
-                    self.labels.append(label)
-                    self.labels_out.append(label + '\n')
+        # 类别 ID 从0开始，按标签文件中的顺序编号，用字典查找
+        self.category_registry = CategoryRegistry(read_labels_file(self.labels_file), start_id=0, frozen=True)
+        self.labels = self.category_registry.labels
+        self.labels_out = [label + '\n' for label in self.labels]
         self.classes = len(self.labels)
         if self.classes == 0:
             raise ValueError("没有有效的标签被读取。请检查标签文件。")
@@ -66,21 +75,38 @@ class LabelmeToYOLO:
             print(f"在 {self.root_dir} 中未找到任何 JSON 文件。")
             return
 
+        # 按文件夹（数据集划分）分组，每个文件夹一个缓存文件
+        folders = {}
         for json_file in json_files:
-            try:
-                self.json_to_txt(json_file)
-                print(f"已转换: {json_file}")
-            except Exception as e:
-                print(f"转换失败: {json_file}，错误: {e}")
+            folders.setdefault(json_file.parent, []).append(json_file)
+
+        for folder, folder_json_files in folders.items():
+            # 在读取 JSON 之前记录源文件的名称、大小和修改时间，转换期间被修改的文件会使缓存失效
+            sources = label_cache_sources(str(folder)) if self.label_cache else None
+            cache_names = []
+            cache_labels = []
+            for json_file in folder_json_files:
+                try:
+                    labels = self.json_to_txt(json_file)
+                    print(f"已转换: {json_file}")
+                except Exception as e:
+                    print(f"转换失败: {json_file}，错误: {e}")
+                    continue
+                cache_names.append(json_file.stem)
+                cache_labels.append(labels)
+
+            if self.label_cache:
+                cache_path = write_label_cache(str(folder / LABEL_CACHE_NAME), cache_names, cache_labels, sources)
+                print(f"标签缓存已写入: {cache_path}")
 
     def json_to_txt(self, json_file: Path):
         """
         将单个 JSON 文件转换为 YOLO 格式的 TXT 文件
 
         :param json_file: JSON 文件路径
+        :return: (N, 5) 的标签数组，每行为 class, x_center, y_center, width, height
         """
-        with json_file.open('r', encoding='utf-8') as f:
-            data = json.load(f)
+        data = load_labelme_json(json_file)  # 不解析 imageData
 
         # 获取图像尺寸
         image_width = data.get('imageWidth', None)
@@ -91,6 +117,7 @@ class LabelmeToYOLO:
         txt_filename = json_file.stem + '.txt'
         txt_path = json_file.parent / txt_filename
 
+        rows = []
         with txt_path.open('w', encoding='utf-8') as txt_file:
             for shape in data.get('shapes', []):
                 label = shape.get('label', '').strip()
@@ -100,11 +127,11 @@ class LabelmeToYOLO:
                     print(f"警告: 文件 {json_file} 包含非矩形标注 '{shape_type}'，已跳过。")
                     continue
 
-                if label not in self.labels:
+                idx = self.category_registry.get(label)
+                if idx is None:
                     print(f"警告: 标签 '{label}' 不在标签列表中，已忽略。")
                     continue
 
-                idx = self.labels.index(label)
                 points = shape.get('points', [])
 
                 if len(points) != 2:
@@ -114,9 +141,13 @@ class LabelmeToYOLO:
                 x_center, y_center, w, h = self.points_to_yolo_bbox(points, image_width, image_height)
 
                 # 写入 YOLO 格式: <object-class> <x_center> <y_center> <width> <height>
-                idx = 0
+                if self.single_class:
+                    idx = 0
                 annotation = f"{idx} {x_center:.6f} {y_center:.6f} {w:.6f} {h:.6f}\n"
                 txt_file.write(annotation)
+                rows.append((idx, x_center, y_center, w, h))
+
+        return np.array(rows, dtype=np.float32).reshape(-1, 5)
 
     def points_to_yolo_bbox(self, points: list, image_width: int, image_height: int) -> tuple:
         """
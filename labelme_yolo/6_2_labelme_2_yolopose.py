@@ -1,7 +1,12 @@
-import json
 import os
 import glob
 
+# labelme2coco 来自本仓库的 labelme2coco_master，运行前在仓库根目录执行：pip install -e labelme2coco_master
+from labelme2coco.labelme_io import load_labelme_json
+from labelme2coco.pose import group_instances, keypoint_index, unknown_shapes
+from labelme2coco.yolo_cache import LABEL_CACHE_NAME, label_cache_sources, write_label_cache
+from labelme2coco.yolo_labels import LabelWriterPool, format_label_rows, pose_label_rows
+
 # 定义关键点的顺序
 KEYPOINTS_ORDER = [
     "L_Eye",
@@ -25,13 +30,20 @@ KEYPOINTS_ORDER = [
     "L_B_Paw",
     "R_B_Paw"
 ]
+KEYPOINTS_INDEX = keypoint_index(KEYPOINTS_ORDER)
+
 
+def convert_labelme_to_yolo_multiple(json_file, output_txt_path, writer=None, precision=6):
+    """
+    将单个 LabelMe JSON 转换为 YOLO 姿态 TXT 文件
 
-def convert_labelme_to_yolo_multiple(json_file, output_txt_path):
+    :param writer: LabelWriterPool，为 None 时直接写入 TXT 文件
+    :param precision: 坐标保留的小数位数
+    :return: (N, 5 + 3K) 的标签数组，转换失败时返回 None
+    """
     try:
-        # 读取JSON文件
-        with open(json_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        # 读取JSON文件（不解析 imageData）
+        data = load_labelme_json(json_file)
 
         image_width = data.get('imageWidth')
         image_height = data.get('imageHeight')
@@ -45,102 +57,82 @@ def convert_labelme_to_yolo_multiple(json_file, output_txt_path):
 
         shapes = data.get('shapes', [])
 
-        # 初始化列表以存储所有对象的YOLO行
-        yolo_lines = []
-
-        i = 0
-        while i < len(shapes):
-            shape = shapes[i]
-            if shape.get('label') == 'horse' and shape.get('shape_type') == 'rectangle':
-                # 提取边界框
-                coords = shape.get('points', [])
-                if len(coords) != 2:
-                    print(f"警告: 文件 '{json_file}' 中的 'horse' 边界框点数不正确。")
-                    i += 1
-                    continue
-
-                x_min = min(coord[0] for coord in coords)
-                y_min = min(coord[1] for coord in coords)
-                x_max = max(coord[0] for coord in coords)
-                y_max = max(coord[1] for coord in coords)
-                bounding_box = (x_min, y_min, x_max, y_max)
-
-                # 计算边界框的中心坐标和宽高，归一化
-                box_center_x = (x_min + x_max) / 2 / image_width
-                box_center_y = (y_min + y_max) / 2 / image_height
-                box_width = (x_max - x_min) / image_width
-                box_height = (y_max - y_min) / image_height
-
-                # 初始化关键点字典
-                keypoints_dict = {kp: (0, 0, 0) for kp in KEYPOINTS_ORDER}
-
-                # 处理当前"horse"后的关键点，直到下一个"horse"或结束
-                i += 1
-                while i < len(shapes) and not (
-                        shapes[i].get('label') == 'horse' and shapes[i].get('shape_type') == 'rectangle'):
-                    kp_shape = shapes[i]
-                    if kp_shape.get('shape_type') == 'point' and kp_shape.get('label') in keypoints_dict:
-                        kp_points = kp_shape.get('points', [])
-                        if len(kp_points) != 1:
-                            print(f"警告: 文件 '{json_file}' 中的关键点 '{kp_shape.get('label')}' 点数不正确。")
-                            i += 1
-                            continue
-                        x, y = kp_points[0]
-                        keypoints_dict[kp_shape.get('label')] = (x / image_width, y / image_height, 2)  # 归一化并设为可见
-                    else:
-                        print(f"警告: 文件 '{json_file}' 中的未知关键点标签 '{kp_shape.get('label')}' 被忽略。")
-                    i += 1
-
-                # 构建YOLO行
-                class_id = 0  # 类别ID为0，您可以根据需要修改
-                yolo_line = f"{class_id} {box_center_x:.6f} {box_center_y:.6f} {box_width:.6f} {box_height:.6f}"
-
-                # 添加关键点信息
-                for kp in KEYPOINTS_ORDER:
-                    x, y, visibility = keypoints_dict[kp]
-                    if visibility == 2:
-                        yolo_line += f" {x:.6f} {y:.6f} {visibility}"
-                    else:
-                        yolo_line += " 0 0 0"
-
-                yolo_lines.append(yolo_line)
-            else:
-                i += 1  # 如果不是"horse"的边界框，继续下一个
-
-        if not yolo_lines:
+        # 按 group_id 或位置把关键点分配给 'horse' 框，与标注顺序无关
+        instances, unassigned, ambiguous = group_instances(shapes, KEYPOINTS_INDEX, box_labels={'horse'},
+                                                           require_box=True)
+        for kp_shape in unassigned:
+            print(f"警告: 文件 '{json_file}' 中的关键点 '{kp_shape['label']}' 不属于任何 'horse' 框，已忽略。")
+        for kp_shape in unknown_shapes(shapes, KEYPOINTS_INDEX, box_labels={'horse'}):
+            print(f"警告: 文件 '{json_file}' 中的未知关键点标签 '{kp_shape['label']}' 被忽略。")
+        for kp_shape in ambiguous:
+            print(f"警告: 文件 '{json_file}' 中的关键点 '{kp_shape['label']}' {kp_shape['points'][0]} "
+                  f"位于多个 'horse' 框附近，请检查归属。")
+
+        # 每个实例一行: 类别ID、归一化的边界框中心坐标和宽高、每个关键点的 x, y, visibility
+        class_id = 0  # 类别ID为0，您可以根据需要修改
+        yolo_rows = pose_label_rows(instances, image_width, image_height, len(KEYPOINTS_ORDER), class_id=class_id)
+
+        if not len(yolo_rows):
             print(f"警告: 文件 '{json_file}' 中未检测到任何 'horse' 对象。")
 
+        # 一次格式化整张图像的标签，未标注的关键点写为 "0 0 0"
+        text = format_label_rows(yolo_rows, len(KEYPOINTS_ORDER), precision=precision)
+
         # 写入TXT文件
-        with open(output_txt_path, 'w', encoding='utf-8') as txt_file:
-            for line in yolo_lines:
-                txt_file.write(line + '\n')
+        if writer is not None:
+            writer.write(output_txt_path, text)
+        else:
+            with open(output_txt_path, 'w', encoding='utf-8') as txt_file:
+                txt_file.write(text)
 
         print(f"转换成功: {output_txt_path}")
+        return yolo_rows
 
     except Exception as e:
         print(f"错误: 转换文件 '{json_file}' 时发生异常: {e}")
 
 
-def convert_labelme_to_yolo_dataset(root_json_dir, root_output_dir):
-    # 使用 os.walk 递归遍历所有子目录
-    for dirpath, _, filenames in os.walk(root_json_dir):
-        for filename in filenames:
-            if filename.lower().endswith('.json'):
-                json_file_path = os.path.join(dirpath, filename)
-
-                # 构建相对于根目录的相对路径
-                relative_path = os.path.relpath(dirpath, root_json_dir)
-
-                # 构建输出TXT文件的目录
-                output_dir = os.path.join(root_output_dir, relative_path)
-                os.makedirs(output_dir, exist_ok=True)
-
-                # 构建输出TXT文件的完整路径
-                txt_filename = os.path.splitext(filename)[0] + '.txt'
-                output_txt_path = os.path.join(output_dir, txt_filename)
-
-                # 进行转换
-                convert_labelme_to_yolo_multiple(json_file_path, output_txt_path)
+def convert_labelme_to_yolo_dataset(root_json_dir, root_output_dir, label_cache=True, precision=6, writers=4):
+    """
+    :param label_cache: 在每个输出目录中写入二进制标签缓存 labels.yolocache，
+        训练和检查时可以直接内存映射读取，而不必解析每个 TXT 文件
+    :param precision: 坐标保留的小数位数
+    :param writers: 写 TXT 文件的线程数，写文件与下一个 JSON 的转换并行
+    """
+    with LabelWriterPool(workers=writers) as writer:
+        # 使用 os.walk 递归遍历所有子目录
+        for dirpath, _, filenames in os.walk(root_json_dir):
+            # 在读取 JSON 之前记录源文件的名称、大小和修改时间，转换期间被修改的文件会使缓存失效
+            sources = label_cache_sources(dirpath) if label_cache else None
+            output_dir = None
+            cache_names = []
+            cache_labels = []
+            for filename in filenames:
+                if filename.lower().endswith('.json'):
+                    json_file_path = os.path.join(dirpath, filename)
+
+                    # 构建相对于根目录的相对路径
+                    relative_path = os.path.relpath(dirpath, root_json_dir)
+
+                    # 构建输出TXT文件的目录
+                    output_dir = os.path.join(root_output_dir, relative_path)
+                    os.makedirs(output_dir, exist_ok=True)
+
+                    # 构建输出TXT文件的完整路径
+                    txt_filename = os.path.splitext(filename)[0] + '.txt'
+                    output_txt_path = os.path.join(output_dir, txt_filename)
+
+                    # 进行转换
+                    labels = convert_labelme_to_yolo_multiple(json_file_path, output_txt_path, writer, precision)
+                    if labels is not None:
+                        cache_names.append(os.path.splitext(filename)[0])
+                        cache_labels.append(labels)
+
+            # 每个子目录（数据集划分）一个缓存文件
+            if label_cache and output_dir is not None:
+                cache_path = write_label_cache(os.path.join(output_dir, LABEL_CACHE_NAME), cache_names, cache_labels,
+                                               sources, num_keypoints=len(KEYPOINTS_ORDER))
+                print(f"标签缓存已写入: {cache_path}")
 
     print("所有JSON文件已转换完成。")
 
@@ -1,10 +1,16 @@
 import os
 import cv2
+import numpy as np
+
+# labelme2coco 来自本仓库的 labelme2coco_master，运行前在仓库根目录执行：pip install -e labelme2coco_master
+from labelme2coco.yolo_cache import LABEL_CACHE_NAME, load_label_cache
 
 # 配置参数
 IMAGE_DIR = r'E:\SUBPJ\GIO\aiba\dataset\pose\0_horse\yolo\images\test'         # 图像目录
 ANNOTATION_DIR = r'E:\SUBPJ\GIO\aiba\dataset\pose\0_horse\yolo\labels\test'  # 标注文件目录
 OUTPUT_DIR = r'E:\SUBPJ\GIO\aiba\dataset\pose\0_horse\yolo\check'        # 输出目录
+LABEL_CACHE_PATH = os.path.join(ANNOTATION_DIR, LABEL_CACHE_NAME)  # 转换脚本写入的二进制标签缓存
+VERIFY_LABEL_CACHE = True  # 检查生成缓存的 JSON 文件是否未改变；JSON 不在本机时设为 False
 
 # 创建输出目录（如果不存在）
 os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -45,46 +51,48 @@ def yolo_to_bbox(x_center, y_center, width, height, img_width, img_height):
 
     return x1, y1, x2, y2
 
-def draw_annotations(image, annotation_file):
+def read_annotations(annotation_file):
     """
-    在图像上绘制标注信息。
+    读取 YOLO 姿态 TXT 文件，返回指定类别的边界框 (N, 4) 和关键点 (N, K, 3)。
     """
     with open(annotation_file, 'r') as file:
         lines = file.readlines()
 
-    img_height, img_width = image.shape[:2]
-
+    boxes = []
+    keypoints = []
     for line in lines:
         parts = line.strip().split()
         if not parts or parts[0] != CLASS_ID:
             continue  # 只处理指定类别 ID 的标注
 
-        # 解析边界框
-        x_center = float(parts[1])
-        y_center = float(parts[2])
-        width = float(parts[3])
-        height = float(parts[4])
+        # 每个关键点有三个值：x, y, visibility
+        values = [float(value) for value in parts[1:]]
+        boxes.append(values[:4])
+        keypoints.append(values[4:4 + 3 * ((len(values) - 4) // 3)])
+
+    num_keypoints = min([len(values) // 3 for values in keypoints], default=0)
+    keypoints = [values[:3 * num_keypoints] for values in keypoints]
+    return np.array(boxes).reshape(-1, 4), np.array(keypoints).reshape(len(boxes), num_keypoints, 3)
+
+
+def draw_annotations(image, boxes, keypoints):
+    """
+    在图像上绘制标注信息。
+
+    :param boxes: (N, 4) 归一化的 x_center, y_center, width, height
+    :param keypoints: (N, K, 3) 归一化的 x, y, visibility
+    """
+    img_height, img_width = image.shape[:2]
 
-        x1, y1, x2, y2 = yolo_to_bbox(x_center, y_center, width, height, img_width, img_height)
+    for box, box_keypoints in zip(boxes, keypoints):
+        x1, y1, x2, y2 = yolo_to_bbox(*map(float, box), img_width, img_height)
 
         # 绘制边界框
         cv2.rectangle(image, (x1, y1), (x2, y2), BOX_COLOR, 2)
 
-        # 解析并绘制关键点
-        # 每个关键点有三个值：x, y, visibility
-        # YOLO 格式中的坐标是相对于图像宽高的比例
-        keypoints = parts[5:]
-        num_keypoints = 20
-        for i in range(num_keypoints):
-            idx = i * 3
-            if idx + 2 >= len(keypoints):
-                break  # 防止索引超出
-
-            x = float(keypoints[idx])
-            y = float(keypoints[idx + 1])
-            visibility = keypoints[idx + 2]
-
-            if visibility != '0':
+        # 绘制关键点，YOLO 格式中的坐标是相对于图像宽高的比例
+        for i, (x, y, visibility) in enumerate(box_keypoints[:len(KEYPOINT_NAMES)]):
+            if visibility != 0:
                 px = int(x * img_width)
                 py = int(y * img_height)
                 cv2.circle(image, (px, py), 3, POINT_COLOR, -1)
@@ -93,16 +101,31 @@ def draw_annotations(image, annotation_file):
     return image
 
 def main():
+    # 有未过期的标签缓存时直接内存映射读取，否则逐个解析 TXT 文件
+    label_cache = load_label_cache(LABEL_CACHE_PATH, verify=VERIFY_LABEL_CACHE)
+    if label_cache is not None:
+        print(f"使用标签缓存: {LABEL_CACHE_PATH}")
+
     # 遍历图像目录中的所有图像文件
     for filename in os.listdir(IMAGE_DIR):
         if not filename.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')):
             continue  # 跳过非图像文件
 
         image_path = os.path.join(IMAGE_DIR, filename)
-        annotation_filename = os.path.splitext(filename)[0] + '.txt'
-        annotation_path = os.path.join(ANNOTATION_DIR, annotation_filename)
-
-        if not os.path.exists(annotation_path):
+        annotation_name = os.path.splitext(filename)[0]
+        annotation_path = os.path.join(ANNOTATION_DIR, annotation_name + '.txt')
+
+        if label_cache is not None:
+            try:
+                labels = label_cache.labels(label_cache.index(annotation_name))
+            except KeyError:
+                print(f"标注文件不存在: {annotation_path}")
+                continue
+            selected = labels['class'] == int(CLASS_ID)
+            boxes, keypoints = labels['box'][selected], labels['keypoints'][selected]
+        elif os.path.exists(annotation_path):
+            boxes, keypoints = read_annotations(annotation_path)
+        else:
             print(f"标注文件不存在: {annotation_path}")
             continue
 
@@ -113,7 +136,7 @@ def main():
             continue
 
         # 绘制标注
-        annotated_image = draw_annotations(image, annotation_path)
+        annotated_image = draw_annotations(image, boxes, keypoints)
 
         # 保存结果
         output_path = os.path.join(OUTPUT_DIR, filename)